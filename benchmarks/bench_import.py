@@ -0,0 +1,68 @@
+'''
+Import-time benchmark for the client and server halves of coopapi.
+
+Each import runs in a fresh interpreter under -X importtime. The run fails (exit code 1) if a client-side module
+pulls in a server-side dependency, so CLI tools that only make requests never pay for fastapi.
+
+    python -m benchmarks.bench_import --repeat 5
+'''
+import argparse
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+SERVER_MODULES = ('fastapi', 'starlette', 'pydantic')
+
+'''module to import, and whether it may load the server-side dependencies'''
+IMPORTS = (
+    ('coopapi', False),
+    ('coopapi.http_request', False),
+    ('coopapi.payload_logging', False),
+    ('coopapi.apiShell', True),
+)
+
+_PROBE = "import sys, {module}; print(','.join(m for m in {server} if m in sys.modules))"
+
+
+def _import_once(module: str) -> Tuple[float, List[str]]:
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', _PROBE.format(module=module, server=SERVER_MODULES)],
+                          capture_output=True, text=True, check=True)
+    # the last importtime line for the module is its cumulative time, in microseconds
+    cumulative = [int(line.split('|')[1]) for line in proc.stderr.splitlines()
+                  if line.startswith('import time:') and line.split('|')[2].strip() == module]
+    loaded = [x for x in proc.stdout.strip().split(',') if x]
+    return cumulative[-1] / 1000 if cumulative else 0.0, loaded
+
+
+def bench_imports(repeat: int) -> Dict[str, Dict]:
+    results = {}
+    for module, server_allowed in IMPORTS:
+        times = []
+        loaded = []
+        for _ in range(repeat):
+            ms, loaded = _import_once(module)
+            times.append(ms)
+        results[module] = {'median_ms': statistics.median(times),
+                           'server_modules': loaded,
+                           'ok': server_allowed or not loaded}
+    return results
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=3, help='fresh interpreters per import')
+    args = parser.parse_args(argv)
+
+    results = bench_imports(args.repeat)
+    print(f"{'module':30} {'median ms':>10}  server modules loaded")
+    for module, r in results.items():
+        flag = '' if r['ok'] else '  <-- client import loads server dependencies'
+        print(f"{module:30} {r['median_ms']:10.1f}  {','.join(r['server_modules']) or '-'}{flag}")
+
+    if not all(r['ok'] for r in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
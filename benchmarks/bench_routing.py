@@ -0,0 +1,134 @@
+'''
+Route matching benchmark for apps with many shells.
+
+Builds apps with 10/100/1000 shells, once with app.include_router for each shell and once through a ShellRegistry, and
+times requests to shells spread across the app: the route matching alone (what Starlette's router does before calling
+an endpoint), and a whole GET one request over ASGI.
+
+    python -m benchmarks.bench_routing --requests 2000
+'''
+import argparse
+import asyncio
+import contextlib
+import io
+import random
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+from fastapi import FastAPI
+from starlette.routing import Match
+
+from coopapi import ApiShell, ShellRegistry
+from examples.dummySchema import DummySchema
+from benchmarks.bench_shell import _percentile
+
+SHELL_COUNTS = (10, 100, 1000)
+
+
+def _getone(request, id):
+    return DummySchema(id=id, desc='dummy', active=True)
+
+
+def _shells(n: int) -> List[ApiShell]:
+    # ApiShell prints as each one registers its routes
+    with contextlib.redirect_stdout(io.StringIO()):
+        return [ApiShell(target_schema=DummySchema,
+                         base_route=f'/resource{i}',
+                         on_getone_callback=_getone,
+                         on_post_callback=lambda request, item: item,
+                         on_put_callback=lambda request, id, update_values: DummySchema(id=id, **update_values),
+                         on_delete_callback=lambda request, id: True,
+                         on_getmany_callback=lambda request, query, limit: [],
+                         dirty_create=lambda d: {k: v[0] for k, v in d.items()})
+                for i in range(n)]
+
+
+def build_included(n: int) -> FastAPI:
+    app = FastAPI()
+    for shell in _shells(n):
+        app.include_router(shell.router)
+    return app
+
+
+def build_registry(n: int) -> FastAPI:
+    app = FastAPI()
+    ShellRegistry(_shells(n)).mount(app)
+    return app
+
+
+def _scope(path: str) -> Dict:
+    return {'type': 'http', 'method': 'GET', 'path': path, 'root_path': '', 'query_string': b'', 'headers': [],
+            'http_version': '1.1', 'scheme': 'http', 'server': ('bench', 80), 'client': ('bench', 1)}
+
+
+def _match(app: FastAPI, scope: Dict):
+    # the loop Starlette's Router runs for each request
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route
+    raise LookupError(scope['path'])
+
+
+async def _request(app: FastAPI, scope: Dict) -> int:
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        sent.append(message)
+
+    await app(dict(scope), receive, send)
+    return sent[0]['status']
+
+
+def _timed(fn: Callable[[], None], n: int) -> Tuple[float, float]:
+    latencies = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t0)
+    latencies.sort()
+    return _percentile(latencies, 50) * 1e6, _percentile(latencies, 99) * 1e6
+
+
+def bench(n_shells: int, n_requests: int) -> Dict[str, Dict[str, float]]:
+    rnd = random.Random(n_shells)
+    scopes = [_scope(f'/resource{rnd.randrange(n_shells)}/api/{i}') for i in range(n_requests)]
+    loop = asyncio.new_event_loop()
+    ret = {}
+    for mode, build in (('include_router', build_included), ('registry', build_registry)):
+        t0 = time.perf_counter()
+        app = build(n_shells)
+        build_s = time.perf_counter() - t0
+        it = iter(scopes * 2)
+        match_p50, match_p99 = _timed(lambda: _match(app, next(it)), n_requests)
+
+        def request():
+            status = loop.run_until_complete(_request(app, next(it)))
+            assert status == 200, status
+        req_p50, req_p99 = _timed(request, n_requests)
+        ret[mode] = {'build_s': build_s, 'match_p50_us': match_p50, 'match_p99_us': match_p99,
+                     'request_p50_us': req_p50, 'request_p99_us': req_p99}
+    loop.close()
+    return ret
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=1000, help='requests per app')
+    parser.add_argument('--shells', type=int, nargs='*', default=SHELL_COUNTS, help='shell counts to build apps with')
+    args = parser.parse_args(argv)
+
+    print(f"{'shells':>6} {'mode':15} {'build s':>8} {'match p50 us':>13} {'match p99 us':>13} "
+          f"{'request p50 us':>15} {'request p99 us':>15}")
+    for n in args.shells:
+        for mode, r in bench(n, args.requests).items():
+            print(f"{n:6} {mode:15} {r['build_s']:8.2f} {r['match_p50_us']:13.1f} {r['match_p99_us']:13.1f} "
+                  f"{r['request_p50_us']:15.1f} {r['request_p99_us']:15.1f}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,184 @@
+'''
+In-process benchmarks for ApiShell routes and the http_request client.
+
+The shell is served over httpx's ASGI transport (no sockets) around examples.dummySchema.DummySchema with an
+InMemoryStore backend, so the numbers reflect coopapi + FastAPI overhead rather than a database. The client numbers
+come from coopapi.http_request against a local stand-in server.
+
+    python -m benchmarks.bench_shell --requests 2000 --out bench.json
+    python -m benchmarks.bench_shell --compare bench.json
+'''
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import threading
+import time
+from dataclasses import dataclass, asdict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Awaitable, Callable, Dict, List
+
+import httpx
+from fastapi import FastAPI
+
+from coopapi import ApiShell, InMemoryStore
+from coopapi import http_request
+from examples.dummySchema import DummySchema
+
+
+@dataclass
+class BenchResult:
+    name: str
+    requests: int
+    seconds: float
+    rps: float
+    p50_ms: float
+    p99_ms: float
+    payload_bytes: int
+
+
+def _percentile(sorted_vals: List[float], p: float) -> float:
+    idx = min(len(sorted_vals) - 1, max(0, int(round(p / 100 * len(sorted_vals))) - 1))
+    return sorted_vals[idx]
+
+def _result(name: str, latencies: List[float], seconds: float, payload_bytes: int) -> BenchResult:
+    latencies = sorted(latencies)
+    return BenchResult(name=name,
+                       requests=len(latencies),
+                       seconds=round(seconds, 4),
+                       rps=round(len(latencies) / seconds, 1),
+                       p50_ms=round(_percentile(latencies, 50) * 1000, 3),
+                       p99_ms=round(_percentile(latencies, 99) * 1000, 3),
+                       payload_bytes=payload_bytes)
+
+
+def _dummy(i: int) -> DummySchema:
+    return DummySchema(id=f"{i:08d}", desc=f"dummy number {i}", active=i % 2 == 0)
+
+
+def build_app(seed: int, **shell_kwargs) -> FastAPI:
+    store = InMemoryStore(DummySchema, hash_indexes=['active'])
+    for i in range(seed):
+        store.add(_dummy(i))
+    shell_kwargs = {**store.callbacks(), **shell_kwargs}
+    shell = ApiShell(target_schema=DummySchema,
+                     base_route='/dummy',
+                     dirty_create=lambda d: {k: v[0] for k, v in d.items()},
+                     **shell_kwargs)
+    app = FastAPI()
+    app.include_router(shell.router)
+    return app
+
+
+async def _run(name: str, n: int, send: Callable[[int], Awaitable[httpx.Response]]) -> BenchResult:
+    latencies = []
+    payload = 0
+    start = time.perf_counter()
+    for i in range(n):
+        t0 = time.perf_counter()
+        response = await send(i)
+        latencies.append(time.perf_counter() - t0)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{name} request {i} failed [{response.status_code}]: {response.text}")
+        payload = len(response.content)
+    return _result(name, latencies, time.perf_counter() - start, payload)
+
+
+async def bench_shell(n: int, getmany_limits=(10, 100, 1000), **shell_kwargs) -> List[BenchResult]:
+    seed = max(getmany_limits) + n
+    app = build_app(seed=seed, **shell_kwargs)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://bench') as client:
+        results = [
+            await _run('POST', n, lambda i: client.post('/dummy/api/', json=asdict(_dummy(seed + i)))),
+            await _run('GET one', n, lambda i: client.get(f'/dummy/api/{i:08d}')),
+        ]
+        for limit in getmany_limits:
+            results.append(await _run(f'GET many limit={limit}', max(1, n // 10),
+                                      lambda i: client.get('/dummy/api/', params={'limit': limit})))
+        results += [
+            await _run('PUT', n, lambda i: client.put(f'/dummy/api/{i:08d}', json={'desc': f'updated {i}'})),
+            await _run('DELETE', n, lambda i: client.delete(f'/dummy/api/{i:08d}')),
+            await _run('dirty POST', n, lambda i: client.post('/dummy/dirty/',
+                                                              json=f"id=d{i:08d}&desc=dirty%20{i}&active=true")),
+        ]
+    return results
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    body = json.dumps([asdict(_dummy(i)) for i in range(10)]).encode()
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def bench_client(n: int) -> List[BenchResult]:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/dummy/api/'
+    try:
+        latencies = []
+        start = time.perf_counter()
+        for i in range(n):
+            t0 = time.perf_counter()
+            response = http_request.get(url)
+            latencies.append(time.perf_counter() - t0)
+        return [_result('client GET', latencies, time.perf_counter() - start, len(response.content))]
+    finally:
+        server.shutdown()
+
+
+def run(n: int) -> Dict:
+    results = asyncio.run(bench_shell(n)) + bench_client(n)
+    return {'meta': {'python': platform.python_version(),
+                     'platform': platform.platform(),
+                     'requests': n,
+                     'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')},
+            'results': [asdict(x) for x in results]}
+
+
+def compare(current: Dict, baseline: Dict) -> str:
+    base = {x['name']: x for x in baseline['results']}
+    lines = [f"{'benchmark':<24}{'rps':>10}{'base rps':>10}{'change':>9}{'p99 ms':>10}{'base p99':>10}"]
+    for x in current['results']:
+        b = base.get(x['name'])
+        if b is None:
+            lines.append(f"{x['name']:<24}{x['rps']:>10}{'-':>10}{'-':>9}{x['p99_ms']:>10}{'-':>10}")
+            continue
+        change = (x['rps'] - b['rps']) / b['rps'] * 100 if b['rps'] else 0
+        lines.append(f"{x['name']:<24}{x['rps']:>10}{b['rps']:>10}{change:>8.1f}%{x['p99_ms']:>10}{b['p99_ms']:>10}")
+    return '\n'.join(lines)
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=1000, help='requests per benchmark')
+    parser.add_argument('--out', help='write results as JSON to this path')
+    parser.add_argument('--compare', help='a previous --out file to compare against')
+    args = parser.parse_args(argv)
+
+    current = run(args.requests)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(current, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(current, json.load(f)))
+    else:
+        for x in current['results']:
+            print(f"{x['name']:<24}{x['rps']:>10} rps  p50 {x['p50_ms']:>8} ms  p99 {x['p99_ms']:>8} ms  "
+                  f"{x['payload_bytes']:>8} B")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
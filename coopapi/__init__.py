@@ -1,8 +1,67 @@
-from coopapi.apiShell import ApiShell
-from coopapi.http_request_handlers import getOneRequestCallback, \
-    postRequestCallback, \
-    deleteRequestCallback, \
-    putRequestCallback, \
-    jsonRequestCallback, \
-    getManyRequestCallback
-from coopapi.errors import DuplicateException, NotFoundException
\ No newline at end of file
+'''
+Public names are imported on first access, so `import coopapi.http_request` (the client side, needing only requests)
+does not pull in fastapi, pydantic and starlette for the server side
+'''
+import importlib
+import importlib.util
+
+_exports = {
+    'ApiShell': 'coopapi.apiShell',
+    'in_executor': 'coopapi.apiShell',
+    'AdmissionControl': 'coopapi.admission',
+    'AdmissionLimit': 'coopapi.admission',
+    'WriteBehind': 'coopapi.write_behind',
+    'ResponseCache': 'coopapi.cache',
+    'CacheBackend': 'coopapi.cache',
+    'LruTtlCacheBackend': 'coopapi.cache',
+    'SingleFlight': 'coopapi.coalesce',
+    'ChangeFeed': 'coopapi.change_feed',
+    'ConditionalGet': 'coopapi.conditional',
+    'PayloadLogConfig': 'coopapi.payload_logging',
+    'RouteMetrics': 'coopapi.metrics',
+    'Tracer': 'coopapi.tracing',
+    'RingBufferExporter': 'coopapi.tracing',
+    'JsonlExporter': 'coopapi.tracing',
+    'InMemoryStore': 'coopapi.memory_backend',
+    'ShellRegistry': 'coopapi.registry',
+    'getOneRequestCallback': 'coopapi.http_request_handlers',
+    'postRequestCallback': 'coopapi.http_request_handlers',
+    'deleteRequestCallback': 'coopapi.http_request_handlers',
+    'putRequestCallback': 'coopapi.http_request_handlers',
+    'patchRequestCallback': 'coopapi.http_request_handlers',
+    'jsonRequestCallback': 'coopapi.http_request_handlers',
+    'getManyRequestCallback': 'coopapi.http_request_handlers',
+    'asyncGetOneRequestCallback': 'coopapi.http_request_handlers',
+    'asyncPostRequestCallback': 'coopapi.http_request_handlers',
+    'asyncDeleteRequestCallback': 'coopapi.http_request_handlers',
+    'asyncPutRequestCallback': 'coopapi.http_request_handlers',
+    'asyncPatchRequestCallback': 'coopapi.http_request_handlers',
+    'asyncGetManyRequestCallback': 'coopapi.http_request_handlers',
+    'postManyRequestCallback': 'coopapi.http_request_handlers',
+    'putManyRequestCallback': 'coopapi.http_request_handlers',
+    'deleteManyRequestCallback': 'coopapi.http_request_handlers',
+    'getManyByIdsRequestCallback': 'coopapi.http_request_handlers',
+    'getManyStreamRequestCallback': 'coopapi.http_request_handlers',
+    'DuplicateException': 'coopapi.errors',
+    'NotFoundException': 'coopapi.errors',
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name: str):
+    try:
+        module = _exports[name]
+    except KeyError:
+        # submodules, eg coopapi.http_request_handlers, which used to be loaded by importing coopapi
+        if not name.startswith('_') and importlib.util.find_spec(f'coopapi.{name}') is not None:
+            return importlib.import_module(f'coopapi.{name}')
+        raise AttributeError(f"module 'coopapi' has no attribute '{name}'") from None
+    value = getattr(importlib.import_module(module), name)
+    # cache it, so later lookups don't come back through here
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_exports))
@@ -0,0 +1,191 @@
+import asyncio
+import functools
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import AsyncIterable, Callable, Deque, Dict, List
+from fastapi import HTTPException, status
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
+from coopapi.metrics import prometheus_labels
+from coopapi.tracing import add_span
+from coopapi.utils import is_async
+
+logger = logging.getLogger('Admission')
+
+SHELL = '*'
+
+
+@dataclass(frozen=True)
+class AdmissionLimit:
+    '''
+    At most max_in_flight requests run at once. Up to max_queue more wait, each for at most queue_timeout_s, for a
+    slot to free up; anything beyond that is turned away straight away with reject_status (503, or 429 when the
+    limit is a per-client quota rather than protection for the backend) and a Retry-After of retry_after_s
+    '''
+    max_in_flight: int
+    max_queue: int = 0
+    queue_timeout_s: float = 1.0
+    retry_after_s: int = 1
+    reject_status: int = status.HTTP_503_SERVICE_UNAVAILABLE
+
+
+class Gate:
+    '''FIFO admission for one AdmissionLimit. Only used from the event loop thread'''
+    def __init__(self, name: str, limit: AdmissionLimit):
+        self.name = name
+        self.limit = limit
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _reject(self, reason: str):
+        msg = f"{self.name} is over capacity ({reason}), retry after {self.limit.retry_after_s}s"
+        logger.warning(msg)
+        raise HTTPException(status_code=self.limit.reject_status,
+                            detail=msg,
+                            headers={'Retry-After': str(self.limit.retry_after_s)})
+
+    async def acquire(self):
+        if self.in_flight < self.limit.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return
+
+        if len(self._waiters) >= self.limit.max_queue:
+            self.rejected += 1
+            self._reject('queue full')
+
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await asyncio.wait_for(fut, self.limit.queue_timeout_s)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if fut.done() and not fut.cancelled():
+                # the slot was handed over just as we gave up on it, pass it on
+                self.release()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.timed_out += 1
+            self._reject('timed out waiting in queue')
+        finally:
+            try:
+                self._waiters.remove(fut)
+            except ValueError:
+                pass
+        self.admitted += 1
+
+    def release(self):
+        # hand the slot straight to the oldest waiter, so in_flight only drops when nobody is queued
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self) -> Dict[str, int]:
+        return {'in_flight': self.in_flight, 'queued': self.queued, 'admitted': self.admitted,
+                'rejected': self.rejected, 'timed_out': self.timed_out}
+
+
+class AdmissionControl:
+    '''
+    Admission control for an ApiShell's routes. `shell` bounds all of the shell's requests together and `verbs` bounds
+    each HTTP method separately (eg, {'POST': AdmissionLimit(max_in_flight=8, max_queue=32)}); a request has to get
+    through its verb's gate and then the shell's. Either may be left out
+    '''
+    def __init__(self, shell: AdmissionLimit = None, verbs: Dict[str, AdmissionLimit] = None):
+        self.shell = shell
+        self.verbs = {k.upper(): v for k, v in (verbs or {}).items()}
+        self._gates: Dict[str, Gate] = {}
+
+    def gates(self, name: str, method: str) -> List[Gate]:
+        '''The gates a request of this method goes through. Gates are shared by every route of the same verb'''
+        ret = []
+        for key, limit in ((method.upper(), self.verbs.get(method.upper())), (SHELL, self.shell)):
+            if limit is None:
+                continue
+            if key not in self._gates:
+                self._gates[key] = Gate(name=f"{name} {key}" if key != SHELL else name, limit=limit)
+            ret.append(self._gates[key])
+        return ret
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {k: g.stats() for k, g in self._gates.items()}
+
+    def render_prometheus(self, shell: str, prefix: str = 'coopapi') -> str:
+        return render_prometheus_gates({shell: self}, prefix)
+
+
+def render_prometheus_gates(controls: Dict[str, AdmissionControl], prefix: str = 'coopapi') -> str:
+    '''The gates of each shell's AdmissionControl, keyed by shell, with each metric family written once'''
+    lines = []
+    for stat, kind, help_txt in (('in_flight', 'gauge', 'Requests currently admitted'),
+                                 ('queued', 'gauge', 'Requests waiting for admission'),
+                                 ('rejected', 'counter', 'Requests turned away because the queue was full'),
+                                 ('timed_out', 'counter', 'Requests turned away after waiting in the queue')):
+        name = f"{prefix}_admission_{stat}" + ('_total' if kind == 'counter' else '')
+        lines += [f"# HELP {name} {help_txt}", f"# TYPE {name} {kind}"]
+        for shell, control in sorted(controls.items()):
+            for key, gate in sorted(control._gates.items()):
+                lines.append(f'{name}{prometheus_labels(shell=shell, verb=key)} {getattr(gate, stat)}')
+    return '\n'.join(lines) + '\n'
+
+
+def _release(gates: List[Gate]):
+    for gate in reversed(gates):
+        gate.release()
+
+
+async def _releasing(body: AsyncIterable, gates: List[Gate]):
+    '''A streamed body that gives up its request's slots once it has been sent, or has failed or been abandoned'''
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        _release(gates)
+        if hasattr(body, 'aclose'):
+            await body.aclose()
+
+
+def admitted_endpoint(endpoint: Callable, gates: List[Gate]) -> Callable:
+    '''
+    Wrap a route endpoint so that it only runs once its gates admit it. The wrapper is always async, as waiting in the
+    queue must not hold a threadpool thread; sync endpoints are run on the threadpool once admitted, as FastAPI would.
+    A request holds its slots until its response is ready, or for a StreamingResponse, until the body has been sent
+    '''
+    if is_async(endpoint):
+        run = endpoint
+    else:
+        async def run(*args, **kwargs):
+            return await run_in_threadpool(endpoint, *args, **kwargs)
+
+    @functools.wraps(endpoint)
+    async def admitted(*args, **kwargs):
+        held = []
+        streamed = False
+        try:
+            start = time.perf_counter()
+            for gate in gates:
+                await gate.acquire()
+                held.append(gate)
+            add_span('queue', time.perf_counter() - start)
+            ret = await run(*args, **kwargs)
+            if isinstance(ret, StreamingResponse):
+                # the work of a stream is mostly done after the endpoint returns, while its body is pulled
+                ret.body_iterator = _releasing(ret.body_iterator, held)
+                streamed = True
+            return ret
+        finally:
+            if not streamed:
+                _release(held)
+
+    return admitted
@@ -1,39 +1,153 @@
-from fastapi import Body, Request, status
+from fastapi import Body, Query, Request, status
 from coopapi import http_request_handlers as hrh
-from typing import Any, Dict, List, Callable, Tuple
+from coopapi import streaming
+from coopapi import projection
+from coopapi.admission import AdmissionControl, admitted_endpoint
+from coopapi.dirty_ingest import IngestReport, CSV_MEDIA_TYPE, dirty_ingest_route
+from coopapi.cache import ResponseCache, cached, invalidating
+from coopapi.coalesce import SingleFlight, coalesced
+from coopapi.change_feed import ChangeFeed, CREATE, UPDATE, DELETE, change_feed_route, publishing
+from coopapi.conditional import ConditionalGet
+from coopapi.metrics import RouteMetrics, timed
+from coopapi.tracing import Tracer, traced, traced_endpoint
+from coopapi.fast_json import trusted_endpoint
+from coopapi.write_behind import WriteBehind, PostBatcher
+from coopapi.payload_logging import PayloadLogConfig, LazyPayload, DEFAULT_PAYLOAD_LOG_CONFIG
+from coopapi.utils import is_async
+from typing import Any, Dict, List, Callable, Tuple, Awaitable
 from fastapi import APIRouter
+from starlette.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from pydantic.dataclasses import dataclass as pydataclass, Field
 from dataclasses import dataclass, field
 import json
 from urllib.parse import parse_qs
+from concurrent.futures import Executor
+import asyncio
+import contextvars
+import functools
 import logging
 
 logger = logging.getLogger('APIHandler')
 
+def in_executor(callback: Callable, executor: Executor) -> Callable[..., Awaitable]:
+    """Adapt a sync callback into an async one that runs on the given executor instead of FastAPI's shared threadpool"""
+    if callback is None or executor is None or is_async(callback):
+        return callback
+
+    async def run(*args, **kwargs):
+        # run in a copy of the request's context, as FastAPI's threadpool does, so the request id and trace carry over
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(executor,
+                                                                functools.partial(context.run, callback, *args, **kwargs))
+    return run
+
 def post_route(create_callback: hrh.postRequestCallback,
-               schema: type):
+               schema: type,
+               log_config: PayloadLogConfig = None):
+    if is_async(create_callback):
+        async def create(request: Request, item: schema = Body(...)) -> schema:
+            return await hrh.async_post_request_handler(request=request,
+                                                        item=item,
+                                                        on_post_callback=create_callback,
+                                                        log_config=log_config
+                                                        )
+        return create
+
     def create(request: Request, item: schema = Body(...)) -> schema:
         ret = hrh.post_request_handler(request=request,
                                        item=item,
-                                       on_post_callback=create_callback
+                                       on_post_callback=create_callback,
+                                       log_config=log_config
                                        )
 
         return ret
     return create
 
+def write_behind_post_route(batcher: PostBatcher,
+                            schema: type,
+                            log_config: PayloadLogConfig = None):
+    async def enqueue(request: Request, item: schema) -> schema:
+        return await batcher.submit(request, item)
+
+    if batcher.config.wait:
+        async def create(request: Request, item: schema = Body(...)) -> schema:
+            batcher.check_capacity()
+            return await hrh.async_post_request_handler(request=request,
+                                                        item=item,
+                                                        on_post_callback=enqueue,
+                                                        log_config=log_config
+                                                        )
+        return create
+
+    async def create(request: Request, item: schema = Body(...)) -> schema:
+        batcher.check_capacity()
+        batcher.submit(request, item)
+        if (log_config or DEFAULT_PAYLOAD_LOG_CONFIG).enabled(hrh.logger, logging.INFO):
+            hrh.logger.info("Creation accepted for item %s", LazyPayload(item, log_config))
+        return item
+    return create
+
 def put_route(update_callback: hrh.putRequestCallback,
-              schema: type):
+              schema: type,
+              log_config: PayloadLogConfig = None):
+    if is_async(update_callback):
+        async def update(request: Request, id: str, update_values: Dict = Body(...)) -> schema:
+            return await hrh.async_put_request_handler(request=request,
+                                                       id=id,
+                                                       obj_type=schema,
+                                                       update_values=update_values,
+                                                       on_put_callback=update_callback,
+                                                       log_config=log_config)
+        return update
+
     def update(request: Request, id: str, update_values: Dict = Body(...)) -> schema:
         return hrh.put_request_handler(request=request,
                                        id=id,
                                        obj_type=schema,
                                        update_values=update_values,
-                                       on_put_callback=update_callback)
+                                       on_put_callback=update_callback,
+                                       log_config=log_config)
     return update
 
+def patch_route(patch_callback: hrh.patchRequestCallback,
+                schema: type,
+                changes_only: bool = False,
+                log_config: PayloadLogConfig = None):
+    patch_model = hrh.patch_model(schema)
+
+    if is_async(patch_callback):
+        async def patch(request: Request, id: str, patch: patch_model = Body(...)):
+            return await hrh.async_patch_request_handler(request=request,
+                                                         id=id,
+                                                         changes=hrh.patch_changes(patch, schema),
+                                                         obj_type=schema,
+                                                         on_patch_callback=patch_callback,
+                                                         changes_only=changes_only,
+                                                         log_config=log_config)
+        return patch
+
+    def patch(request: Request, id: str, patch: patch_model = Body(...)):
+        return hrh.patch_request_handler(request=request,
+                                         id=id,
+                                         changes=hrh.patch_changes(patch, schema),
+                                         obj_type=schema,
+                                         on_patch_callback=patch_callback,
+                                         changes_only=changes_only,
+                                         log_config=log_config)
+    return patch
+
 def delete_route(delete_callback: hrh.deleteRequestCallback,
                  schema: type,
                  redirect_url: str = None):
+    if is_async(delete_callback):
+        async def delete(request: Request, id: str):
+            return await hrh.async_delete_request_handler(id=id,
+                                                          request=request,
+                                                          obj_type=schema,
+                                                          on_delete_callback=delete_callback,
+                                                          redirect_url=redirect_url)
+        return delete
+
     def delete(request: Request, id: str):
         return hrh.delete_request_handler(id=id,
                                           request=request,
@@ -42,48 +156,247 @@ def delete_route(delete_callback: hrh.deleteRequestCallback,
                                           redirect_url=redirect_url)
     return delete
 
+def _read_response(request: Request, ret: Any, conditional: ConditionalGet = None, fields: List[str] = None,
+                   response_model: Any = None, item_model: Any = None):
+    if streaming.is_stream(ret):
+        # as with lists, items a callback has already projected would not pass the model
+        return streaming.stream_response(ret, request, fields=fields,
+                                         response_model=item_model if fields is None else None)
+    if fields is not None:
+        # a partial item would not pass the response_model, so projected results are sent as already encoded json
+        response_model = None
+        if conditional is None:
+            return JSONResponse(projection.project(ret, fields))
+    if conditional is not None:
+        # the validators are taken from the whole result, and only the body is projected
+        return conditional.respond(request, ret, response_model, fields)
+    return ret
+
 def getone_route(find_callback: hrh.getOneRequestCallback,
-                 schema: type):
-    def find(request: Request, id: str) -> schema:
-        return hrh.getone_request_handler(id=id,
-                                          request=request,
-                                          obj_type=schema,
-                                          on_getone_callback=find_callback)
+                 schema: type,
+                 conditional: ConditionalGet = None,
+                 callback_fields: bool = False,
+                 trusted: bool = False):
+    '''
+    fields=a,b,c limits the response to those fields of the schema. When callback_fields is set the callback also
+    receives them (as `fields`) so it can project at the backend. Conditional responses are validated against the
+    schema unless the output is trusted
+    '''
+    response_model = None if trusted else schema
+
+    if is_async(find_callback):
+        async def find(request: Request, id: str, fields: str = None) -> schema:
+            fields = projection.parse_fields(fields, schema)
+            ret = await hrh.async_getone_request_handler(id=id,
+                                                         request=request,
+                                                         obj_type=schema,
+                                                         on_getone_callback=find_callback,
+                                                         fields=fields if callback_fields else None)
+            return _read_response(request, ret, conditional, fields, response_model)
+        return find
+
+    def find(request: Request, id: str, fields: str = None) -> schema:
+        fields = projection.parse_fields(fields, schema)
+        ret = hrh.getone_request_handler(id=id,
+                                         request=request,
+                                         obj_type=schema,
+                                         on_getone_callback=find_callback,
+                                         fields=fields if callback_fields else None)
+        return _read_response(request, ret, conditional, fields, response_model)
     return find
 
 def getmany_route(list_callback: hrh.getManyRequestCallback,
-                  schema: type):
-    def list(request: Request, query: str = None, limit: int = 100) -> List[schema]:
+                  schema: type,
+                  conditional: ConditionalGet = None,
+                  callback_fields: bool = False,
+                  trusted: bool = False):
+    response_model = None if trusted else List[schema]
+    # a generator result is streamed, and its items checked one by one
+    item_model = None if trusted else schema
+    if is_async(list_callback):
+        async def list(request: Request, query: str = None, limit: int = 100, fields: str = None) -> List[schema]:
+            if query is not None:
+                query = json.loads(query)
+            fields = projection.parse_fields(fields, schema)
+            ret = await hrh.async_getmany_request_handler(request,
+                                                          on_getmany_callback=list_callback,
+                                                          query=query,
+                                                          limit=limit,
+                                                          fields=fields if callback_fields else None)
+            return _read_response(request, ret, conditional, fields, response_model, item_model)
+        return list
+
+    def list(request: Request, query: str = None, limit: int = 100, fields: str = None) -> List[schema]:
         if query is not None:
             query = json.loads(query)
+        fields = projection.parse_fields(fields, schema)
         ret = hrh.getmany_request_handler(request,
                                           on_getmany_callback=list_callback,
                                           query=query,
-                                          limit=limit)
-        return ret
+                                          limit=limit,
+                                          fields=fields if callback_fields else None)
+        return _read_response(request, ret, conditional, fields, response_model, item_model)
     return list
 
+def getmany_stream_route(stream_callback: hrh.getManyStreamRequestCallback,
+                         schema: type,
+                         trusted: bool = False):
+    '''
+    Cursor paged export. The callback is asked for one more item than the page holds so the stream knows whether to
+    hand back a next_cursor, and gets the id to resume after (decoded from the cursor) as its last argument. Items
+    are validated against the schema unless the output is trusted
+    '''
+    response_model = None if trusted else schema
+
+    if is_async(stream_callback):
+        async def list_stream(request: Request, query: str = None, limit: int = Query(None, ge=1), cursor: str = None):
+            if query is not None:
+                query = json.loads(query)
+            ret = await hrh.async_getmany_stream_request_handler(request,
+                                                                 on_getmany_stream_callback=stream_callback,
+                                                                 query=query,
+                                                                 limit=limit + 1 if limit is not None else None,
+                                                                 after=streaming.decode_cursor(cursor))
+            return streaming.stream_response(ret, request, limit=limit, envelope=True, response_model=response_model)
+        return list_stream
+
+    def list_stream(request: Request, query: str = None, limit: int = Query(None, ge=1), cursor: str = None):
+        if query is not None:
+            query = json.loads(query)
+        ret = hrh.getmany_stream_request_handler(request,
+                                                 on_getmany_stream_callback=stream_callback,
+                                                 query=query,
+                                                 limit=limit + 1 if limit is not None else None,
+                                                 after=streaming.decode_cursor(cursor))
+        return streaming.stream_response(ret, request, limit=limit, envelope=True, response_model=response_model)
+    return list_stream
+
+
+def post_many_route(create_many_callback: hrh.postManyRequestCallback,
+                    schema: type):
+    if is_async(create_many_callback):
+        async def create_many(request: Request, items: List[schema] = Body(...)):
+            return await hrh.async_batch_request_handler(request=request,
+                                                         ids=[getattr(x, 'id', None) for x in items],
+                                                         payload=items,
+                                                         obj_type=schema,
+                                                         on_batch_callback=create_many_callback)
+        return create_many
+
+    def create_many(request: Request, items: List[schema] = Body(...)):
+        return hrh.batch_request_handler(request=request,
+                                         ids=[getattr(x, 'id', None) for x in items],
+                                         payload=items,
+                                         obj_type=schema,
+                                         on_batch_callback=create_many_callback)
+    return create_many
+
+def put_many_route(update_many_callback: hrh.putManyRequestCallback,
+                   schema: type):
+    if is_async(update_many_callback):
+        async def update_many(request: Request, update_values: Dict[str, Dict] = Body(...)):
+            return await hrh.async_batch_request_handler(request=request,
+                                                         ids=[x for x in update_values.keys()],
+                                                         payload=update_values,
+                                                         obj_type=schema,
+                                                         on_batch_callback=update_many_callback)
+        return update_many
+
+    def update_many(request: Request, update_values: Dict[str, Dict] = Body(...)):
+        return hrh.batch_request_handler(request=request,
+                                         ids=[x for x in update_values.keys()],
+                                         payload=update_values,
+                                         obj_type=schema,
+                                         on_batch_callback=update_many_callback)
+    return update_many
+
+def delete_many_route(delete_many_callback: hrh.deleteManyRequestCallback,
+                      schema: type):
+    if is_async(delete_many_callback):
+        async def delete_many(request: Request, ids: List[str] = Body(...)):
+            return await hrh.async_batch_request_handler(request=request,
+                                                         ids=ids,
+                                                         payload=ids,
+                                                         obj_type=schema,
+                                                         on_batch_callback=delete_many_callback)
+        return delete_many
+
+    def delete_many(request: Request, ids: List[str] = Body(...)):
+        return hrh.batch_request_handler(request=request,
+                                         ids=ids,
+                                         payload=ids,
+                                         obj_type=schema,
+                                         on_batch_callback=delete_many_callback)
+    return delete_many
+
+def getmany_by_ids_route(find_many_callback: hrh.getManyByIdsRequestCallback,
+                         schema: type):
+    if is_async(find_many_callback):
+        async def find_many(request: Request, ids: List[str] = Query(...)):
+            return await hrh.async_batch_request_handler(request=request,
+                                                         ids=ids,
+                                                         payload=ids,
+                                                         obj_type=schema,
+                                                         on_batch_callback=find_many_callback)
+        return find_many
+
+    def find_many(request: Request, ids: List[str] = Query(...)):
+        return hrh.batch_request_handler(request=request,
+                                         ids=ids,
+                                         payload=ids,
+                                         obj_type=schema,
+                                         on_batch_callback=find_many_callback)
+    return find_many
+
 
 dirtyCleaner = Callable[[Dict], Dict]
 
+def _clean_dirty(dirty_str: str, schema: type, cleaner: dirtyCleaner, log_config: PayloadLogConfig = None):
+    dirty_data = parse_qs(dirty_str)
+    clean_data = cleaner(dirty_data)
+    if (log_config or DEFAULT_PAYLOAD_LOG_CONFIG).enabled(logger, logging.INFO):
+        logger.info("Received Data: %s\nCleaned Data: %s",
+                    LazyPayload(dirty_data, log_config),
+                    LazyPayload(clean_data, log_config))
+
+    return schema(**clean_data)
+
 def dirty_post_route(create_callback: hrh.postRequestCallback,
                      schema: type,
-                     cleaner: dirtyCleaner):
-    def dirty_post_route(request: Request, dirty_str: str = Body(...)) -> schema:
-        dirty_data = parse_qs(dirty_str)
-        clean_data = cleaner(dirty_data)
-        logger.info(f"Received Data: {dirty_str}\n"
-                    f"Cleaned Data: {clean_data}")
+                     cleaner: dirtyCleaner,
+                     log_config: PayloadLogConfig = None):
+    if is_async(create_callback):
+        async def dirty_post_route(request: Request, dirty_str: str = Body(...)) -> schema:
+            return await hrh.async_post_request_handler(request=request,
+                                                        item=_clean_dirty(dirty_str, schema, cleaner, log_config),
+                                                        on_post_callback=create_callback,
+                                                        log_config=log_config
+                                                        )
+        return dirty_post_route
 
-        obj = schema(**clean_data)
+    def dirty_post_route(request: Request, dirty_str: str = Body(...)) -> schema:
+        obj = _clean_dirty(dirty_str, schema, cleaner, log_config)
         ret = hrh.post_request_handler(request=request,
                                        item=obj,
-                                       on_post_callback=create_callback
+                                       on_post_callback=create_callback,
+                                       log_config=log_config
                                        )
 
         return ret
     return dirty_post_route
 
+@functools.lru_cache(maxsize=None)
+def _route_class(route_classes: Tuple[type, ...]) -> type:
+    # each wraps super().get_route_handler(), so subclassing all of them chains their handlers
+    if len(route_classes) == 1:
+        return route_classes[0]
+    return type('ShellRoute', route_classes, {})
+
+def metrics_route(metrics: RouteMetrics):
+    def get_metrics():
+        return metrics.response()
+    return get_metrics
+
 # class Config:
 #     arbitrary_types_allowed = True
 
@@ -97,7 +410,28 @@ class ApiShell:
     on_getone_callback: hrh.getOneRequestCallback = field(default=None)
     on_getmany_callback: hrh.getManyRequestCallback = field(default=None)
     dirty_create: dirtyCleaner = field(default=None)
+    on_post_many_callback: hrh.postManyRequestCallback = field(default=None)
+    on_put_many_callback: hrh.putManyRequestCallback = field(default=None)
+    on_delete_many_callback: hrh.deleteManyRequestCallback = field(default=None)
+    on_getmany_by_ids_callback: hrh.getManyByIdsRequestCallback = field(default=None)
+    on_getmany_stream_callback: hrh.getManyStreamRequestCallback = field(default=None)
+    on_patch_callback: hrh.patchRequestCallback = field(default=None)
     router: APIRouter = field(default_factory=APIRouter)
+    executor: Executor = field(default=None)
+    cache: ResponseCache = field(default=None)
+    single_flight: SingleFlight = field(default=None)
+    conditional_get: ConditionalGet = field(default=None)
+    log_config: PayloadLogConfig = field(default=None)
+    metrics: RouteMetrics = field(default=None)
+    metrics_endpoint: bool = field(default=True)
+    trusted_output: bool = field(default=False)
+    verify_output: bool = field(default=False)
+    admission: AdmissionControl = field(default=None)
+    write_behind: WriteBehind = field(default=None)
+    change_feed: ChangeFeed = field(default=None)
+    tracer: Tracer = field(default=None)
+    patch_changes_only: bool = field(default=False)
+    post_batcher: PostBatcher = field(default=None, init=False)
 
 
     def __post_init__(self):
@@ -108,15 +442,186 @@ class ApiShell:
     #     self.register_routes()
     #     print(f"{self.base_route} routes registered")
 
+    def _callbacks(self) -> Dict[str, Callable]:
+        '''
+        The callbacks as the routes will see them. Sync callbacks are moved onto the shell's executor when one is
+        supplied, otherwise they are left for FastAPI to run on its threadpool. With a cache, reads go through it and
+        successful writes invalidate it. Callback timings are taken inside the cache, so hits are not counted as calls.
+        With single_flight, cache misses for the same read share one call; a write moves later reads onto a new flight.
+        With a change_feed, each successful write publishes its changes
+        '''
+        callbacks = {
+            'post': in_executor(self.on_post_callback, self.executor),
+            'put': in_executor(self.on_put_callback, self.executor),
+            'delete': in_executor(self.on_delete_callback, self.executor),
+            'getone': in_executor(self.on_getone_callback, self.executor),
+            'getmany': in_executor(self.on_getmany_callback, self.executor),
+            'post_many': in_executor(self.on_post_many_callback, self.executor),
+            'put_many': in_executor(self.on_put_many_callback, self.executor),
+            'delete_many': in_executor(self.on_delete_many_callback, self.executor),
+            'getmany_by_ids': in_executor(self.on_getmany_by_ids_callback, self.executor),
+            'getmany_stream': in_executor(self.on_getmany_stream_callback, self.executor),
+            'patch': in_executor(self.on_patch_callback, self.executor),
+        }
+
+        if self.tracer is not None:
+            callbacks = {k: traced(v) for k, v in callbacks.items()}
+
+        if self.metrics is not None:
+            callbacks = {k: timed(v, self.metrics, shell=self.base_route, name=k) for k, v in callbacks.items()}
+
+        write_ids = {
+            'post': lambda request, item: [item.id],
+            'put': lambda request, id, update_values: [id],
+            'patch': lambda request, id, changes: [id],
+            'delete': lambda request, id: [id],
+            'post_many': lambda request, items: [x.id for x in items],
+            'put_many': lambda request, update_values: update_values.keys(),
+            'delete_many': lambda request, ids: ids,
+        }
+
+        if self.single_flight is not None:
+            f = self.single_flight
+            for name, key in (('getone', lambda request, id, fields=None: f.one_key(id, fields)),
+                              ('getmany', lambda request, query, limit, fields=None: f.many_key(query, limit, fields))):
+                on_collapsed = functools.partial(self.metrics.observe_coalesced, self.base_route, name) if self.metrics is not None else None
+                callbacks[name] = coalesced(callbacks[name], f, key=key, on_collapsed=on_collapsed)
+            for name, ids in write_ids.items():
+                callbacks[name] = invalidating(callbacks[name], f, ids=ids)
+
+        if self.cache is not None:
+            c = self.cache
+            callbacks['getone'] = cached(callbacks['getone'], c, key=lambda request, id, fields=None: c.one_key(id, fields))
+            callbacks['getmany'] = cached(callbacks['getmany'], c, key=lambda request, query, limit, fields=None: c.many_key(query, limit, fields))
+            for name, ids in write_ids.items():
+                callbacks[name] = invalidating(callbacks[name], c, ids=ids)
+
+        if self.change_feed is not None:
+            ok = lambda ret: not isinstance(ret, Exception) and ret is not False
+            change_events = {
+                'post': lambda ret, request, item: [(CREATE, getattr(ret, 'id', item.id), ret)],
+                'put': lambda ret, request, id, update_values: [(UPDATE, id, ret)],
+                'patch': lambda ret, request, id, changes: [(UPDATE, id, ret)],
+                'delete': lambda ret, request, id: [(DELETE, id, None)] if ok(ret) else [],
+                'post_many': lambda ret, request, items: [(CREATE, x.id, r) for x, r in zip(items, ret) if ok(r)],
+                'put_many': lambda ret, request, update_values: [(UPDATE, id, r) for id, r in zip(update_values, ret) if ok(r)],
+                'delete_many': lambda ret, request, ids: [(DELETE, id, None) for id, r in zip(ids, ret) if ok(r)],
+            }
+            for name, events in change_events.items():
+                callbacks[name] = publishing(callbacks[name], self.change_feed, events=events, source=self.base_route)
+
+        return callbacks
+
+    def _add_route(self, path: str, endpoint: Callable, **kwargs):
+        '''
+        With trusted_output, callback results are taken as already valid and encoded straight to json rather than being
+        re-validated against the route's response_model; verify_output turns that check back on, as a comparison, for
+        tests. With admission, a route only runs once its verb's and the shell's limits let it in. Metrics and tracing
+        each provide an APIRoute subclass, which are combined when both are on
+        '''
+        if self.tracer is not None:
+            # innermost, so that whatever the other wrappers do after the endpoint counts as serializing
+            endpoint = traced_endpoint(endpoint)
+        if self.trusted_output and kwargs.get('response_model') is not None:
+            endpoint = trusted_endpoint(endpoint,
+                                        status_code=kwargs['status_code'],
+                                        response_model=kwargs['response_model'] if self.verify_output else None,
+                                        exclude_unset=kwargs.get('response_model_exclude_unset', False))
+        if self.admission is not None:
+            endpoint = admitted_endpoint(endpoint, self.admission.gates(self.base_route, kwargs['methods'][0]))
+        route_classes = tuple(x.route_class for x in (self.tracer, self.metrics) if x is not None)
+        if route_classes:
+            kwargs['route_class_override'] = _route_class(route_classes)
+        self.router.add_api_route(path, endpoint, **kwargs)
+
     def register_routes(self):
         '''
         Basic CRUD api_routers routes
         '''
+        callbacks = self._callbacks()
+
+        if self.tracer is not None:
+            # flushes and closes a file exporter
+            self.router.on_shutdown.append(self.tracer.close)
+
+        '''
+        Batch and stream routes. These are registered ahead of the single item routes so that '/api/batch' and
+        '/api/stream' are not captured as an '{id}'. Batch routes respond with one result per item, carrying that
+        item's own status code
+        '''
+        batch_model = List[hrh.batch_result_model(self.target_schema)]
+
+        if self.on_post_many_callback is not None:
+            self._add_route(
+                f"{self.base_route}/api/batch",
+                post_many_route(callbacks['post_many'], schema=self.target_schema),
+                methods=['POST'],
+                response_description=f"POST many new {self.target_schema.__name__}s",
+                response_model=batch_model,
+                status_code=status.HTTP_200_OK)
+
+        if self.on_put_many_callback is not None:
+            self._add_route(
+                f"{self.base_route}/api/batch",
+                put_many_route(callbacks['put_many'], schema=self.target_schema),
+                methods=['PUT'],
+                response_description=f"PUT many {self.target_schema.__name__}s, keyed by id",
+                response_model=batch_model,
+                status_code=status.HTTP_200_OK)
+
+        if self.on_delete_many_callback is not None:
+            self._add_route(
+                f"{self.base_route}/api/batch",
+                delete_many_route(callbacks['delete_many'], schema=self.target_schema),
+                methods=['DELETE'],
+                response_description=f"DELETE many {self.target_schema.__name__}s by id",
+                response_model=List[hrh.batch_result_model(bool)],
+                status_code=status.HTTP_200_OK)
+
+        if self.on_getmany_by_ids_callback is not None:
+            self._add_route(
+                f"{self.base_route}/api/batch",
+                getmany_by_ids_route(callbacks['getmany_by_ids'], schema=self.target_schema),
+                methods=['GET'],
+                response_description=f"GET many {self.target_schema.__name__}s by id",
+                response_model=batch_model,
+                status_code=status.HTTP_200_OK)
+
+        if self.on_getmany_stream_callback is not None:
+            self._add_route(
+                f"{self.base_route}/api/stream",
+                getmany_stream_route(callbacks['getmany_stream'], schema=self.target_schema,
+                                     trusted=self.trusted_output),
+                methods=['GET'],
+                response_description=f"Stream {self.target_schema.__name__}s as NDJSON or a chunked JSON array, "
+                                     f"paged by an opaque next_cursor",
+                response_class=StreamingResponse,
+                status_code=status.HTTP_200_OK)
+
+        '''
+        With write_behind, POSTs are queued and written through on_post_many_callback in batches. Anything still queued
+        is flushed when the app shuts down
+        '''
+        if self.write_behind is not None:
+            if self.on_post_many_callback is None:
+                raise NotImplementedError("Cannot supply write_behind without an on_post_many_callback")
+
+            self.post_batcher = PostBatcher(callbacks['post_many'], self.write_behind, log_config=self.log_config)
+            self.router.on_shutdown.append(self.post_batcher.close)
+            self._add_route(
+                f"{self.base_route}/api/",
+                write_behind_post_route(self.post_batcher, schema=self.target_schema, log_config=self.log_config),
+                methods=['POST'],
+                response_description=f"POST a new {self.target_schema.__name__}" +
+                                     ("" if self.write_behind.wait else ", accepted to be written shortly"),
+                response_model=self.target_schema,
+                status_code=status.HTTP_201_CREATED if self.write_behind.wait else status.HTTP_202_ACCEPTED)
+
         # create route
-        if self.on_post_callback is not None:
-            self.router.add_api_route(
+        elif self.on_post_callback is not None:
+            self._add_route(
                 f"{self.base_route}/api/",
-                post_route(self.on_post_callback, schema=self.target_schema),
+                post_route(callbacks['post'], schema=self.target_schema, log_config=self.log_config),
                 methods=['POST'],
                 response_description=f"POST a new {self.target_schema.__name__}",
                 response_model=self.target_schema,
@@ -124,20 +629,34 @@ class ApiShell:
 
         # update route
         if self.on_put_callback is not None:
-            self.router.add_api_route(
+            self._add_route(
                 f"{self.base_route}/api/{{id}}",
-                put_route(update_callback=self.on_put_callback, schema=self.target_schema),
+                put_route(update_callback=callbacks['put'], schema=self.target_schema, log_config=self.log_config),
                 methods=['PUT'],
                 response_description=f"PUT a {self.target_schema.__name__}",
                 response_model=self.target_schema,
                 status_code=status.HTTP_202_ACCEPTED
             )
 
+        # partial update route
+        if self.on_patch_callback is not None:
+            self._add_route(
+                f"{self.base_route}/api/{{id}}",
+                patch_route(patch_callback=callbacks['patch'], schema=self.target_schema,
+                            changes_only=self.patch_changes_only, log_config=self.log_config),
+                methods=['PATCH'],
+                response_description=f"PATCH some fields of a {self.target_schema.__name__}" +
+                                     (", returning only the changed fields" if self.patch_changes_only else ""),
+                response_model=hrh.patch_changes_model(self.target_schema) if self.patch_changes_only else self.target_schema,
+                response_model_exclude_unset=self.patch_changes_only,
+                status_code=status.HTTP_202_ACCEPTED
+            )
+
         # delete route
         if self.on_delete_callback is not None:
-            self.router.add_api_route(
+            self._add_route(
                 f"{self.base_route}/api/{{id}}",
-                delete_route(delete_callback=self.on_delete_callback, schema=self.target_schema),
+                delete_route(delete_callback=callbacks['delete'], schema=self.target_schema),
                 methods=['DELETE'],
                 response_description=f"DELETE a {self.target_schema.__name__}",
                 response_model=bool,
@@ -146,9 +665,11 @@ class ApiShell:
 
         # find route
         if self.on_getone_callback is not None:
-            self.router.add_api_route(
+            self._add_route(
                 f"{self.base_route}/api/{{id}}",
-                getone_route(find_callback=self.on_getone_callback, schema=self.target_schema),
+                getone_route(find_callback=callbacks['getone'], schema=self.target_schema, conditional=self.conditional_get,
+                             callback_fields=projection.accepts_fields(self.on_getone_callback),
+                             trusted=self.trusted_output),
                 methods=['GET'],
                 response_description=f"GET a single {self.target_schema.__name__} by id",
                 response_model=self.target_schema,
@@ -156,9 +677,11 @@ class ApiShell:
 
         # list route
         if self.on_getmany_callback is not None:
-            self.router.add_api_route(
+            self._add_route(
                 f"{self.base_route}/api/",
-                getmany_route(list_callback=self.on_getmany_callback, schema=self.target_schema),
+                getmany_route(list_callback=callbacks['getmany'], schema=self.target_schema, conditional=self.conditional_get,
+                              callback_fields=projection.accepts_fields(self.on_getmany_callback),
+                              trusted=self.trusted_output),
                 methods=['GET'],
                 response_description=f"GET all {self.target_schema.__name__}s",
                 response_model=List[self.target_schema],
@@ -174,9 +697,9 @@ class ApiShell:
         '''
 
         if self.on_delete_callback is not None:
-            self.router.add_api_route(
+            self._add_route(
                 f"{self.base_route}/delete/{{id}}",
-                delete_route(delete_callback=self.on_delete_callback, schema=self.target_schema, redirect_url=f"{self.base_route}"),
+                delete_route(delete_callback=callbacks['delete'], schema=self.target_schema, redirect_url=f"{self.base_route}"),
                 methods=['GET'],
                 response_description=f"Delete a {self.target_schema.__name__}",
                 response_model=bool,
@@ -191,15 +714,62 @@ class ApiShell:
             if self.on_post_callback is None:
                 raise NotImplementedError(f"Cannot supply a dirty create without an on_create_callback")
 
-            self.router.add_api_route(
+            self._add_route(
                 f"{self.base_route}/dirty/",
-                dirty_post_route(create_callback=self.on_post_callback, schema=self.target_schema, cleaner=self.dirty_create),
+                dirty_post_route(create_callback=callbacks['post'], schema=self.target_schema, cleaner=self.dirty_create, log_config=self.log_config),
                 methods=['POST'],
                 response_description=f"Create a {self.target_schema.__name__}",
                 response_model=self.target_schema,
                 status_code=status.HTTP_200_OK
             )
 
+            self._add_route(
+                f"{self.base_route}/dirty/stream",
+                dirty_ingest_route(create_callback=callbacks['post'],
+                                   create_many_callback=callbacks['post_many'],
+                                   schema=self.target_schema,
+                                   cleaner=self.dirty_create,
+                                   log_config=self.log_config),
+                methods=['POST'],
+                response_description=f"Create many {self.target_schema.__name__}s from newline-delimited dirty strings "
+                                     f"or CSV, reporting the records that failed",
+                response_model=IngestReport,
+                status_code=status.HTTP_200_OK,
+                openapi_extra={'requestBody': {'content': {'text/plain': {'schema': {'type': 'string'}},
+                                                           CSV_MEDIA_TYPE: {'schema': {'type': 'string'}}}}}
+            )
+
+        '''
+        Change feed route, streaming the shell's writes as Server-Sent Events
+        '''
+        if self.change_feed is not None:
+            self.router.add_api_route(
+                f"{self.base_route}/changes",
+                change_feed_route(self.change_feed),
+                methods=['GET'],
+                response_description=f"Server-Sent Events for each {self.target_schema.__name__} created, updated or "
+                                     f"deleted, resumable with ?after= or Last-Event-ID",
+                response_class=StreamingResponse,
+                status_code=status.HTTP_200_OK
+            )
+
+        '''
+        Metrics route, exposing the shell's RouteMetrics in the Prometheus text format. Shells sharing a RouteMetrics
+        all serve the same text, so an app with several can turn these off and mount metrics.router() once instead
+        '''
+        if self.metrics is not None and self.admission is not None:
+            self.metrics.observe_admission(self.base_route, self.admission)
+
+        if self.metrics is not None and self.metrics_endpoint:
+            self.router.add_api_route(
+                f"{self.base_route}/metrics",
+                metrics_route(self.metrics),
+                methods=['GET'],
+                response_description=f"Prometheus metrics for the {self.target_schema.__name__} routes",
+                response_class=PlainTextResponse,
+                status_code=status.HTTP_200_OK
+            )
+
 
 
 
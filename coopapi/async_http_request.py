@@ -0,0 +1,245 @@
+import asyncio
+import logging
+import uuid
+import weakref
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Tuple, Union
+
+import httpx
+
+from coopapi.enums import RequestType
+from coopapi.http_request import DEFAULT_TIMEOUT, _log_send, _log_receive, logger
+from coopapi.payload_logging import PayloadLogConfig, DEFAULT_PAYLOAD_LOG_CONFIG
+from coopapi.tracing import REQUEST_ID_HEADER
+
+'''
+Asyncio counterpart to coopapi.http_request. Requests are sent through a pooled httpx.AsyncClient, and gather() fans
+many requests out concurrently (bounded by max_concurrency) while handing the results back in the order given
+'''
+
+
+@dataclass
+class AsyncRequest:
+    url: str
+    method: RequestType = field(default=RequestType.GET)
+    bearer_token: str = field(default=None)
+    loggingLvl: int = field(default=logging.INFO)
+    label: str = field(default=None)
+    request_id: str = field(default=None)
+    kwargs: Dict[str, Any] = field(default_factory=dict)
+
+
+def _timeout(timeout: Union[None, float, Tuple[float, float], httpx.Timeout]) -> httpx.Timeout:
+    # a (connect, read) tuple, as HttpClient takes, which httpx doesn't accept itself
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        return httpx.Timeout(read, connect=connect)
+    return timeout if isinstance(timeout, httpx.Timeout) else httpx.Timeout(timeout)
+
+
+class AsyncHttpClient:
+    '''
+    timeout is in seconds, a (connect, read) tuple like HttpClient's, or an httpx.Timeout, and defaults to HttpClient's
+    DEFAULT_TIMEOUT; None waits forever. transport replaces the network, eg httpx.ASGITransport(app) to send requests
+    straight to an ASGI app
+    '''
+    def __init__(self,
+                 max_concurrency: int = 20,
+                 max_connections: int = 100,
+                 max_keepalive_connections: int = 20,
+                 timeout: Union[float, Tuple[float, float], httpx.Timeout] = DEFAULT_TIMEOUT,
+                 verify: bool = True,
+                 log_config: PayloadLogConfig = None,
+                 transport: httpx.AsyncBaseTransport = None):
+        self.max_concurrency = max_concurrency
+        self.log_config = log_config or DEFAULT_PAYLOAD_LOG_CONFIG
+        self.client = httpx.AsyncClient(limits=httpx.Limits(max_connections=max_connections,
+                                                            max_keepalive_connections=max_keepalive_connections),
+                                        timeout=_timeout(timeout),
+                                        verify=verify,
+                                        transport=transport)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
+
+    async def request(self,
+                      url: str,
+                      method: RequestType,
+                      bearer_token: str = None,
+                      loggingLvl=logging.INFO,
+                      label: str = None,
+                      request_id: str = None,
+                      **kwargs) -> httpx.Response:
+        headers = dict(kwargs.pop('headers', None) or {})
+        if bearer_token is not None:
+            headers['Authorization'] = f"Bearer {bearer_token}"
+
+        if request_id is None:
+            request_id = str(uuid.uuid4())
+        headers.setdefault(REQUEST_ID_HEADER, request_id)
+        sampled = self.log_config.enabled(logger, loggingLvl)
+        if sampled:
+            _log_send(id=request_id, lvl=loggingLvl, method=method, url=url, label=label, log_config=self.log_config, **kwargs)
+        response = await self.client.request(method=method.value, url=url, headers=headers, **kwargs)
+        if sampled:
+            _log_receive(id=request_id, lvl=loggingLvl, method=method, url=url, label=label, log_config=self.log_config, response=response)
+        return response
+
+    async def gather(self,
+                     requests: Iterable[AsyncRequest],
+                     max_concurrency: int = None,
+                     return_exceptions: bool = False) -> List[Union[httpx.Response, Exception]]:
+        '''
+        Send all requests concurrently, at most max_concurrency (default: the client's) at a time. Results are in the
+        order the requests were given. With return_exceptions a failed request yields its exception in place instead of
+        failing the whole gather
+        '''
+        semaphore = asyncio.Semaphore(max_concurrency or self.max_concurrency)
+
+        async def send(req: AsyncRequest):
+            async with semaphore:
+                return await self.request(url=req.url,
+                                          method=req.method,
+                                          bearer_token=req.bearer_token,
+                                          loggingLvl=req.loggingLvl,
+                                          label=req.label,
+                                          request_id=req.request_id,
+                                          **req.kwargs)
+
+        return await asyncio.gather(*[send(x) for x in requests], return_exceptions=return_exceptions)
+
+
+'''
+httpx clients are bound to the event loop they were first used on, so the shared client is kept per loop
+'''
+_default_clients: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncHttpClient]' = weakref.WeakKeyDictionary()
+
+def default_client() -> AsyncHttpClient:
+    loop = asyncio.get_running_loop()
+    client = _default_clients.get(loop)
+    if client is None:
+        client = AsyncHttpClient()
+        _default_clients[loop] = client
+    return client
+
+
+async def request(url: str,
+                  method: RequestType,
+                  bearer_token: str = None,
+                  loggingLvl=logging.INFO,
+                  label: str = None,
+                  request_id: str = None,
+                  **kwargs) -> httpx.Response:
+    return await default_client().request(url=url,
+                                          method=method,
+                                          bearer_token=bearer_token,
+                                          loggingLvl=loggingLvl,
+                                          label=label,
+                                          request_id=request_id,
+                                          **kwargs)
+
+async def gather(requests: Iterable[AsyncRequest],
+                 max_concurrency: int = None,
+                 return_exceptions: bool = False) -> List[Union[httpx.Response, Exception]]:
+    return await default_client().gather(requests,
+                                         max_concurrency=max_concurrency,
+                                         return_exceptions=return_exceptions)
+
+
+async def get(url: str,
+              bearer_token: str = None,
+              loggingLvl=logging.INFO,
+              label: str = None,
+              **kwargs) -> httpx.Response:
+    return await request(url=url,
+                         method=RequestType.GET,
+                         bearer_token=bearer_token,
+                         loggingLvl=loggingLvl,
+                         label=label,
+                         **kwargs)
+
+async def post(url: str,
+               data: Dict = None,
+               json_serializable: Any = None,
+               label: str = None,
+               loggingLvl=logging.INFO,
+               bearer_token: str = None) -> httpx.Response:
+    return await request(url=url,
+                         method=RequestType.POST,
+                         bearer_token=bearer_token,
+                         loggingLvl=loggingLvl,
+                         label=label,
+                         data=data,
+                         json=json_serializable)
+
+async def put(url: str,
+              data: Dict = None,
+              label: str = None,
+              loggingLvl=logging.INFO,
+              bearer_token: str = None) -> httpx.Response:
+    return await request(url=url,
+                         method=RequestType.PUT,
+                         bearer_token=bearer_token,
+                         loggingLvl=loggingLvl,
+                         label=label,
+                         data=data)
+
+async def patch(url: str,
+                data: Dict = None,
+                label: str = None,
+                loggingLvl=logging.INFO,
+                bearer_token: str = None) -> httpx.Response:
+    return await request(url=url,
+                         method=RequestType.PATCH,
+                         bearer_token=bearer_token,
+                         loggingLvl=loggingLvl,
+                         label=label,
+                         data=data)
+
+async def delete(url: str,
+                 data: Dict = None,
+                 label: str = None,
+                 loggingLvl=logging.INFO,
+                 bearer_token: str = None) -> httpx.Response:
+    return await request(url=url,
+                         method=RequestType.DELETE,
+                         bearer_token=bearer_token,
+                         loggingLvl=loggingLvl,
+                         label=label,
+                         data=data)
+
+async def head(url: str,
+               data: Dict = None,
+               label: str = None,
+               loggingLvl=logging.INFO,
+               bearer_token: str = None) -> httpx.Response:
+    return await request(url=url,
+                         method=RequestType.HEAD,
+                         bearer_token=bearer_token,
+                         loggingLvl=loggingLvl,
+                         label=label,
+                         data=data)
+
+async def options(url: str,
+                  data: Dict = None,
+                  label: str = None,
+                  loggingLvl=logging.INFO,
+                  bearer_token: str = None) -> httpx.Response:
+    return await request(url=url,
+                         method=RequestType.OPTIONS,
+                         bearer_token=bearer_token,
+                         loggingLvl=loggingLvl,
+                         label=label,
+                         data=data)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    ret = asyncio.run(gather([AsyncRequest(url='https://w3schools.com/python/demopage.htm', label=str(i)) for i in range(5)]))
+    print(ret)
@@ -0,0 +1,184 @@
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Tuple
+from coopapi import streaming
+from coopapi.utils import is_async
+
+MISSING = object()
+
+
+class CacheBackend(ABC):
+    '''
+    Storage for a ResponseCache. Implementations must be safe to call from several threads and report a miss by
+    returning MISSING
+    '''
+
+    @abstractmethod
+    def get(self, key: Hashable) -> Any:
+        pass
+
+    @abstractmethod
+    def set(self, key: Hashable, value: Any):
+        pass
+
+    @abstractmethod
+    def delete(self, key: Hashable):
+        pass
+
+    @abstractmethod
+    def clear(self):
+        pass
+
+    @property
+    def evictions(self) -> int:
+        return 0
+
+
+class LruTtlCacheBackend(CacheBackend):
+    def __init__(self, max_size: int = 1024, ttl_s: float = None):
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._evictions = 0
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            entry = self._data.get(key, MISSING)
+            if entry is MISSING:
+                return MISSING
+
+            value, expires = entry
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                self._evictions += 1
+                return MISSING
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        expires = time.monotonic() + self.ttl_s if self.ttl_s is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self._evictions += 1
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    @property
+    def evictions(self) -> int:
+        return self._evictions
+
+
+@dataclass
+class ResponseCache:
+    '''
+    Read-through cache for an ApiShell's getone and getmany callbacks. Single items are keyed by id and dropped when
+    that id is written through the shell. getmany results are keyed by the normalized query and limit plus a
+    generation number; any write bumps the generation, which orphans every cached list (and projected item) at once and
+    leaves the backend to age them out
+    '''
+    backend: CacheBackend = field(default_factory=LruTtlCacheBackend)
+    hits: int = field(default=0, init=False)
+    misses: int = field(default=0, init=False)
+    _generation: int = field(default=0, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def one_key(self, id: str, fields: List[str] = None) -> Tuple:
+        if fields is None:
+            return ('one', id)
+        # projections of an item aren't tracked individually, so they are orphaned by any write like lists are
+        return ('one', id, self._generation, tuple(fields))
+
+    def many_key(self, query: Dict, limit: int, fields: List[str] = None) -> Tuple:
+        return ('many', self._generation, json.dumps(query, sort_keys=True, default=str), limit,
+                tuple(fields) if fields is not None else None)
+
+    def lookup(self, key: Hashable) -> Any:
+        ret = self.backend.get(key)
+        with self._lock:
+            if ret is MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return ret
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def store(self, key: Hashable, value: Any, generation: int):
+        # a write that landed while the callback was running may have made value stale already
+        if generation == self._generation and not streaming.is_stream(value):
+            self.backend.set(key, value)
+
+    def invalidate(self, ids: Iterable[str]):
+        with self._lock:
+            self._generation += 1
+        for id in ids:
+            self.backend.delete(self.one_key(id))
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.backend.evictions}
+
+
+def cached(callback: Callable, cache: ResponseCache, key: Callable[..., Hashable]) -> Callable:
+    '''Wrap a read callback so that it is only called on a cache miss. key() receives the callback's arguments'''
+    if callback is None:
+        return None
+
+    if is_async(callback):
+        async def read(*args, **kwargs):
+            k = key(*args, **kwargs)
+            generation = cache.generation
+            ret = cache.lookup(k)
+            if ret is MISSING:
+                ret = await callback(*args, **kwargs)
+                cache.store(k, ret, generation)
+            return ret
+        return read
+
+    def read(*args, **kwargs):
+        k = key(*args, **kwargs)
+        generation = cache.generation
+        ret = cache.lookup(k)
+        if ret is MISSING:
+            ret = callback(*args, **kwargs)
+            cache.store(k, ret, generation)
+        return ret
+    return read
+
+
+def invalidating(callback: Callable, cache: ResponseCache, ids: Callable[..., Iterable[str]]) -> Callable:
+    '''Wrap a write callback so that a successful call invalidates the cache. ids() receives the callback's arguments'''
+    if callback is None:
+        return None
+
+    if is_async(callback):
+        async def write(*args, **kwargs):
+            ret = await callback(*args, **kwargs)
+            cache.invalidate(ids(*args, **kwargs))
+            return ret
+        return write
+
+    def write(*args, **kwargs):
+        ret = callback(*args, **kwargs)
+        cache.invalidate(ids(*args, **kwargs))
+        return ret
+    return write
@@ -0,0 +1,205 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+from fastapi import Header, Query, Request
+from starlette.responses import StreamingResponse
+from coopapi import fast_json
+from coopapi.utils import is_async
+
+logger = logging.getLogger('ChangeFeed')
+
+SSE_MEDIA_TYPE = 'text/event-stream'
+
+CREATE = 'create'
+UPDATE = 'update'
+DELETE = 'delete'
+'''Sent instead of a replay when the events after the requested sequence number are no longer held'''
+RESET = 'reset'
+'''Sent as the last event to a subscriber that fell further behind than its buffer allows'''
+OVERFLOW = 'overflow'
+
+
+@dataclass(frozen=True)
+class ChangeEvent:
+    seq: int
+    type: str
+    id: Optional[str] = None
+    item: Any = None
+    source: Optional[str] = None
+    ts: float = field(default_factory=time.time)
+
+    @functools.cached_property
+    def sse(self) -> bytes:
+        '''Encoded once, however many subscribers it goes to'''
+        data = fast_json.dumps({'seq': self.seq, 'type': self.type, 'id': self.id, 'source': self.source,
+                                'ts': self.ts, 'item': self.item})
+        return b'id: %d\nevent: %s\ndata: %s\n\n' % (self.seq, self.type.encode(), data)
+
+
+class Subscription:
+    '''
+    One subscriber's bounded buffer. Publishers never wait on it: when it is full the subscriber is cut off with an
+    overflow event and is expected to reconnect, resuming from the last sequence number it saw
+    '''
+    def __init__(self, buffer_size: int):
+        self.buffer_size = buffer_size
+        self.closed = False
+        self._events: Deque[ChangeEvent] = deque()
+        self._loop = asyncio.get_running_loop()
+        self._ready = asyncio.Event()
+
+    def _push(self, event: ChangeEvent) -> bool:
+        '''Called with the feed's lock held, from any thread. False when the subscriber has overflowed'''
+        if self.closed:
+            return True
+        if len(self._events) >= self.buffer_size:
+            self.closed = True
+            last = self._events[-1].seq if self._events else event.seq - 1
+            self._events.append(ChangeEvent(seq=last, type=OVERFLOW))
+            self._wake()
+            return False
+        self._events.append(event)
+        return self._wake()
+
+    def _wake(self) -> bool:
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+            return True
+        except RuntimeError:
+            # the subscriber's event loop is gone
+            self.closed = True
+            return False
+
+    async def get(self, timeout: float = None) -> Optional[ChangeEvent]:
+        '''The next event, or None when timeout passes first'''
+        while not self._events:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        return self._events.popleft()
+
+
+class ChangeFeed:
+    '''
+    Sequence-numbered create/update/delete events for a shell's writes, fanned out to subscribers. The last `history`
+    events are kept so a subscriber can resume from a sequence number. publish() is the hook for changes made outside
+    the shell and may be called from any thread
+    '''
+    def __init__(self, buffer_size: int = 1024, history: int = 10000, heartbeat_s: float = 15.0):
+        self.buffer_size = buffer_size
+        self.heartbeat_s = heartbeat_s
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._history: Deque[ChangeEvent] = deque(maxlen=history)
+        self._subscribers: List[Subscription] = []
+        self.published = 0
+        self.overflowed = 0
+
+    @property
+    def seq(self) -> int:
+        return self._seq
+
+    def publish(self, type: str, id: str = None, item: Any = None, source: str = None) -> ChangeEvent:
+        with self._lock:
+            self._seq += 1
+            # items are snapshotted as plain data, so later changes to the object don't leak into the event
+            event = ChangeEvent(seq=self._seq, type=type, id=id, item=fast_json.to_plain(item), source=source)
+            self._history.append(event)
+            self.published += 1
+            for sub in list(self._subscribers):
+                if not sub._push(event):
+                    self.overflowed += 1
+                    self._subscribers.remove(sub)
+        return event
+
+    def subscribe(self, after: int = None) -> Subscription:
+        '''A live subscription, first replaying the held events after `after` when one is given'''
+        sub = Subscription(self.buffer_size)
+        with self._lock:
+            if after is not None:
+                if (self._history and after < self._history[0].seq - 1) or after > self._seq:
+                    # the gap can't be replayed, the subscriber has to start over from a full read
+                    sub._events.append(ChangeEvent(seq=self._seq, type=RESET))
+                else:
+                    sub._events.extend(x for x in self._history if x.seq > after)
+            self._subscribers.append(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            sub.closed = True
+            if sub in self._subscribers:
+                self._subscribers.remove(sub)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'seq': self._seq, 'published': self.published, 'subscribers': len(self._subscribers),
+                    'overflowed': self.overflowed}
+
+
+async def _sse(feed: ChangeFeed, sub: Subscription, request: Request) -> AsyncIterator[bytes]:
+    try:
+        yield b'retry: 1000\n\n'
+        while True:
+            event = await sub.get(timeout=feed.heartbeat_s)
+            if event is None:
+                if await request.is_disconnected():
+                    return
+                # a comment, so proxies keep the connection open and dead clients are noticed
+                yield b': keepalive\n\n'
+                continue
+            yield event.sse
+            if event.type == OVERFLOW:
+                return
+    finally:
+        feed.unsubscribe(sub)
+
+
+def change_feed_route(feed: ChangeFeed):
+    async def changes(request: Request,
+                      after: int = Query(None, description="Replay the events after this sequence number"),
+                      last_event_id: str = Header(None)):
+        # EventSource sends Last-Event-ID by itself when it reconnects
+        if after is None and last_event_id is not None and last_event_id.isdigit():
+            after = int(last_event_id)
+        sub = feed.subscribe(after)
+        return StreamingResponse(_sse(feed, sub, request),
+                                 media_type=SSE_MEDIA_TYPE,
+                                 headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    return changes
+
+
+def publishing(callback: Callable,
+               feed: ChangeFeed,
+               events: Callable[..., Iterable[Tuple[str, str, Any]]],
+               source: str = None) -> Callable:
+    '''
+    Wrap a write callback so that once it succeeds its changes are published. events() receives the callback's
+    result followed by its arguments and returns (type, id, item) for each change
+    '''
+    if callback is None:
+        return None
+
+    def publish(ret, *args, **kwargs):
+        for type, id, item in events(ret, *args, **kwargs):
+            feed.publish(type, id=id, item=item, source=source)
+
+    if is_async(callback):
+        async def write(*args, **kwargs):
+            ret = await callback(*args, **kwargs)
+            publish(ret, *args, **kwargs)
+            return ret
+        return write
+
+    def write(*args, **kwargs):
+        ret = callback(*args, **kwargs)
+        publish(ret, *args, **kwargs)
+        return ret
+    return write
@@ -0,0 +1,129 @@
+import asyncio
+import functools
+import json
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Tuple
+from coopapi import streaming
+from coopapi.utils import is_async
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    '''
+    Collapses concurrent identical reads into one callback invocation. The first request for a key (the leader) calls
+    through; requests for the same key that arrive while it is in flight wait for, and share, its result or exception.
+    Keys carry a generation that writes bump, so a read that starts after a write never joins a flight that started
+    before it. Streams are not shared, as they can only be read once: requests that joined a flight that returned one
+    make their own call
+    '''
+    def __init__(self):
+        self.calls = 0
+        self.collapsed = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._futures: Dict[Hashable, asyncio.Future] = {}
+
+    def one_key(self, id: str, fields: List[str] = None) -> Tuple:
+        return ('one', id, tuple(fields) if fields is not None else None)
+
+    def many_key(self, query: Dict, limit: int, fields: List[str] = None) -> Tuple:
+        return ('many', json.dumps(query, sort_keys=True, default=str), limit,
+                tuple(fields) if fields is not None else None)
+
+    def invalidate(self, ids: Iterable[str] = ()):
+        with self._lock:
+            self._generation += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {'calls': self.calls, 'collapsed': self.collapsed}
+
+    def do(self, key: Hashable, fn: Callable[[], Any], on_collapsed: Callable[[], None] = None) -> Any:
+        with self._lock:
+            key = (self._generation, key)
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.collapsed += 1
+
+        if not leader:
+            if on_collapsed is not None:
+                on_collapsed()
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            if streaming.is_stream(call.result):
+                # a stream can only be consumed once, so it is not shared; each request reads its own
+                return fn()
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    async def do_async(self, key: Hashable, fn: Callable[[], Awaitable], on_collapsed: Callable[[], None] = None) -> Any:
+        # tasks are only touched from the event loop thread, the lock is just for the shared counters
+        with self._lock:
+            key = (self._generation, key)
+            task = self._futures.get(key)
+            leader = task is None
+            if leader:
+                # the call runs in its own task, so the request that started it going away doesn't cancel it for the
+                # others. Every request, the leader included, waits on it shielded
+                task = self._futures[key] = asyncio.ensure_future(fn())
+                task.add_done_callback(functools.partial(self._done, key))
+                self.calls += 1
+            else:
+                self.collapsed += 1
+
+        if not leader and on_collapsed is not None:
+            on_collapsed()
+        ret = await asyncio.shield(task)
+        if not leader and streaming.is_stream(ret):
+            return await fn()
+        return ret
+
+    def _done(self, key: Hashable, task: asyncio.Future):
+        if self._futures.get(key) is task:
+            del self._futures[key]
+        if not task.cancelled():
+            # retrieved here so it isn't reported as unhandled when every waiter has gone away
+            task.exception()
+
+def coalesced(callback: Callable,
+              flight: SingleFlight,
+              key: Callable[..., Hashable],
+              on_collapsed: Callable[[], None] = None) -> Callable:
+    '''
+    Wrap a read callback so identical concurrent calls share one invocation. key() receives the callback's arguments;
+    on_collapsed is called for each call that joined another's flight instead of running
+    '''
+    if callback is None:
+        return None
+
+    if is_async(callback):
+        async def read(*args, **kwargs):
+            return await flight.do_async(key(*args, **kwargs), lambda: callback(*args, **kwargs), on_collapsed)
+        return read
+
+    def read(*args, **kwargs):
+        return flight.do(key(*args, **kwargs), lambda: callback(*args, **kwargs), on_collapsed)
+    return read
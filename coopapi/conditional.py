@@ -0,0 +1,100 @@
+import hashlib
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Callable, List, Optional
+from fastapi import Request, Response, status
+from coopapi import fast_json
+from coopapi import projection
+from coopapi import streaming
+
+etagCallback = Callable[[Request, Any], Optional[str]]
+lastModifiedCallback = Callable[[Request, Any], Optional[datetime]]
+
+
+def _quote(etag: str) -> str:
+    if etag.startswith('"') or etag.startswith('W/"'):
+        return etag
+    return f'"{etag}"'
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == '*':
+        return True
+
+    # If-None-Match uses the weak comparison, so W/ prefixes are ignored on both sides
+    bare = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == bare:
+            return True
+    return False
+
+def _not_modified_since(if_modified_since: str, last_modified: datetime) -> bool:
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    # HTTP dates only carry whole seconds
+    return last_modified.replace(microsecond=0) <= since
+
+
+def _encode(result: Any, response_model: Any = None, fields: Optional[List[str]] = None) -> bytes:
+    if response_model is not None:
+        # the body is built here rather than by FastAPI, so the response_model's validation and filtering are too
+        result = fast_json.validated(result, response_model)
+    if fields is not None:
+        result = projection.project(result, fields)
+    return fast_json.dumps(result)
+
+
+@dataclass
+class ConditionalGet:
+    '''
+    Conditional GET handling for the shell's read routes. The ETag comes from etag_callback when given, which lets a
+    304 go out without serializing anything, otherwise (when hash_content is set) from a hash of the encoded body.
+    last_modified_callback enables If-Modified-Since. Both callbacks receive the request and the getone item or
+    getmany list as the callback returned it. Given a response_model, respond() validates the body it sends against it,
+    as FastAPI would have. Given fields, only the body is projected to them: the callbacks and the 304 decision see the
+    whole result, while a hashed ETag is of the projected body that is sent
+    '''
+    etag_callback: etagCallback = field(default=None)
+    last_modified_callback: lastModifiedCallback = field(default=None)
+    hash_content: bool = field(default=True)
+
+    def respond(self, request: Request, result: Any, response_model: Any = None, fields: List[str] = None) -> Any:
+        if isinstance(result, Response) or streaming.is_stream(result):
+            return result
+
+        body = None
+        etag = self.etag_callback(request, result) if self.etag_callback is not None else None
+        if etag is None and self.hash_content:
+            body = _encode(result, response_model, fields)
+            etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+
+        headers = {}
+        if etag is not None:
+            headers['ETag'] = _quote(etag)
+
+        last_modified = self.last_modified_callback(request, result) if self.last_modified_callback is not None else None
+        if last_modified is not None:
+            if last_modified.tzinfo is None:
+                last_modified = last_modified.replace(tzinfo=timezone.utc)
+            headers['Last-Modified'] = format_datetime(last_modified.astimezone(timezone.utc), usegmt=True)
+
+        if_none_match = request.headers.get('if-none-match')
+        if_modified_since = request.headers.get('if-modified-since')
+        if if_none_match is not None and etag is not None:
+            not_modified = _etag_matches(if_none_match, headers['ETag'])
+        elif if_none_match is None and if_modified_since is not None and last_modified is not None:
+            not_modified = _not_modified_since(if_modified_since, last_modified)
+        else:
+            not_modified = False
+
+        if not_modified:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        if body is None:
+            body = _encode(result, response_model, fields)
+        return Response(content=body, media_type='application/json', headers=headers)
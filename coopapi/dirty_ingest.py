@@ -0,0 +1,159 @@
+import csv
+import logging
+import tempfile
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs
+import pydantic
+from fastapi import Request, status
+from starlette.concurrency import run_in_threadpool
+from coopapi import http_request_handlers as hrh
+from coopapi.payload_logging import PayloadLogConfig, LazyPayload, DEFAULT_PAYLOAD_LOG_CONFIG
+from coopapi.utils import is_async
+
+logger = logging.getLogger('DirtyIngest')
+
+CSV_MEDIA_TYPE = 'text/csv'
+
+'''
+Uploads are spooled to memory up to this size and to a temporary file beyond it, so the size of an upload doesn't
+decide how much memory it takes
+'''
+SPOOL_MAX_BYTES = 1024 * 1024
+
+
+class IngestError(pydantic.BaseModel):
+    record: int
+    id: Optional[str] = None
+    status_code: int
+    detail: str
+
+
+class IngestReport(pydantic.BaseModel):
+    received: int = 0
+    created: int = 0
+    failed: int = 0
+    errors: List[IngestError] = []
+    errors_truncated: bool = False
+
+
+async def _spool(request: Request) -> tempfile.SpooledTemporaryFile:
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    async for chunk in request.stream():
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
+def _records(spool, is_csv: bool) -> Iterator[Tuple[int, Dict[str, List[str]]]]:
+    '''
+    Yield (record number, dirty data) in the shape parse_qs produces, so the shell's dirty cleaner works unchanged. CSV
+    rows are read with their header row as the keys, blank lines are skipped
+    '''
+    # decoded a line at a time, since TextIOWrapper can't wrap a SpooledTemporaryFile before Python 3.11. A line break
+    # byte is never part of a multi-byte character, so splitting the bytes first is safe
+    lines = (line.decode('utf-8') for line in spool)
+    if is_csv:
+        # the lines keep their endings, so quoted fields spanning lines still parse
+        for no, row in enumerate(csv.DictReader(lines), start=1):
+            yield no, {k: [v] for k, v in row.items() if k is not None and v not in (None, '')}
+    else:
+        for no, line in enumerate(lines, start=1):
+            line = line.strip()
+            if line:
+                yield no, parse_qs(line)
+
+
+def _prepare(records: Iterator, n: int, schema: type, cleaner: Callable[[Dict], Dict],
+             log_config: PayloadLogConfig = None) -> Tuple[int, List[Tuple[int, Any]], List[IngestError]]:
+    '''Clean and construct up to n records. Returns how many were read, the valid items and the records that failed'''
+    log_records = (log_config or DEFAULT_PAYLOAD_LOG_CONFIG).enabled(logger, logging.DEBUG)
+    read = 0
+    items = []
+    errors = []
+    for no, dirty_data in records:
+        read += 1
+        try:
+            clean_data = cleaner(dirty_data)
+            if log_records:
+                logger.debug("Record %s cleaned to %s", no, LazyPayload(clean_data, log_config))
+            items.append((no, schema(**clean_data)))
+        except Exception as e:
+            errors.append(IngestError(record=no,
+                                      status_code=status.HTTP_400_BAD_REQUEST,
+                                      detail=f"Record could not be interpreted as [{schema.__name__}]: {e}"))
+        if read >= n:
+            break
+    return read, items, errors
+
+
+async def _call(callback: Callable, *args) -> Any:
+    if is_async(callback):
+        return await callback(*args)
+    return await run_in_threadpool(callback, *args)
+
+
+async def _write(request: Request,
+                 items: List[Any],
+                 create_callback: hrh.postRequestCallback,
+                 create_many_callback: hrh.postManyRequestCallback) -> List[Any]:
+    '''One result or exception per item, written in one batch when there is a batch callback'''
+    if create_many_callback is not None:
+        try:
+            rets = await _call(create_many_callback, request, items)
+        except Exception as e:
+            return [e] * len(items)
+        if len(rets) != len(items):
+            return [TypeError(f"The batch callback returned {len(rets)} results for {len(items)} items")] * len(items)
+        return rets
+
+    rets = []
+    for item in items:
+        try:
+            rets.append(await _call(create_callback, request, item))
+        except Exception as e:
+            rets.append(e)
+    return rets
+
+
+def dirty_ingest_route(create_callback: hrh.postRequestCallback,
+                       create_many_callback: hrh.postManyRequestCallback,
+                       schema: type,
+                       cleaner: Callable[[Dict], Dict],
+                       chunk_size: int = 500,
+                       max_errors: int = 1000,
+                       log_config: PayloadLogConfig = None):
+    '''
+    Bulk version of the dirty route. The body is newline-delimited form strings, or CSV with a header row when sent as
+    text/csv. Records are cleaned and validated chunk_size at a time and each chunk is written as one batch, so a bad
+    record only fails itself; the response counts what was created and lists (up to max_errors of) the failures.
+    Cleaned records are logged at debug through log_config
+    '''
+    async def dirty_ingest(request: Request) -> IngestReport:
+        is_csv = request.headers.get('content-type', '').split(';')[0].strip() == CSV_MEDIA_TYPE
+        report = IngestReport()
+
+        with await _spool(request) as spool:
+            records = _records(spool, is_csv)
+            while True:
+                read, items, errors = await run_in_threadpool(_prepare, records, chunk_size, schema, cleaner, log_config)
+                if read == 0:
+                    break
+
+                rets = await _write(request, [x for _, x in items], create_callback, create_many_callback) if items else []
+                for (no, item), ret in zip(items, rets):
+                    code, detail = hrh.batch_item_status(schema, getattr(item, 'id', None), ret)
+                    if detail is None:
+                        report.created += 1
+                    else:
+                        errors.append(IngestError(record=no, id=getattr(item, 'id', None), status_code=code, detail=detail))
+
+                report.received += read
+                report.failed += len(errors)
+                room = max_errors - len(report.errors)
+                report.errors += sorted(errors, key=lambda x: x.record)[:room]
+                report.errors_truncated |= len(errors) > room
+
+        logger.info("Ingested %s %s records: %s created, %s failed",
+                    report.received, schema.__name__, report.created, report.failed)
+        return report
+    return dirty_ingest
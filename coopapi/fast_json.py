@@ -0,0 +1,98 @@
+import dataclasses
+import functools
+import json
+import logging
+from typing import Any, Callable, Dict, Optional, Tuple
+from fastapi import HTTPException, Response, status
+from fastapi.encoders import jsonable_encoder
+import pydantic
+from coopapi.utils import is_async
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger('FastJson')
+
+JSON_MEDIA_TYPE = 'application/json'
+
+_dataclass_fields: Dict[type, Optional[Tuple[str, ...]]] = {}
+
+
+def _field_names(t: type) -> Optional[Tuple[str, ...]]:
+    try:
+        return _dataclass_fields[t]
+    except KeyError:
+        names = tuple(f.name for f in dataclasses.fields(t)) if dataclasses.is_dataclass(t) else None
+        _dataclass_fields[t] = names
+        return names
+
+
+def to_plain(obj: Any) -> Any:
+    '''
+    Equivalent of jsonable_encoder for the shapes callbacks usually return (dataclasses, dicts, lists and scalars),
+    reading dataclass fields directly instead of deep-copying through dataclasses.asdict. Anything else is handed to
+    jsonable_encoder
+    '''
+    t = type(obj)
+    if obj is None or t is str or t is int or t is float or t is bool:
+        return obj
+    if t is list or t is tuple:
+        return [to_plain(x) for x in obj]
+    if t is dict:
+        return {k if type(k) is str else jsonable_encoder(k): to_plain(v) for k, v in obj.items()}
+    names = _field_names(t)
+    if names is not None:
+        return {n: to_plain(getattr(obj, n)) for n in names}
+    return jsonable_encoder(obj)
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=jsonable_encoder, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(to_plain(obj), separators=(',', ':')).encode()
+
+
+def validated(obj: Any, response_model: Any, exclude_unset: bool = False) -> Any:
+    '''Validate and filter obj through response_model and encode the result, as FastAPI does with a route's return'''
+    return jsonable_encoder(pydantic.parse_obj_as(response_model, obj), exclude_unset=exclude_unset)
+
+
+def _verify(body: bytes, response_model: Any, exclude_unset: bool = False):
+    '''Check that the fast encoding is what validating against response_model would have produced'''
+    sent = json.loads(body)
+    try:
+        expected = validated(sent, response_model, exclude_unset)
+    except pydantic.ValidationError as e:
+        expected = e
+    if expected != sent:
+        msg = f"Trusted output does not match the response model [{response_model}]: {expected}"
+        logger.error(msg)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=msg)
+
+
+def trusted_endpoint(endpoint: Callable, status_code: int, response_model: Any = None, exclude_unset: bool = False) -> Callable:
+    '''
+    Wrap a route endpoint so that whatever it returns is encoded straight to a json Response, skipping FastAPI's
+    response_model validation and re-serialization. The route keeps its response_model, so the docs don't change.
+    With a response_model given here, each response is also checked against it (for tests, not production)
+    '''
+    def respond(ret: Any) -> Any:
+        if isinstance(ret, Response):
+            return ret
+        body = dumps(ret)
+        if response_model is not None:
+            _verify(body, response_model, exclude_unset)
+        return Response(content=body, status_code=status_code, media_type=JSON_MEDIA_TYPE)
+
+    if is_async(endpoint):
+        @functools.wraps(endpoint)
+        async def trusted(*args, **kwargs):
+            return respond(await endpoint(*args, **kwargs))
+        return trusted
+
+    @functools.wraps(endpoint)
+    def trusted(*args, **kwargs):
+        return respond(endpoint(*args, **kwargs))
+    return trusted
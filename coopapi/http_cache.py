@@ -0,0 +1,325 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from datetime import timedelta
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+import requests
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+logger = logging.getLogger('coop.http.cache')
+
+'''Statuses a response may be cached with. Anything else always goes to the network'''
+CACHEABLE_STATUSES = frozenset([200, 203, 300, 301, 410])
+
+'''Headers a 304 carries that replace the stored ones'''
+_REFRESHED_HEADERS = ('cache-control', 'expires', 'etag', 'last-modified', 'date', 'age', 'vary')
+
+
+def _directives(cache_control: Optional[str]) -> Dict[str, Optional[str]]:
+    ret = {}
+    for part in (cache_control or '').split(','):
+        name, _, value = part.strip().partition('=')
+        if name:
+            ret[name.lower()] = value.strip('"') if value else None
+    return ret
+
+
+def _http_date(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def _int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    url: str
+    status_code: int
+    headers: Dict[str, str]
+    content: bytes
+    stored_at: float
+    '''request headers named by the response's Vary, as they were sent'''
+    vary: Dict[str, Optional[str]] = field(default_factory=dict)
+
+    @property
+    def expires_at(self) -> float:
+        '''When the response goes stale: max-age, else Expires, counted from when it was generated'''
+        headers = CaseInsensitiveDict(self.headers)
+        directives = _directives(headers.get('cache-control'))
+        if 'no-cache' in directives:
+            return self.stored_at
+        age = _int(headers.get('age')) or 0
+        max_age = _int(directives.get('max-age'))
+        if max_age is not None:
+            return self.stored_at + max_age - age
+        expires = _http_date(headers.get('expires'))
+        if expires is not None:
+            date = _http_date(headers.get('date'))
+            # Expires is judged against the server's clock where there is one
+            return self.stored_at + expires - (date if date is not None else self.stored_at)
+        return self.stored_at
+
+    def fresh(self, now: float) -> bool:
+        return now < self.expires_at
+
+    @property
+    def validators(self) -> Dict[str, str]:
+        headers = CaseInsensitiveDict(self.headers)
+        ret = {}
+        if headers.get('etag'):
+            ret['If-None-Match'] = headers['etag']
+        if headers.get('last-modified'):
+            ret['If-Modified-Since'] = headers['last-modified']
+        return ret
+
+    def matches(self, request_headers: CaseInsensitiveDict) -> bool:
+        return all(request_headers.get(k) == v for k, v in self.vary.items())
+
+    def refreshed(self, not_modified: Response, now: float) -> 'CachedResponse':
+        headers = CaseInsensitiveDict(self.headers)
+        for name in _REFRESHED_HEADERS:
+            if name in not_modified.headers:
+                headers[name] = not_modified.headers[name]
+            elif name == 'age':
+                # the stored Age was for the old copy, the 304 has just been generated
+                headers.pop(name, None)
+        return replace(self, headers=dict(headers), stored_at=now)
+
+    def to_response(self) -> Response:
+        response = Response()
+        response.url = self.url
+        response.status_code = self.status_code
+        response.headers = CaseInsensitiveDict(self.headers)
+        response._content = self.content
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.elapsed = timedelta(0)
+        response.from_cache = True
+        return response
+
+
+class MemoryTier:
+    '''Bounded LRU of cached responses'''
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, CachedResponse]' = OrderedDict()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: CachedResponse):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SqliteTier:
+    '''
+    Cached responses in a sqlite file, so they outlive the process. Holds at most max_entries, dropping the least
+    recently stored
+    '''
+    _PRUNE_EVERY = 100
+
+    def __init__(self, path: str, max_entries: int = 100000):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS responses ('
+                               'key TEXT PRIMARY KEY, url TEXT, status_code INTEGER, headers TEXT, content BLOB, '
+                               'stored_at REAL, vary TEXT)')
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            row = self._conn.execute('SELECT url, status_code, headers, content, stored_at, vary FROM responses '
+                                     'WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        url, status_code, headers, content, stored_at, vary = row
+        return CachedResponse(url=url, status_code=status_code, headers=json.loads(headers), content=content,
+                              stored_at=stored_at, vary=json.loads(vary))
+
+    def set(self, key: str, entry: CachedResponse):
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               (key, entry.url, entry.status_code, json.dumps(entry.headers), entry.content,
+                                entry.stored_at, json.dumps(entry.vary)))
+            self._writes += 1
+            if self._writes % self._PRUNE_EVERY == 0:
+                self._conn.execute('DELETE FROM responses WHERE key IN '
+                                   '(SELECT key FROM responses ORDER BY stored_at DESC LIMIT -1 OFFSET ?)',
+                                   (self.max_entries,))
+
+    def delete(self, key: str):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM responses')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class HttpCache:
+    '''
+    Client side cache for HttpClient GETs, following the response's Cache-Control (max-age, no-cache, no-store, Vary)
+    and Expires. A fresh entry is served without touching the network; a stale one with an ETag or Last-Modified is
+    revalidated with a conditional request, and a 304 refreshes it. Entries live in a bounded in-memory LRU and, when
+    path is given, in a sqlite file behind it that persists across runs. Bodies over max_body_bytes are not cached
+    '''
+    def __init__(self,
+                 max_entries: int = 1024,
+                 path: str = None,
+                 max_disk_entries: int = 100000,
+                 max_body_bytes: int = 1024 * 1024):
+        self.memory = MemoryTier(max_entries)
+        self.disk = SqliteTier(path, max_disk_entries) if path is not None else None
+        self.max_body_bytes = max_body_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(url: str, params=None, headers: CaseInsensitiveDict = None) -> str:
+        '''The full url, and the credentials it was fetched with, so one caller's responses are never served to another'''
+        full_url = requests.Request('GET', url, params=params).prepare().url
+        auth = (headers or {}).get('authorization') or ''
+        return hashlib.sha256(f"{full_url}\n{auth}".encode()).hexdigest()
+
+    def get(self, key: str, request_headers: CaseInsensitiveDict) -> Optional[CachedResponse]:
+        entry = self.memory.get(key)
+        if entry is None and self.disk is not None:
+            entry = self.disk.get(key)
+            if entry is not None:
+                self.memory.set(key, entry)
+        if entry is not None and not entry.matches(request_headers):
+            return None
+        return entry
+
+    def store(self, key: str, response: Response, request_headers: CaseInsensitiveDict, now: float) -> Optional[CachedResponse]:
+        if response.status_code not in CACHEABLE_STATUSES:
+            return None
+        directives = _directives(response.headers.get('cache-control'))
+        vary = [x.strip().lower() for x in response.headers.get('vary', '').split(',') if x.strip()]
+        if 'no-store' in directives or '*' in vary or len(response.content) > self.max_body_bytes:
+            return None
+
+        entry = CachedResponse(url=response.url,
+                               status_code=response.status_code,
+                               headers=dict(response.headers),
+                               content=response.content,
+                               stored_at=now,
+                               vary={k: request_headers.get(k) for k in vary})
+        if not entry.fresh(now) and not entry.validators:
+            # it could never be served or revalidated
+            return None
+        self.put(key, entry)
+        return entry
+
+    def put(self, key: str, entry: CachedResponse):
+        self.memory.set(key, entry)
+        if self.disk is not None:
+            self.disk.set(key, entry)
+
+    def invalidate(self, key: str):
+        self.memory.delete(key)
+        if self.disk is not None:
+            self.disk.delete(key)
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+    def count(self, outcome: str):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.revalidated + self.misses
+            return {'hits': self.hits,
+                    'revalidated': self.revalidated,
+                    'misses': self.misses,
+                    'hit_rate': (self.hits + self.revalidated) / total if total else 0.0}
+
+    def send(self, session_request, url: str, method: str, headers: Dict[str, str], **kwargs) -> Response:
+        '''
+        Make a request through the cache. session_request is the underlying call, eg requests.Session.request. Only
+        plain GETs are served from the cache; successful unsafe requests drop the url's entry
+        '''
+        request_headers = CaseInsensitiveDict(headers)
+        key = self.key(url, kwargs.get('params'), request_headers)
+
+        if method != 'GET' or kwargs.get('stream'):
+            response = session_request(method=method, url=url, headers=headers, **kwargs)
+            if method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+                self.invalidate(key)
+            return response
+
+        request_directives = _directives(request_headers.get('cache-control'))
+        if 'no-store' in request_directives:
+            return session_request(method=method, url=url, headers=headers, **kwargs)
+
+        now = time.time()
+        entry = self.get(key, request_headers)
+        if entry is not None and entry.fresh(now) and 'no-cache' not in request_directives:
+            self.count('hits')
+            return entry.to_response()
+
+        if entry is not None:
+            headers = {**entry.validators, **headers}
+        response = session_request(method=method, url=url, headers=headers, **kwargs)
+        now = time.time()
+
+        if response.status_code == 304 and entry is not None:
+            self.count('revalidated')
+            entry = entry.refreshed(response, now)
+            self.put(key, entry)
+            return entry.to_response()
+
+        self.count('misses')
+        self.store(key, response, request_headers, now)
+        return response
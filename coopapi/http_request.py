@@ -1,32 +1,152 @@
 import logging
+import threading
 import uuid
 
 import requests
-from typing import Dict, Any
-from fastapi import Request, HTTPException, status, Response
+from requests import Response
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Dict, Any, Iterable, Tuple, Union
 from coopapi.enums import RequestType
-import json
-import pprint
+from coopapi.http_cache import HttpCache
+from coopapi.tracing import REQUEST_ID_HEADER
+from coopapi.payload_logging import PayloadLogConfig, DEFAULT_PAYLOAD_LOG_CONFIG
 logger = logging.getLogger('coop.http')
 
+'''
+(connect, read) timeouts in seconds, so that a host which stops answering fails the request rather than hanging it. A
+connect timeout just over a multiple of 3s leaves room for a retransmitted SYN
+'''
+DEFAULT_TIMEOUT = (3.05, 30.0)
+
 
 def _response_handler(response: Response):
     pass
 
-def _log_send(id:str, lvl: int, method: RequestType, url, label: str = None, **kwargs):
+def _log_send(id:str, lvl: int, method: RequestType, url, label: str = None, log_config: PayloadLogConfig = None, **kwargs):
+    if not logger.isEnabledFor(lvl):
+        return
+    log_config = log_config or DEFAULT_PAYLOAD_LOG_CONFIG
+
     _lbl_txt = f"[{label}]: " if label else ""
     _txt = f"{_lbl_txt}{method.name} @URL: {url} [{id}]"
     if kwargs.get('data', None) is not None:
-        _txt += f"\ndata: {pprint.pformat(kwargs['data'])}"
+        _txt += f"\ndata: {log_config.format(kwargs['data'])}"
     if kwargs.get('json', None) is not None:
-        _txt += f"\njson: {pprint.pformat(kwargs['json'])}"
+        _txt += f"\njson: {log_config.format(kwargs['json'])}"
 
     logger.log(lvl, _txt)
 
-def _log_receive(id:str, lvl:int , method: RequestType, response: Response, url, label: str = None):
+def _log_receive(id:str, lvl:int , method: RequestType, response: Response, url, label: str = None, log_config: PayloadLogConfig = None):
+    if not logger.isEnabledFor(lvl):
+        return
+    log_config = log_config or DEFAULT_PAYLOAD_LOG_CONFIG
+
     _lbl_txt = f"[{label}]: " if label else ""
-    logger.log(lvl, f"{_lbl_txt}{method.name} @URL: {url} returned [{response.status_code}] [{id}] in {int(response.elapsed.microseconds / 1000)} ms\n"
-                     f"{pprint.pformat(json.loads(response.content.decode(response.encoding)))}")
+    logger.log(lvl, f"{_lbl_txt}{method.name} @URL: {url} returned [{response.status_code}] [{id}] in {int(response.elapsed.total_seconds() * 1000)} ms\n"
+                     f"{log_config.format_content(response.content, response.encoding)}")
+
+class HttpClient:
+    '''
+    Reusable client over a pooled, keep-alive requests.Session. Connections to a host are kept open between calls so
+    repeated requests skip the TCP/TLS handshake. Payload logging follows log_config. Idempotent verbs are retried with exponential backoff on connection
+    errors and on retry_statuses. host_pool_sizes overrides pool_maxsize for specific hosts, eg {'api.example.com': 50}.
+    With a cache, GETs are served from it while fresh and revalidated once stale. timeout is in seconds, or a (connect,
+    read) tuple, and defaults to DEFAULT_TIMEOUT; None waits forever
+    '''
+    IDEMPOTENT_METHODS = frozenset([RequestType.GET.value,
+                                    RequestType.HEAD.value,
+                                    RequestType.PUT.value,
+                                    RequestType.DELETE.value,
+                                    RequestType.OPTIONS.value])
+
+    def __init__(self,
+                 pool_connections: int = 10,
+                 pool_maxsize: int = 10,
+                 host_pool_sizes: Dict[str, int] = None,
+                 timeout: Union[float, Tuple[float, float]] = DEFAULT_TIMEOUT,
+                 retries: int = 2,
+                 backoff_factor: float = 0.1,
+                 retry_statuses: Iterable[int] = (502, 503, 504),
+                 verify: bool = True,
+                 log_config: PayloadLogConfig = None,
+                 cache: HttpCache = None):
+        self.timeout = timeout
+        self.cache = cache
+        self.verify = verify
+        self.log_config = log_config or DEFAULT_PAYLOAD_LOG_CONFIG
+        self._retry = Retry(total=retries,
+                            backoff_factor=backoff_factor,
+                            status_forcelist=tuple(retry_statuses),
+                            allowed_methods=self.IDEMPOTENT_METHODS,
+                            raise_on_status=False)
+        self.session = requests.Session()
+        self.session.mount('http://', self._adapter(pool_connections, pool_maxsize))
+        self.session.mount('https://', self._adapter(pool_connections, pool_maxsize))
+        for host, size in (host_pool_sizes or {}).items():
+            self.session.mount(f'http://{host}', self._adapter(1, size))
+            self.session.mount(f'https://{host}', self._adapter(1, size))
+
+    def _adapter(self, pool_connections: int, pool_maxsize: int) -> HTTPAdapter:
+        return HTTPAdapter(pool_connections=pool_connections,
+                           pool_maxsize=pool_maxsize,
+                           max_retries=self._retry)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def request(self,
+                url: str,
+                method: RequestType,
+                bearer_token: str = None,
+                loggingLvl=logging.INFO,
+                label: str = None,
+                request_id: str = None,
+                **kwargs) -> Response:
+        headers = dict(kwargs.pop('headers', None) or {})
+        if bearer_token is not None:
+            headers['Authorization'] = f"Bearer {bearer_token}"
+        kwargs.setdefault('timeout', self.timeout)
+        kwargs.setdefault('verify', self.verify)
+
+        if request_id is None:
+            request_id = str(uuid.uuid4())
+        headers.setdefault(REQUEST_ID_HEADER, request_id)
+        sampled = self.log_config.enabled(logger, loggingLvl)
+        if sampled:
+            _log_send(id=request_id, lvl=loggingLvl, method=method, url=url, label=label, log_config=self.log_config, **kwargs)
+        if self.cache is not None:
+            response: Response = self.cache.send(self.session.request, method=method.value, url=url, headers=headers, **kwargs)
+        else:
+            response: Response = self.session.request(method=method.value, url=url, headers=headers, **kwargs)
+        if sampled:
+            _log_receive(id=request_id, lvl=loggingLvl, method=method, url=url, label=label, log_config=self.log_config, response=response)
+        return response
+
+
+_default_client: HttpClient = None
+_default_client_lock = threading.Lock()
+
+def default_client() -> HttpClient:
+    '''The shared client behind the module level functions, created on first use'''
+    global _default_client
+    if _default_client is None:
+        with _default_client_lock:
+            if _default_client is None:
+                _default_client = HttpClient()
+    return _default_client
+
+def set_default_client(client: HttpClient):
+    global _default_client
+    with _default_client_lock:
+        _default_client = client
+
 
 def request(url: str,
             method: RequestType,
@@ -35,16 +155,13 @@ def request(url: str,
             label: str = None,
             request_id: str = None,
             **kwargs) -> Response:
-    headers = {}
-    if bearer_token is not None:
-        headers['Authorization'] = f"Bearer {bearer_token}"
-
-    if request_id is None:
-        request_id = str(uuid.uuid4())
-    _log_send(id=request_id, lvl=loggingLvl, method=method, url=url, label=label, **kwargs)
-    response: Response = requests.request(method=method.value, url=url, verify=True, headers=headers, **kwargs)
-    _log_receive(id=request_id, lvl=loggingLvl, method=method, url=url, label=label, response=response)
-    return response
+    return default_client().request(url=url,
+                                    method=method,
+                                    bearer_token=bearer_token,
+                                    loggingLvl=loggingLvl,
+                                    label=label,
+                                    request_id=request_id,
+                                    **kwargs)
 
 
 def get(url: str,
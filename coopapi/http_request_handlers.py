@@ -1,8 +1,14 @@
 from coopapi import errors as errors
+from coopapi.projection import schema_fields
+from coopapi.payload_logging import PayloadLogConfig, LazyPayload, DEFAULT_PAYLOAD_LOG_CONFIG
 import logging
 from fastapi import Request, HTTPException, status
-from typing import List, Dict, Callable, TypeVar, Optional, Any
+from typing import List, Dict, Callable, TypeVar, Optional, Any, Awaitable, Union, Tuple, Iterable, AsyncIterable, Type
+import copy
+import functools
+import typing
 import pydantic
+from pydantic.fields import FieldInfo, ModelField
 from starlette.responses import RedirectResponse
 
 logger = logging.getLogger('HTTPHandler')
@@ -13,109 +19,347 @@ postRequestCallback = Callable[[Request, T], T]
 getManyRequestCallback = Callable[[Request, Optional[Dict], Optional[int]], List[T]]
 getOneRequestCallback = Callable[[Request, str], T]
 putRequestCallback = Callable[[Request, str, Dict], T]
+patchRequestCallback = Callable[[Request, str, Dict[str, Any]], T]
 deleteRequestCallback = Callable[[Request, str], bool]
 jsonRequestCallback = Callable[[Request, str], T]
+getManyStreamRequestCallback = Callable[[Request, Optional[Dict], Optional[int], Optional[str]], Union[Iterable[T], AsyncIterable[T]]]
 
-def post_request_handler(request: Request, item: T, on_post_callback: postRequestCallback) -> T:
-    code = None
-    msg = None
-    er = None
+asyncPostRequestCallback = Callable[[Request, T], Awaitable[T]]
+asyncGetManyRequestCallback = Callable[[Request, Optional[Dict], Optional[int]], Awaitable[List[T]]]
+asyncGetOneRequestCallback = Callable[[Request, str], Awaitable[T]]
+asyncPutRequestCallback = Callable[[Request, str, Dict], Awaitable[T]]
+asyncPatchRequestCallback = Callable[[Request, str, Dict[str, Any]], Awaitable[T]]
+asyncDeleteRequestCallback = Callable[[Request, str], Awaitable[bool]]
 
+
+def _raise_http(code: int, msg: str, er: Exception = None):
+    logger.error(msg)
+    raise HTTPException(status_code=code,
+                        detail=msg) from er
+
+
+'''
+Each handler is split into the part that calls the callback and the parts that interpret its result or error. The
+interpretation is shared between the sync handlers and their async_ counterparts so both behave identically.
+'''
+
+def _post_result(item: T, ret: T, log_config: PayloadLogConfig = None) -> T:
+    if (log_config or DEFAULT_PAYLOAD_LOG_CONFIG).enabled(logger, logging.INFO):
+        logger.info("Creation Successful for item %s", LazyPayload(item, log_config))
+
+    if type(ret) != type(item):
+        raise TypeError(f"The on_create_callback method did not return the correct type")
+
+    return ret
+
+def _post_error(item: T, e: Exception):
+    if isinstance(e, pydantic.error_wrappers.ValidationError):
+        _raise_http(status.HTTP_400_BAD_REQUEST, f"Malformed json could not be interpreted as [{type(item).__name__}]: {e}", e)
+    elif isinstance(e, errors.DuplicateException):
+        _raise_http(status.HTTP_409_CONFLICT, f"Record [{type(item).__name__}] already exists with id '{item.id}'. {e}", e)
+    else:
+        _raise_http(status.HTTP_500_INTERNAL_SERVER_ERROR, f"Unhandled error [{type(e)}]: {e}", e)
+
+def post_request_handler(request: Request, item: T, on_post_callback: postRequestCallback, log_config: PayloadLogConfig = None) -> T:
+    try:
+        return _post_result(item, on_post_callback(request, item), log_config)
+    except Exception as e:
+        _post_error(item, e)
+
+async def async_post_request_handler(request: Request, item: T, on_post_callback: asyncPostRequestCallback, log_config: PayloadLogConfig = None) -> T:
     try:
-        ret = on_post_callback(request, item)
-        logger.info(f"Creation Successful for item {item}")
+        return _post_result(item, await on_post_callback(request, item), log_config)
+    except Exception as e:
+        _post_error(item, e)
+
 
-        if type(ret) != type(item):
-            raise TypeError(f"The on_create_callback method did not return the correct type")
+def _getmany_error(e: Exception):
+    _raise_http(status.HTTP_500_INTERNAL_SERVER_ERROR, f"Unhandled error [{type(e)}]: {e}", e)
 
-        return ret
-    except pydantic.error_wrappers.ValidationError as e:
-        code = status.HTTP_400_BAD_REQUEST
-        msg = f"Malformed json could not be interpreted as [{type(item).__name__}]: {e}"
-        er = e
-    except errors.DuplicateException as e:
-        code = status.HTTP_409_CONFLICT
-        msg = f"Record [{type(item).__name__}] already exists with id '{item.id}'. {e}"
-        er = e
+def _fields_kwargs(fields: Optional[List[str]]) -> Dict:
+    # fields is only passed to callbacks that take it, so those written before it existed are called as they were
+    return {'fields': fields} if fields is not None else {}
+
+def getmany_request_handler(request: Request, on_getmany_callback: getManyRequestCallback, query: Dict = None, limit: int = None, fields: List[str] = None) -> List[T]:
+    try:
+        return on_getmany_callback(request, query, limit, **_fields_kwargs(fields))
     except Exception as e:
-        code = status.HTTP_500_INTERNAL_SERVER_ERROR
-        msg = f"Unhandled error [{type(e)}]: {e}"
-        er = e
-    finally:
-        if code is not None or msg is not None:
-            logger.error(msg)
-            raise HTTPException(status_code=code,
-                                detail=msg) from er
+        _getmany_error(e)
 
+async def async_getmany_request_handler(request: Request, on_getmany_callback: asyncGetManyRequestCallback, query: Dict = None, limit: int = None, fields: List[str] = None) -> List[T]:
+    try:
+        return await on_getmany_callback(request, query, limit, **_fields_kwargs(fields))
+    except Exception as e:
+        _getmany_error(e)
 
-def getmany_request_handler(request: Request, on_getmany_callback: getManyRequestCallback, query: Dict = None, limit: int = None) -> List[T]:
-    code = None
-    msg = None
-    er = None
+def getmany_stream_request_handler(request: Request, on_getmany_stream_callback: getManyStreamRequestCallback, query: Dict = None, limit: int = None, after: str = None) -> Iterable[T]:
+    try:
+        return on_getmany_stream_callback(request, query, limit, after)
+    except Exception as e:
+        _getmany_error(e)
 
+async def async_getmany_stream_request_handler(request: Request, on_getmany_stream_callback: Callable[..., Awaitable], query: Dict = None, limit: int = None, after: str = None) -> AsyncIterable[T]:
     try:
-        return on_getmany_callback(request, query, limit)
+        return await on_getmany_stream_callback(request, query, limit, after)
     except Exception as e:
-        code = status.HTTP_500_INTERNAL_SERVER_ERROR
-        msg = f"Unhandled error [{type(e)}]: {e}"
-        er = e
-    finally:
-        if code is not None or msg is not None:
-            logger.error(msg)
-            raise HTTPException(status_code=code,
-                                detail=msg) from er
+        _getmany_error(e)
 
 
-def getone_request_handler(id: str, request: Request, obj_type: type, on_getone_callback: getOneRequestCallback) -> List[T]:
-    code = None
-    msg = None
+def _getone_error(id: str, obj_type: type, e: Exception):
+    if isinstance(e, errors.NotFoundException):
+        _raise_http(status.HTTP_404_NOT_FOUND, f"{obj_type.__name__} with ID {id} not found. {e}")
+    else:
+        _raise_http(status.HTTP_500_INTERNAL_SERVER_ERROR, f"Unhandled error [{type(e)}]: {e}")
 
+def getone_request_handler(id: str, request: Request, obj_type: type, on_getone_callback: getOneRequestCallback, fields: List[str] = None) -> T:
     try:
-        return on_getone_callback(request, id)
-    except errors.NotFoundException as e:
-        code = status.HTTP_404_NOT_FOUND
-        msg = f"{obj_type.__name__} with ID {id} not found. {e}"
+        return on_getone_callback(request, id, **_fields_kwargs(fields))
     except Exception as e:
-        code = status.HTTP_500_INTERNAL_SERVER_ERROR
-        msg = f"Unhandled error [{type(e)}]: {e}"
-    finally:
-        if code is not None or msg is not None:
-            logger.error(msg)
-            raise HTTPException(status_code=code,
-                                detail=msg)
+        _getone_error(id, obj_type, e)
 
+async def async_getone_request_handler(id: str, request: Request, obj_type: type, on_getone_callback: asyncGetOneRequestCallback, fields: List[str] = None) -> T:
+    try:
+        return await on_getone_callback(request, id, **_fields_kwargs(fields))
+    except Exception as e:
+        _getone_error(id, obj_type, e)
+
+
+def _put_result(update_values: Dict, updated_item: T, log_config: PayloadLogConfig = None) -> T:
+    if (log_config or DEFAULT_PAYLOAD_LOG_CONFIG).enabled(logger, logging.INFO):
+        logger.info("Update Successful for item %s with new values %s",
+                    LazyPayload(updated_item, log_config),
+                    LazyPayload(update_values, log_config))
+    return updated_item
+
+def put_request_handler(request: Request, id: str, update_values: Dict, obj_type: type, on_put_callback: putRequestCallback, log_config: PayloadLogConfig = None):
+    try:
+        return _put_result(update_values, on_put_callback(request, id, update_values), log_config)
+    except errors.NotFoundException:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"{obj_type.__name__} with ID {id} not found")
 
-def put_request_handler(request: Request, id: str, update_values: Dict, obj_type: type, on_put_callback: putRequestCallback):
+async def async_put_request_handler(request: Request, id: str, update_values: Dict, obj_type: type, on_put_callback: asyncPutRequestCallback, log_config: PayloadLogConfig = None):
     try:
-        updated_item = on_put_callback(request, id, update_values)
-        logger.info(f"Update Successful for item {updated_item} with new values {update_values}")
-        return updated_item
+        return _put_result(update_values, await on_put_callback(request, id, update_values), log_config)
     except errors.NotFoundException:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"{obj_type.__name__} with ID {id} not found")
 
 
+'''
+Patch handlers. The body is validated against patch_model(schema), where every field is optional, and only the fields
+the client actually sent reach the callback, as a {field: new value} diff the backend can apply as a targeted update
+'''
+
+def _schema_types(schema: type) -> Dict[str, Any]:
+    hints = typing.get_type_hints(schema)
+    return {name: hints.get(name, Any) for name in schema_fields(schema)}
+
+
+@functools.lru_cache(maxsize=None)
+def _schema_model(schema: type) -> Type[pydantic.BaseModel]:
+    '''The pydantic model that validates schema: itself, a pydantic dataclass's model, or one built from a dataclass'''
+    if isinstance(schema, type) and issubclass(schema, pydantic.BaseModel):
+        return schema
+    model = getattr(schema, '__pydantic_model__', None)
+    if model is not None:
+        return model
+    return pydantic.create_model(schema.__name__, **{name: (hint, ...) for name, hint in _schema_types(schema).items()})
+
+
+class _PatchConfig:
+    extra = pydantic.Extra.forbid
+    allow_population_by_field_name = True
+
+
+def _optional(field: ModelField, hint: Any) -> Tuple[Any, FieldInfo]:
+    # the schema's own FieldInfo, so constraints (max_length, ge...) and aliases carry over, minus its default
+    info = copy.copy(field.field_info)
+    info.default = None
+    info.default_factory = None
+    return Optional[hint], info
+
+
+def _not_null(cls, v):
+    if v is None:
+        raise ValueError('none is not an allowed value')
+    return v
+
+
+def _field_validators(fields: Dict[str, ModelField]) -> Dict[str, Any]:
+    # always=False as an unset field is not being changed. Root validators are left out, as they judge a whole item
+    ret = {f"{name}_{v.func.__name__}_{i}": pydantic.validator(name, pre=v.pre, each_item=v.each_item,
+                                                               check_fields=False, allow_reuse=True)(v.func)
+           for name, field in fields.items()
+           for i, v in enumerate((field.class_validators or {}).values())}
+    not_null = [name for name, field in fields.items() if not field.allow_none]
+    if not_null:
+        # every field is Optional here so it can be left out, but null is only a value where the schema allows it
+        ret['_not_null'] = pydantic.validator(*not_null, pre=True, allow_reuse=True)(_not_null)
+    return ret
+
+
+@functools.lru_cache(maxsize=None)
+def patch_model(item_type: type) -> type:
+    '''
+    The fields of item_type other than id, all optional, rejecting unknown fields. Each field keeps the schema's
+    constraints and validators, so whatever a patch sets is valid for the schema
+    '''
+    hints = typing.get_type_hints(item_type)
+    fields = {name: f for name, f in _schema_model(item_type).__fields__.items() if name != 'id'}
+    return pydantic.create_model(f"{getattr(item_type, '__name__', 'Item')}Patch",
+                                 __config__=_PatchConfig,
+                                 __validators__=_field_validators(fields),
+                                 **{name: _optional(f, hints.get(name, f.outer_type_)) for name, f in fields.items()})
+
+
+@functools.lru_cache(maxsize=None)
+def patch_changes_model(item_type: type) -> type:
+    '''The response of a changes-only patch: the id and the fields that were changed'''
+    return pydantic.create_model(f"{getattr(item_type, '__name__', 'Item')}Changes",
+                                 __base__=patch_model(item_type),
+                                 id=(str, ...))
+
+
+def patch_changes(patch: pydantic.BaseModel, obj_type: type) -> Dict[str, Any]:
+    '''The fields the client sent, rejecting an empty patch'''
+    changes = patch.dict(exclude_unset=True)
+    if not changes:
+        _raise_http(status.HTTP_400_BAD_REQUEST, f"Patch for [{obj_type.__name__}] has no fields to change")
+    return changes
+
+
+def _patch_result(id: str, changes: Dict[str, Any], patched_item: T, changes_only: bool, log_config: PayloadLogConfig = None):
+    if (log_config or DEFAULT_PAYLOAD_LOG_CONFIG).enabled(logger, logging.INFO):
+        logger.info("Patch Successful for item [%s] with changes %s", id, LazyPayload(changes, log_config))
+    if not changes_only:
+        return patched_item
+    if isinstance(patched_item, dict):
+        return {'id': id, **{k: patched_item.get(k) for k in changes}}
+    return {'id': id, **{k: getattr(patched_item, k) for k in changes}}
+
+def _patch_error(obj_type: type, id: str, e: Exception):
+    if isinstance(e, errors.NotFoundException):
+        _raise_http(status.HTTP_404_NOT_FOUND, f"{obj_type.__name__} with ID {id} not found. {e}", e)
+    else:
+        _raise_http(status.HTTP_400_BAD_REQUEST, f"Patch leaves [{obj_type.__name__}] with ID {id} invalid: {e}", e)
+
+def patch_request_handler(request: Request, id: str, changes: Dict[str, Any], obj_type: type, on_patch_callback: patchRequestCallback, changes_only: bool = False, log_config: PayloadLogConfig = None):
+    try:
+        return _patch_result(id, changes, on_patch_callback(request, id, changes), changes_only, log_config)
+    except (errors.NotFoundException, pydantic.error_wrappers.ValidationError) as e:
+        _patch_error(obj_type, id, e)
+
+async def async_patch_request_handler(request: Request, id: str, changes: Dict[str, Any], obj_type: type, on_patch_callback: asyncPatchRequestCallback, changes_only: bool = False, log_config: PayloadLogConfig = None):
+    try:
+        return _patch_result(id, changes, await on_patch_callback(request, id, changes), changes_only, log_config)
+    except (errors.NotFoundException, pydantic.error_wrappers.ValidationError) as e:
+        _patch_error(obj_type, id, e)
+
+
+def _delete_result(id: str, redirect_url: str = None):
+    logger.info(f"Delete Successful for item with id [{id}]")
+
+    if redirect_url is not None:
+        return RedirectResponse(url=redirect_url, status_code=status.HTTP_302_FOUND)
+    else:
+        return True
+
 def delete_request_handler(id: str,
                            request: Request,
                            obj_type: type,
                            on_delete_callback: deleteRequestCallback,
                            redirect_url: str = None
                            ):
-    code = None
-    msg = None
+    try:
+        on_delete_callback(request, id)
+    except errors.NotFoundException as e:
+        _raise_http(status.HTTP_404_NOT_FOUND, f"{obj_type.__name__} with ID {id} not found. {e}")
+    return _delete_result(id, redirect_url)
 
+async def async_delete_request_handler(id: str,
+                                       request: Request,
+                                       obj_type: type,
+                                       on_delete_callback: asyncDeleteRequestCallback,
+                                       redirect_url: str = None
+                                       ):
     try:
-        delete_result = on_delete_callback(request, id)
-        logger.info(f"Delete Successful for item with id [{id}]")
+        await on_delete_callback(request, id)
     except errors.NotFoundException as e:
-        code = status.HTTP_404_NOT_FOUND
-        msg = f"{obj_type.__name__} with ID {id} not found. {e}"
-    finally:
-        if code is not None or msg is not None:
-            logger.error(msg)
-            raise HTTPException(status_code=code,
-                                detail=msg)
-
-        if redirect_url is not None:
-            return RedirectResponse(url=redirect_url, status_code=status.HTTP_302_FOUND)
-        else:
-            return True
+        _raise_http(status.HTTP_404_NOT_FOUND, f"{obj_type.__name__} with ID {id} not found. {e}")
+    return _delete_result(id, redirect_url)
+
+
+'''
+Batch handlers. A batch callback receives the whole batch and returns one result per item, in order. An item that
+failed is reported by returning the exception in its place (eg, a NotFoundException() instance), which lets the
+rest of the batch succeed. Each item is mapped to its own status code rather than failing the request.
+'''
+
+postManyRequestCallback = Callable[[Request, List[T]], List[Union[T, Exception]]]
+putManyRequestCallback = Callable[[Request, Dict[str, Dict]], List[Union[T, Exception]]]
+deleteManyRequestCallback = Callable[[Request, List[str]], List[Union[bool, Exception]]]
+getManyByIdsRequestCallback = Callable[[Request, List[str]], List[Union[T, Exception]]]
+
+
+@functools.lru_cache(maxsize=None)
+def batch_result_model(item_type: type) -> type:
+    return pydantic.create_model(f"{getattr(item_type, '__name__', 'Item')}BatchResult",
+                                 id=(Optional[str], None),
+                                 status_code=(int, ...),
+                                 detail=(Optional[str], None),
+                                 item=(Optional[item_type], None))
+
+
+def batch_item_status(obj_type: type, id: Optional[str], ret: Any) -> Tuple[int, Optional[str]]:
+    '''The status code and error detail (None on success) for one item's result or exception in a batch'''
+    if isinstance(ret, pydantic.error_wrappers.ValidationError):
+        return status.HTTP_400_BAD_REQUEST, f"Malformed json could not be interpreted as [{obj_type.__name__}]: {ret}"
+    elif isinstance(ret, errors.DuplicateException):
+        return status.HTTP_409_CONFLICT, f"Record [{obj_type.__name__}] already exists with id '{id}'. {ret}"
+    elif isinstance(ret, errors.NotFoundException):
+        return status.HTTP_404_NOT_FOUND, f"{obj_type.__name__} with ID {id} not found. {ret}"
+    elif isinstance(ret, Exception):
+        return status.HTTP_500_INTERNAL_SERVER_ERROR, f"Unhandled error [{type(ret)}]: {ret}"
+    return status.HTTP_200_OK, None
+
+
+def _batch_result(ids: List[Optional[str]], obj_type: type, rets: List[Any]) -> List[Dict]:
+    if len(rets) != len(ids):
+        raise TypeError(f"The batch callback returned {len(rets)} results for {len(ids)} items")
+
+    results = []
+    failed = 0
+    for id, ret in zip(ids, rets):
+        code, detail = batch_item_status(obj_type, id, ret)
+        if detail is not None:
+            failed += 1
+            ret = None
+        results.append({'id': id, 'status_code': code, 'detail': detail, 'item': ret})
+
+    logger.info(f"Batch of {len(ids)} [{obj_type.__name__}] processed with {failed} failures")
+    return results
+
+
+def _batch_error(obj_type: type, e: Exception):
+    code, msg = batch_item_status(obj_type, None, e)
+    _raise_http(code, f"Batch of [{obj_type.__name__}] failed: {msg}", e)
+
+
+def batch_request_handler(request: Request,
+                          ids: List[Optional[str]],
+                          payload: Any,
+                          obj_type: type,
+                          on_batch_callback: Callable[[Request, Any], List[Any]]) -> List[Dict]:
+    try:
+        return _batch_result(ids, obj_type, on_batch_callback(request, payload))
+    except Exception as e:
+        _batch_error(obj_type, e)
+
+async def async_batch_request_handler(request: Request,
+                                      ids: List[Optional[str]],
+                                      payload: Any,
+                                      obj_type: type,
+                                      on_batch_callback: Callable[[Request, Any], Awaitable[List[Any]]]) -> List[Dict]:
+    try:
+        return _batch_result(ids, obj_type, await on_batch_callback(request, payload))
+    except Exception as e:
+        _batch_error(obj_type, e)
@@ -0,0 +1,287 @@
+import bisect
+import dataclasses
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set
+from coopapi import errors
+
+'''
+Query predicates understood by InMemoryStore.find, in the same shape as a Mongo filter. A bare value is an equality
+test, eg {'active': True, 'qty': {'$gte': 3, '$lt': 10}, 'desc': {'$in': ['a', 'b']}}
+'''
+RANGE_OPS = ('$gt', '$gte', '$lt', '$lte')
+OPS = RANGE_OPS + ('$eq', '$ne', '$in')
+
+
+def _matches(value: Any, predicate: Any) -> bool:
+    if not isinstance(predicate, dict):
+        return value == predicate
+
+    for op, arg in predicate.items():
+        if op == '$eq' and not value == arg:
+            return False
+        elif op == '$ne' and not value != arg:
+            return False
+        elif op == '$in' and value not in arg:
+            return False
+        elif op in RANGE_OPS:
+            if value is None:
+                return False
+            if op == '$gt' and not value > arg:
+                return False
+            if op == '$gte' and not value >= arg:
+                return False
+            if op == '$lt' and not value < arg:
+                return False
+            if op == '$lte' and not value <= arg:
+                return False
+        elif op not in OPS:
+            raise ValueError(f"Unsupported query operator '{op}'")
+    return True
+
+
+class HashIndex:
+    def __init__(self):
+        self._ids: Dict[Any, Set[str]] = {}
+
+    def add(self, value: Any, id: str):
+        self._ids.setdefault(value, set()).add(id)
+
+    def remove(self, value: Any, id: str):
+        ids = self._ids.get(value)
+        if ids is not None:
+            ids.discard(id)
+            if not ids:
+                del self._ids[value]
+
+    def lookup(self, predicate: Any) -> Optional[Set[str]]:
+        '''The ids that can satisfy predicate, or None when this index can't narrow it down'''
+        if not isinstance(predicate, dict):
+            return set(self._ids.get(predicate, ()))
+        if '$eq' in predicate:
+            return set(self._ids.get(predicate['$eq'], ()))
+        if '$in' in predicate:
+            ret = set()
+            for x in predicate['$in']:
+                ret |= self._ids.get(x, set())
+            return ret
+        return None
+
+
+class SortedIndex:
+    '''
+    Sorted (value, id) keys, with the values alongside, so that range predicates resolve with two bisections. None
+    doesn't order against other values, so ids with no value are kept apart
+    '''
+    def __init__(self):
+        self._keys: List[tuple] = []
+        self._values: List[Any] = []
+        self._none: Set[str] = set()
+
+    def add(self, value: Any, id: str):
+        if value is None:
+            self._none.add(id)
+            return
+        idx = bisect.bisect_left(self._keys, (value, id))
+        self._keys.insert(idx, (value, id))
+        self._values.insert(idx, value)
+
+    def remove(self, value: Any, id: str):
+        if value is None:
+            self._none.discard(id)
+            return
+        idx = bisect.bisect_left(self._keys, (value, id))
+        if idx < len(self._keys) and self._keys[idx] == (value, id):
+            del self._keys[idx]
+            del self._values[idx]
+
+    def _slice(self, predicate: Any) -> range:
+        if not isinstance(predicate, dict):
+            predicate = {'$eq': predicate}
+
+        lo, hi = 0, len(self._values)
+        if '$eq' in predicate:
+            lo = max(lo, bisect.bisect_left(self._values, predicate['$eq']))
+            hi = min(hi, bisect.bisect_right(self._values, predicate['$eq']))
+        if '$gt' in predicate:
+            lo = max(lo, bisect.bisect_right(self._values, predicate['$gt']))
+        if '$gte' in predicate:
+            lo = max(lo, bisect.bisect_left(self._values, predicate['$gte']))
+        if '$lt' in predicate:
+            hi = min(hi, bisect.bisect_left(self._values, predicate['$lt']))
+        if '$lte' in predicate:
+            hi = min(hi, bisect.bisect_right(self._values, predicate['$lte']))
+        return range(lo, max(lo, hi))
+
+    def lookup(self, predicate: Any) -> Optional[Set[str]]:
+        if not isinstance(predicate, dict):
+            predicate = {'$eq': predicate}
+        if not any(op in predicate for op in RANGE_OPS + ('$eq',)):
+            return None
+        if '$eq' in predicate and predicate['$eq'] is None:
+            # no value fails every range predicate
+            return set() if any(op in predicate for op in RANGE_OPS) else set(self._none)
+        return {self._keys[i][1] for i in self._slice(predicate)}
+
+    def ids_after(self, after: Any) -> Iterator[str]:
+        '''Ids in value order, starting after the value `after`. Only meaningful for an index of the ids themselves'''
+        start = bisect.bisect_right(self._keys, (after, after)) if after is not None else 0
+        for i in range(start, len(self._keys)):
+            yield self._keys[i][1]
+
+
+class InMemoryStore:
+    '''
+    Thread-safe, in-memory store of target_schema items keyed on id_field, with callbacks() ready to hand to an
+    ApiShell. Fields listed in hash_indexes serve equality and $in predicates from a dict, and fields in
+    sorted_indexes also serve range predicates; a query is resolved from the most selective usable index and only
+    the remaining predicates are checked item by item. Queries on unindexed fields fall back to a full scan. Either
+    way, results come back in id order, so a limit takes the same items whichever indexes exist
+    '''
+    def __init__(self,
+                 target_schema: type,
+                 hash_indexes: Iterable[str] = (),
+                 sorted_indexes: Iterable[str] = (),
+                 id_field: str = 'id'):
+        self.target_schema = target_schema
+        self.id_field = id_field
+        self._items: Dict[str, Any] = {}
+        self._lock = threading.RLock()
+        self._indexes: Dict[str, Any] = {x: HashIndex() for x in hash_indexes}
+        self._indexes.update({x: SortedIndex() for x in sorted_indexes})
+        # the id is always sorted-indexed, which orders the cursor paged stream
+        self._by_id = SortedIndex()
+
+    def __len__(self):
+        return len(self._items)
+
+    def _id(self, item: Any) -> str:
+        return getattr(item, self.id_field)
+
+    def _index(self, item: Any):
+        id = self._id(item)
+        self._by_id.add(id, id)
+        for field, index in self._indexes.items():
+            index.add(getattr(item, field, None), id)
+
+    def _unindex(self, item: Any):
+        id = self._id(item)
+        self._by_id.remove(id, id)
+        for field, index in self._indexes.items():
+            index.remove(getattr(item, field, None), id)
+
+    def add(self, item: Any) -> Any:
+        with self._lock:
+            if self._id(item) in self._items:
+                raise errors.DuplicateException()
+            self._items[self._id(item)] = item
+            self._index(item)
+            return item
+
+    def get(self, id: str) -> Any:
+        with self._lock:
+            try:
+                return self._items[id]
+            except KeyError:
+                raise errors.NotFoundException()
+
+    def update(self, id: str, update_values: Dict) -> Any:
+        with self._lock:
+            old = self.get(id)
+            values = {f.name: getattr(old, f.name) for f in dataclasses.fields(old)} if dataclasses.is_dataclass(old) \
+                else dict(old.__dict__)
+            values.update(update_values)
+            new = self.target_schema(**values)
+            # an update may change the id, which moves the item to its new key
+            new_id = self._id(new)
+            if new_id != id and new_id in self._items:
+                raise errors.DuplicateException()
+            self._unindex(old)
+            del self._items[id]
+            self._items[new_id] = new
+            self._index(new)
+            return new
+
+    def delete(self, id: str) -> bool:
+        with self._lock:
+            old = self.get(id)
+            self._unindex(old)
+            del self._items[id]
+            return True
+
+    def _candidates(self, query: Dict) -> Iterable[str]:
+        best = None
+        for field, predicate in query.items():
+            index = self._indexes.get(field)
+            if index is None and field == self.id_field:
+                index = self._by_id
+            ids = index.lookup(predicate) if index is not None else None
+            if ids is not None and (best is None or len(ids) < len(best)):
+                best = ids
+        if best is None:
+            return list(self._by_id.ids_after(None))
+        return sorted(best)
+
+    def find(self, query: Dict = None, limit: int = None) -> List[Any]:
+        with self._lock:
+            if not query:
+                ids = self._by_id.ids_after(None)
+            else:
+                ids = self._candidates(query)
+
+            ret = []
+            for id in ids:
+                if limit is not None and len(ret) >= limit:
+                    break
+                item = self._items[id]
+                if not query or all(_matches(getattr(item, k, None), v) for k, v in query.items()):
+                    ret.append(item)
+            return ret
+
+    def find_after(self, query: Dict = None, limit: int = None, after: str = None) -> List[Any]:
+        '''Like find, but ordered by id and starting after the given id, for cursor paging'''
+        with self._lock:
+            ret = []
+            for id in self._by_id.ids_after(after):
+                if limit is not None and len(ret) >= limit:
+                    break
+                item = self._items[id]
+                if not query or all(_matches(getattr(item, k, None), v) for k, v in query.items()):
+                    ret.append(item)
+            return ret
+
+    def iter_after(self, query: Dict = None, limit: int = None, after: str = None, page_size: int = 1000) -> Iterator[Any]:
+        '''Generator over find_after in pages, so a full export neither materializes the store nor holds the lock'''
+        count = 0
+        while limit is None or count < limit:
+            n = page_size if limit is None else min(page_size, limit - count)
+            page = self.find_after(query, n, after)
+            yield from page
+            count += len(page)
+            if len(page) < n:
+                return
+            after = self._id(page[-1])
+
+    def _each(self, func: Callable, args: Iterable) -> List[Any]:
+        ret = []
+        for x in args:
+            try:
+                ret.append(func(*x))
+            except Exception as e:
+                ret.append(e)
+        return ret
+
+    def callbacks(self) -> Dict[str, Callable]:
+        '''ApiShell keyword arguments wiring every CRUD, batch and stream callback to this store'''
+        return {
+            'on_post_callback': lambda request, item: self.add(item),
+            'on_put_callback': lambda request, id, update_values: self.update(id, update_values),
+            'on_patch_callback': lambda request, id, changes: self.update(id, changes),
+            'on_delete_callback': lambda request, id: self.delete(id),
+            'on_getone_callback': lambda request, id: self.get(id),
+            'on_getmany_callback': lambda request, query, limit: self.find(query, limit),
+            'on_post_many_callback': lambda request, items: self._each(self.add, ((x,) for x in items)),
+            'on_put_many_callback': lambda request, update_values: self._each(self.update, update_values.items()),
+            'on_delete_many_callback': lambda request, ids: self._each(self.delete, ((x,) for x in ids)),
+            'on_getmany_by_ids_callback': lambda request, ids: self._each(self.get, ((x,) for x in ids)),
+            'on_getmany_stream_callback': lambda request, query, limit, after: self.iter_after(query, limit, after),
+        }
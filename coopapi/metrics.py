@@ -0,0 +1,197 @@
+import bisect
+import threading
+import time
+from typing import Any, Callable, Dict, List, Sequence, Tuple, Type
+from fastapi import APIRouter, HTTPException
+from fastapi.exceptions import RequestValidationError
+from fastapi.routing import APIRoute
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, Response
+from coopapi.utils import is_async
+
+PROMETHEUS_MEDIA_TYPE = 'text/plain; version=0.0.4'
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        idx = bisect.bisect_left(self.buckets, value)
+        if idx < len(self.counts):
+            self.counts[idx] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[int]:
+        ret = []
+        running = 0
+        for x in self.counts:
+            running += x
+            ret.append(running)
+        return ret
+
+
+def prometheus_labels(**labels) -> str:
+    '''A Prometheus label set, with the values escaped'''
+    txt = ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+    return f'{{{txt}}}'
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class RouteMetrics:
+    '''
+    Request counts and latency histograms per route, plus duration histograms for the callbacks behind them. Route
+    timings cover the whole route handler (request validation, the callback, response serialization and error
+    handling), so the gap between a route's latency and its callback's duration is the framework's share. A single
+    RouteMetrics may be shared by several shells, in which case each shell's /metrics serves all of them (along with
+    every shell's admission gates), so only one needs scraping; router() serves them once for the whole app instead
+    '''
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS, prefix: str = 'coopapi'):
+        self.buckets = tuple(sorted(buckets))
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._requests: Dict[Tuple[str, str, int], int] = {}
+        self._latency: Dict[Tuple[str, str], Histogram] = {}
+        self._callbacks: Dict[Tuple[str, str], Histogram] = {}
+        self._coalesced: Dict[Tuple[str, str], int] = {}
+        self._admission: Dict[str, Any] = {}
+        self._route_class: Type[APIRoute] = None
+
+    def observe_request(self, route: str, method: str, status_code: int, seconds: float):
+        with self._lock:
+            key = (route, method, status_code)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            hist = self._latency.get((route, method))
+            if hist is None:
+                hist = self._latency[(route, method)] = Histogram(self.buckets)
+            hist.observe(seconds)
+
+    def observe_callback(self, shell: str, callback: str, seconds: float):
+        with self._lock:
+            hist = self._callbacks.get((shell, callback))
+            if hist is None:
+                hist = self._callbacks[(shell, callback)] = Histogram(self.buckets)
+            hist.observe(seconds)
+
+    def observe_coalesced(self, shell: str, callback: str):
+        with self._lock:
+            key = (shell, callback)
+            self._coalesced[key] = self._coalesced.get(key, 0) + 1
+
+    def observe_admission(self, shell: str, admission: Any):
+        '''Export a shell's AdmissionControl gates along with the route metrics'''
+        with self._lock:
+            self._admission[shell] = admission
+
+    @property
+    def route_class(self) -> Type[APIRoute]:
+        '''An APIRoute subclass that times its whole handler into this RouteMetrics'''
+        if self._route_class is None:
+            self._route_class = _instrumented_route_class(self)
+        return self._route_class
+
+    def _render_histograms(self, lines: List[str], name: str, hists: Dict[Tuple, Histogram], label_names: Tuple[str, str]):
+        for key, hist in sorted(hists.items()):
+            labels = dict(zip(label_names, key))
+            for le, count in zip(self.buckets, hist.cumulative()):
+                lines.append(f"{name}_bucket{prometheus_labels(**labels, le=le)} {count}")
+            lines.append(f"{name}_bucket{prometheus_labels(**labels, le='+Inf')} {hist.count}")
+            lines.append(f"{name}_sum{prometheus_labels(**labels)} {hist.sum}")
+            lines.append(f"{name}_count{prometheus_labels(**labels)} {hist.count}")
+
+    def render_prometheus(self) -> str:
+        with self._lock:
+            lines = [f"# HELP {self.prefix}_requests_total Requests handled, by route, method and status",
+                     f"# TYPE {self.prefix}_requests_total counter"]
+            for (route, method, code), count in sorted(self._requests.items()):
+                lines.append(f"{self.prefix}_requests_total{prometheus_labels(route=route, method=method, status=code)} {count}")
+
+            lines += [f"# HELP {self.prefix}_request_duration_seconds Time spent in the route handler",
+                      f"# TYPE {self.prefix}_request_duration_seconds histogram"]
+            self._render_histograms(lines, f"{self.prefix}_request_duration_seconds", self._latency, ('route', 'method'))
+
+            lines += [f"# HELP {self.prefix}_callback_duration_seconds Time spent in the shell's callbacks",
+                      f"# TYPE {self.prefix}_callback_duration_seconds histogram"]
+            self._render_histograms(lines, f"{self.prefix}_callback_duration_seconds", self._callbacks, ('shell', 'callback'))
+
+            lines += [f"# HELP {self.prefix}_callback_coalesced_total Reads that shared an identical in-flight call instead of making their own",
+                      f"# TYPE {self.prefix}_callback_coalesced_total counter"]
+            for (shell, callback), count in sorted(self._coalesced.items()):
+                lines.append(f"{self.prefix}_callback_coalesced_total{prometheus_labels(shell=shell, callback=callback)} {count}")
+            admission = dict(self._admission)
+
+        txt = '\n'.join(lines) + '\n'
+        if admission:
+            # imported here, since admission uses this module's label formatting
+            from coopapi.admission import render_prometheus_gates
+            txt += render_prometheus_gates(admission, prefix=self.prefix)
+        return txt
+
+    def response(self) -> Response:
+        return PlainTextResponse(self.render_prometheus(), media_type=PROMETHEUS_MEDIA_TYPE)
+
+    def router(self, path: str = '/metrics') -> APIRouter:
+        '''An APIRouter serving these metrics at path, for an app to expose once however many shells share them'''
+        router = APIRouter()
+        router.add_api_route(path, self.response, methods=['GET'], response_class=PlainTextResponse,
+                             response_description="Prometheus metrics for the app's shells")
+        return router
+
+
+def _instrumented_route_class(metrics: RouteMetrics) -> Type[APIRoute]:
+    class InstrumentedRoute(APIRoute):
+        def get_route_handler(self) -> Callable:
+            handler = super().get_route_handler()
+            path = self.path
+
+            async def timed_handler(request: Request) -> Response:
+                start = time.perf_counter()
+                code = 500
+                try:
+                    response = await handler(request)
+                    code = response.status_code
+                    return response
+                except HTTPException as e:
+                    code = e.status_code
+                    raise
+                except RequestValidationError:
+                    code = 422
+                    raise
+                finally:
+                    metrics.observe_request(path, request.method, code, time.perf_counter() - start)
+            return timed_handler
+
+    return InstrumentedRoute
+
+
+def timed(callback: Callable, metrics: RouteMetrics, shell: str, name: str) -> Callable:
+    '''Wrap a callback so each call, successful or not, is recorded as a callback duration'''
+    if callback is None:
+        return None
+
+    if is_async(callback):
+        async def run(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await callback(*args, **kwargs)
+            finally:
+                metrics.observe_callback(shell, name, time.perf_counter() - start)
+        return run
+
+    def run(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return callback(*args, **kwargs)
+        finally:
+            metrics.observe_callback(shell, name, time.perf_counter() - start)
+    return run
@@ -0,0 +1,84 @@
+import dataclasses
+import json
+import logging
+import pprint
+import random
+from dataclasses import dataclass, field
+from typing import Any, FrozenSet
+
+REDACTED = '***'
+
+
+@dataclass(frozen=True)
+class PayloadLogConfig:
+    '''
+    How request/response payloads are written to the logs. Nothing is formatted unless the logger would emit the
+    record and the sample_rate draw passes; bodies longer than max_body_chars are cut short (and bodies larger than
+    max_parse_bytes are not parsed at all), and the values of any key in redact_fields are masked
+    '''
+    max_body_chars: int = 2000
+    max_parse_bytes: int = 64 * 1024
+    sample_rate: float = 1.0
+    redact_fields: FrozenSet[str] = field(default_factory=lambda: frozenset(['password',
+                                                                            'secret',
+                                                                            'token',
+                                                                            'access_token',
+                                                                            'refresh_token',
+                                                                            'authorization']))
+
+    def enabled(self, logger: logging.Logger, lvl: int) -> bool:
+        if not logger.isEnabledFor(lvl):
+            return False
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def redact(self, obj: Any) -> Any:
+        if not self.redact_fields:
+            return obj
+        if isinstance(obj, dict):
+            return {k: REDACTED if isinstance(k, str) and k.lower() in self.redact_fields else self.redact(v)
+                    for k, v in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            return [self.redact(x) for x in obj]
+        return obj
+
+    def truncate(self, txt: str) -> str:
+        if len(txt) <= self.max_body_chars:
+            return txt
+        return f"{txt[:self.max_body_chars]}... [{len(txt) - self.max_body_chars} chars truncated]"
+
+    def format(self, obj: Any) -> str:
+        if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+            obj = dataclasses.asdict(obj)
+        elif hasattr(obj, 'dict') and callable(obj.dict):
+            obj = obj.dict()
+        return self.truncate(pprint.pformat(self.redact(obj)))
+
+    def format_content(self, content: bytes, encoding: str = None) -> str:
+        if not content:
+            return ''
+
+        if len(content) > self.max_parse_bytes:
+            # too big to be worth parsing; only decode as much as will be shown
+            head = content[:self.max_body_chars * 4].decode(encoding or 'utf-8', errors='replace')
+            return f"{head[:self.max_body_chars]}... [{len(content)} bytes total]"
+
+        txt = content.decode(encoding or 'utf-8', errors='replace')
+        try:
+            return self.format(json.loads(txt))
+        except ValueError:
+            return self.truncate(txt)
+
+
+DEFAULT_PAYLOAD_LOG_CONFIG = PayloadLogConfig()
+
+
+class LazyPayload:
+    '''Defers formatting of obj until the log record is actually rendered'''
+    __slots__ = ('obj', 'config')
+
+    def __init__(self, obj: Any, config: PayloadLogConfig = None):
+        self.obj = obj
+        self.config = config or DEFAULT_PAYLOAD_LOG_CONFIG
+
+    def __str__(self):
+        return self.config.format(self.obj)
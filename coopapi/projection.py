@@ -0,0 +1,49 @@
+import dataclasses
+import inspect
+from typing import Any, Callable, List, Optional
+from fastapi import HTTPException, status
+from coopapi import fast_json
+
+
+def schema_fields(schema: type) -> List[str]:
+    if dataclasses.is_dataclass(schema):
+        return [f.name for f in dataclasses.fields(schema)]
+    return list(getattr(schema, '__fields__', {}).keys())
+
+
+def parse_fields(fields: Optional[str], schema: type) -> Optional[List[str]]:
+    '''Split a fields=a,b,c query parameter, rejecting any name that isn't a field of the schema'''
+    if fields is None or fields.strip() == '':
+        return None
+
+    requested = [x.strip() for x in fields.split(',') if x.strip()]
+    known = schema_fields(schema)
+    unknown = [x for x in requested if x not in known]
+    if unknown:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Unknown fields {unknown} for [{schema.__name__}]. Valid fields are {known}")
+    return requested
+
+
+def accepts_fields(callback: Callable) -> bool:
+    '''Whether a callback takes the optional `fields` argument, and so can project at the backend'''
+    if callback is None:
+        return False
+    try:
+        params = inspect.signature(callback).parameters
+    except (TypeError, ValueError):
+        return False
+    return 'fields' in params or any(p.kind == inspect.Parameter.VAR_KEYWORD for p in params.values())
+
+
+def _project_one(item: Any, fields: List[str]) -> Any:
+    if isinstance(item, dict):
+        return fast_json.to_plain({k: item[k] for k in fields if k in item})
+    # read just the requested attributes rather than converting the whole item first
+    return fast_json.to_plain({k: getattr(item, k) for k in fields if hasattr(item, k)})
+
+def project(result: Any, fields: List[str]) -> Any:
+    '''Encode result (an item or a list of items) keeping only the requested fields'''
+    if isinstance(result, (list, tuple)):
+        return [_project_one(x, fields) for x in result]
+    return _project_one(result, fields)
@@ -0,0 +1,135 @@
+import typing
+from typing import Dict, List, Optional
+from fastapi import FastAPI
+from starlette.routing import BaseRoute, Match, NoMatchFound
+from starlette.types import Receive, Scope, Send
+from coopapi.apiShell import ApiShell
+
+'''Where ShellDispatch leaves the matched route in the request scope'''
+_ROUTE_KEY = 'coopapi.shell_route'
+
+
+def _normalize(base_route: str) -> str:
+    return '/' + base_route.strip('/') if base_route.strip('/') else ''
+
+
+class ShellRegistry:
+    '''
+    Shells keyed by base_route, for apps with many of them. Starlette tries an app's routes one at a time, so with
+    include_router each request is matched against every route of every shell before it. Mounted with mount(app),
+    the registry is a single route that finds the shell from the request path in a dict (one lookup per distinct
+    base_route depth) and only then tries that shell's own handful of routes. Each shell's routes are used as the
+    shell built them, rather than being copied onto the app
+    '''
+    def __init__(self, shells: typing.Iterable[ApiShell] = ()):
+        self._shells: Dict[str, ApiShell] = {}
+        self._routes: Dict[str, List[BaseRoute]] = {}
+        self._depths: List[int] = []
+        self._app: FastAPI = None
+        for shell in shells:
+            self.add(shell)
+
+    def add(self, shell: ApiShell) -> ApiShell:
+        key = _normalize(shell.base_route)
+        if key in self._shells:
+            raise ValueError(f"A shell is already registered for base_route '{shell.base_route}'")
+        self._shells[key] = shell
+        self._routes[key] = list(shell.router.routes)
+        depth = key.count('/')
+        if depth not in self._depths:
+            # deepest first, so '/v1/orders' wins over '/v1'
+            self._depths = sorted(self._depths + [depth], reverse=True)
+        if self._app is not None:
+            self._add_event_handlers(shell)
+        return shell
+
+    def _add_event_handlers(self, shell: ApiShell):
+        for handler in shell.router.on_startup:
+            self._app.router.add_event_handler('startup', handler)
+        for handler in shell.router.on_shutdown:
+            self._app.router.add_event_handler('shutdown', handler)
+
+    def __len__(self) -> int:
+        return len(self._shells)
+
+    def __getitem__(self, base_route: str) -> ApiShell:
+        return self._shells[_normalize(base_route)]
+
+    @property
+    def routes(self) -> List[BaseRoute]:
+        return [route for routes in self._routes.values() for route in routes]
+
+    def lookup(self, path: str) -> Optional[List[BaseRoute]]:
+        '''The routes of the shell whose base_route is the longest prefix of path'''
+        segments = path.split('/')
+        for depth in self._depths:
+            if len(segments) > depth:
+                routes = self._routes.get('/'.join(segments[:depth + 1]))
+                if routes is not None:
+                    return routes
+        return None
+
+    def mount(self, app: FastAPI, index: int = None):
+        '''
+        Route the app's requests for the registered shells through the registry. Shells added afterwards are picked
+        up too. The shells' startup/shutdown handlers are added to the app, and their routes still appear in its docs
+        '''
+        if self._app is not None:
+            raise ValueError("The registry is already mounted")
+        self._app = app
+        app.router.routes.insert(len(app.router.routes) if index is None else index, ShellDispatch(self))
+        for shell in self._shells.values():
+            self._add_event_handlers(shell)
+
+        def openapi():
+            # FastAPI documents the APIRoutes in app.routes, so it is handed a view of the app whose routes include the
+            # shells', leaving the routes the app is serving from untouched
+            if app.openapi_schema is None:
+                app.openapi_schema = type(app).openapi(_DocumentedApp(app, app.router.routes + self.routes))
+            return app.openapi_schema
+        app.openapi = openapi
+
+
+class _DocumentedApp:
+    '''An app as FastAPI.openapi sees it, with its own list of routes'''
+    def __init__(self, app: FastAPI, routes: List[BaseRoute]):
+        self._app = app
+        self.routes = routes
+        self.openapi_schema = None
+
+    def __getattr__(self, name: str) -> typing.Any:
+        return getattr(self._app, name)
+
+
+class ShellDispatch(BaseRoute):
+    '''A route standing in for all of a ShellRegistry's shells'''
+    def __init__(self, registry: ShellRegistry):
+        self.registry = registry
+
+    def matches(self, scope: Scope) -> typing.Tuple[Match, Scope]:
+        if scope['type'] not in ('http', 'websocket'):
+            return Match.NONE, {}
+        routes = self.registry.lookup(scope['path'])
+        if routes is None:
+            return Match.NONE, {}
+
+        partial = None
+        for route in routes:
+            match, child_scope = route.matches(scope)
+            if match == Match.FULL:
+                return Match.FULL, {**child_scope, _ROUTE_KEY: route}
+            if match == Match.PARTIAL and partial is None:
+                partial = {**child_scope, _ROUTE_KEY: route}
+        # with no route of the shell matching, the app's later routes still get a chance
+        return (Match.PARTIAL, partial) if partial is not None else (Match.NONE, {})
+
+    async def handle(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await scope[_ROUTE_KEY].handle(scope, receive, send)
+
+    def url_path_for(self, __name: str, **path_params: typing.Any):
+        for route in self.registry.routes:
+            try:
+                return route.url_path_for(__name, **path_params)
+            except NoMatchFound:
+                pass
+        raise NoMatchFound(__name, path_params)
@@ -0,0 +1,136 @@
+import base64
+import json
+from collections.abc import Iterator, AsyncIterator
+from typing import Any, AsyncIterable, Iterable, List, Optional, Union
+from fastapi import HTTPException, Request, status
+from starlette.concurrency import iterate_in_threadpool
+from starlette.responses import StreamingResponse
+from coopapi import fast_json
+from coopapi import projection
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+JSON_MEDIA_TYPE = 'application/json'
+
+'''
+Items are buffered into chunks of roughly this many bytes before being handed to the server, so that a stream of
+small records does not cost one write per record
+'''
+CHUNK_BYTES = 64 * 1024
+
+
+def encode_cursor(after: str) -> str:
+    # default=str for ids that aren't json types, eg a Mongo ObjectId
+    return base64.urlsafe_b64encode(json.dumps({'after': after}, default=str).encode()).decode()
+
+def decode_cursor(cursor: Optional[str]) -> Optional[str]:
+    if cursor is None:
+        return None
+
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))['after']
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Invalid cursor '{cursor}'") from e
+
+
+def item_id(item: Any) -> Any:
+    '''The id a page ends on. Items may be objects or documents (dicts), keyed by id or by Mongo's _id'''
+    if isinstance(item, dict):
+        if 'id' in item:
+            return item['id']
+        if '_id' in item:
+            return item['_id']
+        raise KeyError(f"Streamed item has no 'id' or '_id' to page from: {list(item)}")
+    return getattr(item, 'id')
+
+def is_stream(ret: Any) -> bool:
+    return isinstance(ret, (Iterator, AsyncIterator))
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in request.headers.get('accept', '')
+
+
+async def _aiterate(items: Union[Iterable, AsyncIterable]):
+    if isinstance(items, AsyncIterator):
+        async for x in items:
+            yield x
+    else:
+        # sync iterators are pulled on the threadpool so a blocking backend cursor doesn't stall the event loop
+        try:
+            async for x in iterate_in_threadpool(items):
+                yield x
+        finally:
+            if hasattr(items, 'close'):
+                items.close()
+
+async def _chunks(items: Union[Iterable, AsyncIterable],
+                  ndjson: bool,
+                  limit: Optional[int],
+                  envelope: bool,
+                  fields: Optional[List[str]] = None,
+                  response_model: Any = None):
+    if ndjson:
+        open_txt, sep, close_txt = b'', b'\n', b'\n'
+    elif envelope:
+        open_txt, sep, close_txt = b'{"items":[', b',', b']'
+    else:
+        open_txt, sep, close_txt = b'[', b',', b']'
+
+    buf = bytearray(open_txt)
+    count = 0
+    last_id = None
+    next_cursor = None
+    source = _aiterate(items)
+    try:
+        async for item in source:
+            if limit is not None and count >= limit:
+                # the source yielded past the page, so there is more to fetch from where this page ended
+                next_cursor = encode_cursor(last_id)
+                break
+
+            if limit is not None:
+                # taken as each item goes by, so an item without an id fails before much of the body is sent
+                last_id = item_id(item)
+            # a bad item raises here, failing the stream rather than sending it unchecked
+            out = fast_json.validated(item, response_model) if response_model is not None else item
+            if fields is not None:
+                out = projection.project(out, fields)
+
+            if count > 0:
+                buf += sep
+            buf += fast_json.dumps(out)
+            count += 1
+
+            if len(buf) >= CHUNK_BYTES:
+                yield bytes(buf)
+                buf.clear()
+    finally:
+        await source.aclose()
+
+    if count > 0 or not ndjson:
+        buf += close_txt
+    if ndjson and next_cursor is not None:
+        buf += fast_json.dumps({'next_cursor': next_cursor}) + b'\n'
+    elif envelope and not ndjson:
+        buf += b',"next_cursor":' + fast_json.dumps(next_cursor) + b'}'
+    yield bytes(buf)
+
+
+def stream_response(items: Union[Iterable, AsyncIterable],
+                    request: Request,
+                    limit: int = None,
+                    envelope: bool = False,
+                    fields: List[str] = None,
+                    response_model: Any = None) -> StreamingResponse:
+    '''
+    Stream items as NDJSON when the client accepts it, otherwise as a chunked JSON array. With envelope=True the
+    array is wrapped as {"items": [...], "next_cursor": ...}; in NDJSON a final {"next_cursor": ...} line is written
+    when there is another page. A page is full after `limit` items, so the source should yield limit + 1 items when
+    more are available. Given a response_model, each item is validated and filtered through it, as a listed item
+    would be, and the stream fails on the first one that doesn't pass. fields, when given, limits each item to those
+    fields.
+    '''
+    ndjson = wants_ndjson(request)
+    return StreamingResponse(_chunks(items, ndjson=ndjson, limit=limit, envelope=envelope, fields=fields,
+                                     response_model=response_model),
+                             media_type=NDJSON_MEDIA_TYPE if ndjson else JSON_MEDIA_TYPE)
@@ -0,0 +1,260 @@
+import contextvars
+import functools
+import json
+import random
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Type
+from coopapi.utils import is_async
+
+'''Header carrying a request's id from the client to the shell, and echoed back on the response'''
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+_current: contextvars.ContextVar = contextvars.ContextVar('coopapi_trace', default=None)
+_request_id: contextvars.ContextVar = contextvars.ContextVar('coopapi_request_id', default=None)
+
+
+class Trace:
+    '''
+    Timings for one request. queue is waiting for admission, receive is reading the body (whoever reads it), validate
+    is FastAPI parsing it into the endpoint's arguments, callback is the shell's callback and serialize is everything
+    after the endpoint returns
+    '''
+    __slots__ = ('request_id', 'route', 'method', 'started', 'spans', '_start', '_endpoint_start', '_endpoint_end',
+                 '_received_before_endpoint')
+
+    def __init__(self, request_id: str, route: str, method: str):
+        self.request_id = request_id
+        self.route = route
+        self.method = method
+        self.started = time.time()
+        self.spans: Dict[str, float] = {}
+        self._start = time.perf_counter()
+        self._endpoint_start = None
+        self._endpoint_end = None
+        self._received_before_endpoint = 0.0
+
+    def add(self, span: str, seconds: float):
+        self.spans[span] = self.spans.get(span, 0.0) + seconds
+
+    def received(self, seconds: float):
+        # an endpoint reading request.stream() itself receives while it runs, which isn't part of validating
+        if self._endpoint_start is None:
+            self._received_before_endpoint += seconds
+        self.add('receive', seconds)
+
+    def record(self, status_code: int) -> Dict[str, Any]:
+        end = time.perf_counter()
+        if self._endpoint_start is not None:
+            self.add('validate', self._endpoint_start - self._start - self._received_before_endpoint -
+                     self.spans.get('queue', 0.0))
+            self.add('serialize', end - (self._endpoint_end or end))
+        return {'request_id': self.request_id,
+                'route': self.route,
+                'method': self.method,
+                'status_code': status_code,
+                'started': self.started,
+                'duration_ms': round((end - self._start) * 1000, 3),
+                'spans_ms': {k: round(v * 1000, 3) for k, v in self.spans.items()}}
+
+
+class TraceExporter(ABC):
+    @abstractmethod
+    def export(self, record: Dict[str, Any]):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class RingBufferExporter(TraceExporter):
+    '''Keeps the last `size` traces in memory'''
+    def __init__(self, size: int = 1000):
+        self._records: Deque[Dict[str, Any]] = deque(maxlen=size)
+
+    def export(self, record: Dict[str, Any]):
+        self._records.append(record)
+
+    def traces(self) -> List[Dict[str, Any]]:
+        return list(self._records)
+
+
+class JsonlExporter(TraceExporter):
+    '''Appends one json line per trace to path, flushed every flush_every traces and on close'''
+    def __init__(self, path: str, flush_every: int = 100):
+        self.path = path
+        self.flush_every = flush_every
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._file = open(path, 'a', buffering=64 * 1024)
+
+    def export(self, record: Dict[str, Any]):
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._pending += 1
+            if self._pending >= self.flush_every:
+                self._file.flush()
+                self._pending = 0
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class Tracer:
+    '''
+    Request tracing for an ApiShell. A fraction sample_rate of requests is traced and handed to the exporter; the
+    rest cost a random() call. Every request has an id, from the X-Request-ID header or generated when there is none,
+    which is echoed on the response, left on request.state.request_id and returned by current_request_id(). The
+    shell closes the tracer, and so its exporter, when the app shuts down
+    '''
+    def __init__(self, exporter: TraceExporter = None, sample_rate: float = 0.01):
+        self.exporter = exporter if exporter is not None else RingBufferExporter()
+        self.sample_rate = sample_rate
+        self._route_class = None
+        self._closed = False
+
+    def sampled(self) -> bool:
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def close(self):
+        # a tracer may be shared by several shells, each of which closes it on shutdown
+        if not self._closed:
+            self._closed = True
+            self.exporter.close()
+
+    @property
+    def route_class(self) -> Type:
+        '''An APIRoute subclass that traces its handler into this Tracer'''
+        if self._route_class is None:
+            self._route_class = _traced_route_class(self)
+        return self._route_class
+
+
+def _traced_route_class(tracer: Tracer) -> Type:
+    from fastapi import HTTPException
+    from fastapi.exceptions import RequestValidationError
+    from fastapi.routing import APIRoute
+    from starlette.requests import Request
+
+    class TracedRoute(APIRoute):
+        def get_route_handler(self) -> Callable:
+            handler = super().get_route_handler()
+            path = self.path
+
+            async def traced_handler(request):
+                request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+                request.state.request_id = request_id
+                token = _request_id.set(request_id)
+                try:
+                    response = await (sampled_handler(request, request_id) if tracer.sampled() else handler(request))
+                    response.headers[REQUEST_ID_HEADER] = request_id
+                    return response
+                finally:
+                    _request_id.reset(token)
+
+            async def sampled_handler(request, request_id: str):
+                trace = Trace(request_id=request_id, route=path, method=request.method)
+                token = _current.set(trace)
+                code = 500
+                try:
+                    # the body is timed as it is read, by FastAPI or by an endpoint streaming it, rather than read here
+                    request = Request(request.scope, _timed_receive(request.receive, trace))
+                    response = await handler(request)
+                    code = response.status_code
+                    return response
+                except HTTPException as e:
+                    code = e.status_code
+                    raise
+                except RequestValidationError:
+                    code = 422
+                    raise
+                finally:
+                    _current.reset(token)
+                    tracer.exporter.export(trace.record(code))
+            return traced_handler
+
+    return TracedRoute
+
+
+def _timed_receive(receive: Callable, trace: Trace) -> Callable:
+    async def timed():
+        start = time.perf_counter()
+        message = await receive()
+        if message['type'] == 'http.request':
+            trace.received(time.perf_counter() - start)
+        return message
+    return timed
+
+
+def add_span(span: str, seconds: float):
+    '''Add time to a span of the current trace, if the request is being traced'''
+    trace = _current.get()
+    if trace is not None:
+        trace.add(span, seconds)
+
+
+def traced_endpoint(endpoint: Callable) -> Callable:
+    '''Wrap a route endpoint to mark where it starts and ends in the current trace'''
+    def start():
+        trace = _current.get()
+        if trace is not None:
+            trace._endpoint_start = time.perf_counter()
+        return trace
+
+    if is_async(endpoint):
+        @functools.wraps(endpoint)
+        async def run(*args, **kwargs):
+            trace = start()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                if trace is not None:
+                    trace._endpoint_end = time.perf_counter()
+        return run
+
+    @functools.wraps(endpoint)
+    def run(*args, **kwargs):
+        trace = start()
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            if trace is not None:
+                trace._endpoint_end = time.perf_counter()
+    return run
+
+
+def traced(callback: Callable) -> Callable:
+    '''Wrap a callback so its duration is added to the current trace as its callback span'''
+    if callback is None:
+        return None
+
+    if is_async(callback):
+        async def run(*args, **kwargs):
+            trace = _current.get()
+            start = time.perf_counter()
+            try:
+                return await callback(*args, **kwargs)
+            finally:
+                if trace is not None:
+                    trace.add('callback', time.perf_counter() - start)
+        return run
+
+    def run(*args, **kwargs):
+        trace = _current.get()
+        start = time.perf_counter()
+        try:
+            return callback(*args, **kwargs)
+        finally:
+            if trace is not None:
+                trace.add('callback', time.perf_counter() - start)
+    return run
+
+
+def current_request_id() -> Optional[str]:
+    '''The id of the current request, sampled or not, for callbacks that want to log or forward it'''
+    return _request_id.get()
@@ -0,0 +1,6 @@
+import asyncio
+from typing import Callable
+
+
+def is_async(callback: Callable) -> bool:
+    return asyncio.iscoroutinefunction(callback) or asyncio.iscoroutinefunction(getattr(callback, '__call__', None))
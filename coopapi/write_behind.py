@@ -0,0 +1,142 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Tuple
+from fastapi import HTTPException, Request, status
+from starlette.concurrency import run_in_threadpool
+from coopapi.payload_logging import PayloadLogConfig, LazyPayload, DEFAULT_PAYLOAD_LOG_CONFIG
+from coopapi.utils import is_async
+
+logger = logging.getLogger('WriteBehind')
+
+
+@dataclass(frozen=True)
+class WriteBehind:
+    '''
+    Settings for batching the shell's POSTs. Items are queued and handed to the batch callback max_batch at a time, or
+    once the oldest queued item has waited max_latency_s. With wait=True a POST returns once its batch has been
+    written (with that item's own result or error); otherwise it returns 202 as soon as the item is queued. At most
+    max_pending items may be queued, beyond that POSTs get a 503
+    '''
+    max_batch: int = 100
+    max_latency_s: float = 0.01
+    wait: bool = True
+    max_pending: int = 10000
+    retry_after_s: int = 1
+
+
+_Pending = Tuple[Request, Any, asyncio.Future]
+
+
+class PostBatcher:
+    '''
+    Queues single items for a batch callback (a postManyRequestCallback) and flushes them from a background task, one
+    batch at a time, so items keep gathering while a batch is being written. The batch is given the request of its
+    first item. Items are logged through log_config
+    '''
+    def __init__(self, batch_callback: Callable, config: WriteBehind, log_config: PayloadLogConfig = None):
+        self.batch_callback = batch_callback
+        self.config = config
+        self.log_config = log_config or DEFAULT_PAYLOAD_LOG_CONFIG
+        self.batches = 0
+        self.items = 0
+        self.failed = 0
+        self._pending: List[_Pending] = []
+        self._changed: asyncio.Event = None
+        self._worker: asyncio.Task = None
+        self._closing = False
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def stats(self) -> Dict[str, int]:
+        return {'pending': self.pending, 'batches': self.batches, 'items': self.items, 'failed': self.failed}
+
+    def check_capacity(self):
+        if len(self._pending) >= self.config.max_pending or self._closing:
+            msg = f"Write queue is full ({len(self._pending)} pending), retry after {self.config.retry_after_s}s"
+            logger.warning(msg)
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail=msg,
+                                headers={'Retry-After': str(self.config.retry_after_s)})
+
+    def submit(self, request: Request, item: Any) -> asyncio.Future:
+        '''Queue an item, returning a future for its result in the batch'''
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.get_loop() is not loop:
+            self._changed = asyncio.Event()
+            self._worker = loop.create_task(self._run())
+
+        if self.log_config.enabled(logger, logging.DEBUG):
+            logger.debug("Queued %s for writing", LazyPayload(item, self.log_config))
+        fut = loop.create_future()
+        self._pending.append((request, item, fut))
+        self._changed.set()
+        return fut
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._pending:
+                if self._closing:
+                    return
+                await self._changed.wait()
+                self._changed.clear()
+                continue
+
+            # gather until the batch is full or the oldest item has waited long enough
+            deadline = loop.time() + self.config.max_latency_s
+            while len(self._pending) < self.config.max_batch and not self._closing:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                self._changed.clear()
+                try:
+                    await asyncio.wait_for(self._changed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+            batch = self._pending[:self.config.max_batch]
+            del self._pending[:self.config.max_batch]
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[_Pending]):
+        request = batch[0][0]
+        items = [item for _, item, _ in batch]
+        try:
+            if is_async(self.batch_callback):
+                rets = await self.batch_callback(request, items)
+            else:
+                rets = await run_in_threadpool(self.batch_callback, request, items)
+            if len(rets) != len(items):
+                raise TypeError(f"The batch callback returned {len(rets)} results for {len(items)} items")
+        except Exception as e:
+            logger.error(f"Batch of {len(items)} failed: {e}")
+            rets = [e] * len(items)
+
+        self.batches += 1
+        self.items += len(items)
+        for (_, item, fut), ret in zip(batch, rets):
+            if isinstance(ret, Exception):
+                self.failed += 1
+                if not self.config.wait:
+                    # nobody is waiting on the result, so this is the only place the failure shows up
+                    logger.error("Queued write of %s failed: %s", LazyPayload(item, self.log_config), ret)
+                if not fut.done():
+                    fut.set_exception(ret)
+                    # mark the error as seen, the waiter (if there still is one) gets it regardless
+                    fut.exception()
+            elif not fut.done():
+                fut.set_result(ret)
+
+    async def close(self):
+        '''Stop taking items and flush everything still queued'''
+        self._closing = True
+        try:
+            if self._worker is not None and self._worker.get_loop() is asyncio.get_running_loop():
+                self._changed.set()
+                await self._worker
+        finally:
+            self._worker = None
+            self._closing = False
@@ -14,8 +14,14 @@ setuptools.setup(name='coopapi',
       author_email='tyler.tj.burns@gmail.com',
       license='MIT',
       packages=setuptools.find_packages(),
-      python_requires=">3.5",
+      python_requires=">=3.8",
       install_requires=requirements,
+      extras_require={
+          # the client (coopapi.http_request) only needs requests; the ApiShell server side needs fastapi
+          'client': ['requests'],
+          'async': ['httpx'],
+          'server': ['fastapi', 'pydantic', 'starlette'],
+      },
       long_description_content_type="text/markdown",
       long_description=README,
       zip_safe=False,
@@ -26,8 +32,13 @@ setuptools.setup(name='coopapi',
         'Development Status :: 3 - Alpha',
         'License :: OSI Approved :: MIT License',
         'Programming Language :: Python',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
         'Topic :: Software Development :: Libraries',
         'Topic :: Software Development :: Libraries :: Python Modules',
         'Intended Audience :: Developers',
@@ -0,0 +1,112 @@
+import asyncio
+import unittest
+import httpx
+import pydantic
+from fastapi import FastAPI, HTTPException
+from coopapi import ApiShell, AdmissionControl, AdmissionLimit
+
+
+class Item(pydantic.BaseModel):
+    id: str
+
+
+class TestAdmission(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.release = asyncio.Event()
+        self.running = 0
+        self.peak = 0
+        self.streaming = False
+
+        async def getone(request, id):
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+            try:
+                await self.release.wait()
+            finally:
+                self.running -= 1
+            return Item(id=id)
+
+        def getmany(request, query, limit):
+            return []
+
+        async def stream(request, query, limit, after):
+            self.streaming = True
+            yield Item(id='1')
+            await self.release.wait()
+            if query == {'fail': True}:
+                raise RuntimeError('backend went away')
+            yield Item(id='2')
+
+        self.admission = AdmissionControl(verbs={'GET': AdmissionLimit(max_in_flight=1, max_queue=1, queue_timeout_s=5,
+                                                                       retry_after_s=2)})
+        app = FastAPI()
+        app.include_router(ApiShell(Item, '/a', on_getone_callback=getone, on_getmany_callback=getmany,
+                                    on_getmany_stream_callback=stream, admission=self.admission).router)
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test')
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    async def _until(self, check):
+        for _ in range(200):
+            if check():
+                return
+            await asyncio.sleep(0.005)
+        self.fail('timed out')
+
+    async def test_queues_then_rejects(self):
+        first = asyncio.ensure_future(self.client.get('/a/api/1'))
+        await self._until(lambda: self.running == 1)
+        second = asyncio.ensure_future(self.client.get('/a/api/2'))
+        await self._until(lambda: self.admission.stats()['GET']['queued'] == 1)
+
+        third = await self.client.get('/a/api/3')
+        self.assertEqual(third.status_code, 503)
+        self.assertEqual(third.headers['retry-after'], '2')
+
+        self.release.set()
+        self.assertEqual([x.status_code for x in await asyncio.gather(first, second)], [200, 200])
+        self.assertEqual(self.peak, 1)
+        self.assertEqual(self.admission.stats()['GET'],
+                         {'in_flight': 0, 'queued': 0, 'admitted': 2, 'rejected': 1, 'timed_out': 0})
+
+    async def test_queue_timeout(self):
+        gate = AdmissionControl(verbs={'GET': AdmissionLimit(max_in_flight=1, max_queue=1, queue_timeout_s=0.05)})
+        gates = gate.gates('/t', 'GET')
+        await gates[0].acquire()
+        with self.assertRaises(HTTPException) as ctx:
+            await gates[0].acquire()
+        self.assertEqual(ctx.exception.status_code, 503)
+        self.assertEqual(gate.stats()['GET']['timed_out'], 1)
+        gates[0].release()
+        self.assertEqual(gate.stats()['GET']['in_flight'], 0)
+
+    async def test_sync_routes_are_admitted(self):
+        ret = await self.client.get('/a/api/')
+        self.assertEqual(ret.status_code, 200)
+        self.assertEqual(self.admission.stats()['GET']['in_flight'], 0)
+
+    async def test_streams_hold_their_slot_until_sent(self):
+        first = asyncio.ensure_future(self.client.get('/a/api/stream'))
+        await self._until(lambda: self.streaming)
+        # the endpoint has returned, but the body is still being sent
+        self.assertEqual(self.admission.stats()['GET']['in_flight'], 1)
+        second = asyncio.ensure_future(self.client.get('/a/api/'))
+        await self._until(lambda: self.admission.stats()['GET']['queued'] == 1)
+
+        self.release.set()
+        first, second = await asyncio.gather(first, second)
+        self.assertEqual([x['id'] for x in first.json()['items']], ['1', '2'])
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(self.admission.stats()['GET']['in_flight'], 0)
+
+    async def test_failed_stream_releases_its_slot(self):
+        self.release.set()
+        with self.assertRaises(Exception):
+            await self.client.get('/a/api/stream', params={'query': '{"fail": true}'})
+        self.assertEqual(self.admission.stats()['GET']['in_flight'], 0)
+        self.assertEqual((await self.client.get('/a/api/')).status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import asyncio
+import random
+import unittest
+import httpx
+from coopapi.async_http_request import AsyncHttpClient, AsyncRequest
+from coopapi.enums import RequestType
+from coopapi.tracing import REQUEST_ID_HEADER
+
+
+class StandIn:
+    '''An ASGI server standing in for the network, recording how many requests it was serving at once'''
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+        self.headers = []
+
+    async def __call__(self, scope, receive, send):
+        path = scope['path']
+        if path == '/fail':
+            raise ConnectionError('stand-in failure')
+        self.headers.append(dict(scope['headers']))
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(random.uniform(0, 0.01))
+        finally:
+            self.active -= 1
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', b'text/plain')]})
+        await send({'type': 'http.response.body', 'body': path.encode()})
+
+
+class TestAsyncHttpClient(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = StandIn()
+        self.client = AsyncHttpClient(max_concurrency=3, transport=httpx.ASGITransport(app=self.server))
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    async def test_gather_keeps_order_and_bounds_concurrency(self):
+        rets = await self.client.gather(AsyncRequest(url=f'http://test/{i}') for i in range(20))
+        self.assertEqual([x.text for x in rets], [f'/{i}' for i in range(20)])
+        self.assertLessEqual(self.server.peak, 3)
+        self.assertGreater(self.server.peak, 1)
+
+    async def test_gather_concurrency_override(self):
+        await self.client.gather([AsyncRequest(url=f'http://test/{i}') for i in range(10)], max_concurrency=1)
+        self.assertEqual(self.server.peak, 1)
+
+    async def test_return_exceptions_puts_failures_in_place(self):
+        requests = [AsyncRequest(url='http://test/0'), AsyncRequest(url='http://test/fail'), AsyncRequest(url='http://test/2')]
+        rets = await self.client.gather(requests, return_exceptions=True)
+        self.assertEqual(rets[0].text, '/0')
+        self.assertIsInstance(rets[1], ConnectionError)
+        self.assertEqual(rets[2].text, '/2')
+        with self.assertRaises(ConnectionError):
+            await self.client.gather(requests)
+
+    async def test_request_id_is_sent(self):
+        await self.client.request('http://test/x', RequestType.GET, request_id='abc')
+        self.assertEqual(self.server.headers[-1][REQUEST_ID_HEADER.lower().encode()], b'abc')
+
+    async def test_timeouts(self):
+        async with AsyncHttpClient() as client:
+            self.assertEqual(client.client.timeout, httpx.Timeout(30.0, connect=3.05))
+        for timeout, expected in (((1, 5), httpx.Timeout(5, connect=1)),
+                                  (None, httpx.Timeout(None)),
+                                  (2, httpx.Timeout(2)),
+                                  (httpx.Timeout(3, read=9), httpx.Timeout(3, read=9))):
+            async with AsyncHttpClient(timeout=timeout) as client:
+                self.assertEqual(client.client.timeout, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+import pydantic
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from coopapi import ApiShell, DuplicateException, NotFoundException
+
+
+class Item(pydantic.BaseModel):
+    id: str
+    name: str
+
+
+class TestBatchRoutes(unittest.TestCase):
+    def setUp(self):
+        db = self.db = {}
+
+        def post_many(request, items):
+            ret = []
+            for x in items:
+                if x.id in db:
+                    ret.append(DuplicateException())
+                else:
+                    db[x.id] = x
+                    ret.append(x)
+            return ret
+
+        def put_many(request, update_values):
+            ret = []
+            for id, values in update_values.items():
+                if id not in db:
+                    ret.append(NotFoundException())
+                    continue
+                db[id] = Item(**{**db[id].dict(), **values})
+                ret.append(db[id])
+            return ret
+
+        async def getmany_by_ids(request, ids):
+            return [db[x] if x in db else NotFoundException() for x in ids]
+
+        def delete_many(request, ids):
+            return [db.pop(x, None) is not None or NotFoundException() for x in ids]
+
+        app = FastAPI()
+        app.include_router(ApiShell(Item, '/b',
+                                    on_post_many_callback=post_many,
+                                    on_put_many_callback=put_many,
+                                    on_getmany_by_ids_callback=getmany_by_ids,
+                                    on_delete_many_callback=delete_many,
+                                    on_getone_callback=lambda request, id: db[id]).router)
+        self.client = TestClient(app)
+
+    def test_each_item_gets_its_own_status(self):
+        ret = self.client.post('/b/api/batch', json=[{'id': '1', 'name': 'a'}, {'id': '1', 'name': 'b'}]).json()
+        self.assertEqual([x['status_code'] for x in ret], [200, 409])
+        self.assertEqual(ret[0]['item'], {'id': '1', 'name': 'a'})
+        self.assertIsNone(ret[1]['item'])
+
+        ret = self.client.put('/b/api/batch', json={'1': {'name': 'z'}, '2': {'name': 'y'}}).json()
+        self.assertEqual([(x['id'], x['status_code']) for x in ret], [('1', 200), ('2', 404)])
+
+        ret = self.client.get('/b/api/batch', params={'ids': ['2', '1']}).json()
+        self.assertEqual([(x['id'], x['status_code']) for x in ret], [('2', 404), ('1', 200)])
+        self.assertEqual(ret[1]['item']['name'], 'z')
+
+        ret = self.client.request('DELETE', '/b/api/batch', json=['1', '1']).json()
+        self.assertEqual([x['status_code'] for x in ret], [200, 404])
+
+    def test_batch_paths_are_not_taken_as_ids(self):
+        ret = self.client.get('/b/api/batch', params={'ids': ['1']})
+        self.assertEqual(ret.status_code, 200)
+        self.assertEqual(ret.json()[0]['status_code'], 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
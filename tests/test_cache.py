@@ -0,0 +1,65 @@
+import unittest
+import pydantic
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from coopapi import ApiShell, ResponseCache, InMemoryStore
+
+
+class Item(pydantic.BaseModel):
+    id: str
+    name: str
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.store = InMemoryStore(Item)
+        self.store.add(Item(id='1', name='a'))
+        self.reads = {'getone': 0, 'getmany': 0}
+        callbacks = self.store.callbacks()
+
+        def counted(name):
+            fn = callbacks[f'on_{name}_callback']
+
+            def read(*args, **kwargs):
+                self.reads[name] += 1
+                return fn(*args, **kwargs)
+            return read
+
+        self.cache = ResponseCache()
+        app = FastAPI()
+        app.include_router(ApiShell(Item, '/c',
+                                    on_post_callback=callbacks['on_post_callback'],
+                                    on_put_callback=callbacks['on_put_callback'],
+                                    on_getone_callback=counted('getone'),
+                                    on_getmany_callback=counted('getmany'),
+                                    cache=self.cache).router)
+        self.client = TestClient(app)
+
+    def test_reads_are_served_from_cache(self):
+        for _ in range(3):
+            self.assertEqual(self.client.get('/c/api/1').json(), {'id': '1', 'name': 'a'})
+            self.client.get('/c/api/')
+        self.assertEqual(self.reads, {'getone': 1, 'getmany': 1})
+        self.assertEqual(self.cache.stats()['hits'], 4)
+
+    def test_put_invalidates_the_item(self):
+        self.client.get('/c/api/1')
+        self.client.put('/c/api/1', json={'name': 'b'})
+        self.assertEqual(self.client.get('/c/api/1').json()['name'], 'b')
+        self.assertEqual(self.reads['getone'], 2)
+
+    def test_any_write_orphans_lists(self):
+        self.assertEqual(len(self.client.get('/c/api/').json()), 1)
+        self.client.post('/c/api/', json={'id': '2', 'name': 'b'})
+        self.assertEqual(len(self.client.get('/c/api/').json()), 2)
+        self.assertEqual(self.reads['getmany'], 2)
+
+    def test_failed_write_does_not_invalidate(self):
+        self.client.get('/c/api/1')
+        self.assertEqual(self.client.put('/c/api/9', json={'name': 'b'}).status_code, 404)
+        self.client.get('/c/api/1')
+        self.assertEqual(self.reads['getone'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
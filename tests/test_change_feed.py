@@ -0,0 +1,56 @@
+import unittest
+import pydantic
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from coopapi import ApiShell, ChangeFeed, InMemoryStore
+from coopapi.change_feed import OVERFLOW, RESET
+
+
+class Item(pydantic.BaseModel):
+    id: str
+    name: str
+
+
+class TestChangeFeed(unittest.IsolatedAsyncioTestCase):
+    async def test_replay_and_live_events(self):
+        feed = ChangeFeed(history=10)
+        feed.publish('create', id='1')
+        feed.publish('update', id='1')
+        sub = feed.subscribe(after=1)
+        feed.publish('delete', id='1')
+        self.assertEqual([(await sub.get(0.1)).type for _ in range(2)], ['update', 'delete'])
+        self.assertIsNone(await sub.get(0.01))
+
+    async def test_unreplayable_gap_resets(self):
+        feed = ChangeFeed(history=2)
+        for i in range(5):
+            feed.publish('update', id=str(i))
+        self.assertEqual((await feed.subscribe(after=1).get(0.1)).type, RESET)
+
+    async def test_slow_subscriber_is_cut_off(self):
+        feed = ChangeFeed(buffer_size=2)
+        sub = feed.subscribe()
+        for i in range(3):
+            feed.publish('update', id=str(i))
+        self.assertEqual([(await sub.get(0.1)).type for _ in range(3)], ['update', 'update', OVERFLOW])
+        self.assertEqual(feed.stats()['subscribers'], 0)
+
+    async def test_shell_writes_publish(self):
+        feed = ChangeFeed()
+        store = InMemoryStore(Item)
+        app = FastAPI()
+        app.include_router(ApiShell(Item, '/f', **store.callbacks(), change_feed=feed).router)
+        client = TestClient(app)
+        sub = feed.subscribe()
+        client.post('/f/api/', json={'id': '1', 'name': 'a'})
+        client.put('/f/api/1', json={'name': 'b'})
+        client.put('/f/api/9', json={'name': 'b'})
+        client.delete('/f/api/1')
+        events = [await sub.get(0.1) for _ in range(3)]
+        self.assertEqual([(x.type, x.id) for x in events], [('create', '1'), ('update', '1'), ('delete', '1')])
+        self.assertEqual(events[1].item, {'id': '1', 'name': 'b'})
+        self.assertIsNone(await sub.get(0.01))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import pydantic
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from coopapi import ApiShell, SingleFlight
+
+
+class Item(pydantic.BaseModel):
+    id: str
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_calls_share_one(self):
+        flight = SingleFlight()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            time.sleep(0.05)
+            return 'x'
+
+        with ThreadPoolExecutor(4) as pool:
+            rets = list(pool.map(lambda _: flight.do('k', fn), range(4)))
+        self.assertEqual(rets, ['x'] * 4)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.stats(), {'calls': 1, 'collapsed': 3})
+
+    def test_invalidate_starts_a_new_flight(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow():
+            started.set()
+            release.wait()
+            return 'old'
+
+        with ThreadPoolExecutor(2) as pool:
+            first = pool.submit(flight.do, 'k', slow)
+            started.wait()
+            flight.invalidate(['1'])
+            second = pool.submit(flight.do, 'k', lambda: 'new')
+            self.assertEqual(second.result(), 'new')
+            release.set()
+            self.assertEqual(first.result(), 'old')
+
+    def test_exceptions_are_shared(self):
+        flight = SingleFlight()
+
+        def fn():
+            time.sleep(0.05)
+            raise KeyError('x')
+
+        with ThreadPoolExecutor(3) as pool:
+            futures = [pool.submit(flight.do, 'k', fn) for _ in range(3)]
+            for f in futures:
+                self.assertRaises(KeyError, f.result)
+
+
+class TestSingleFlightAsync(unittest.IsolatedAsyncioTestCase):
+    async def test_cancelling_the_leader_does_not_cancel_the_others(self):
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def fn():
+            await release.wait()
+            return 'x'
+
+        leader = asyncio.ensure_future(flight.do_async('k', fn))
+        await asyncio.sleep(0)
+        followers = [asyncio.ensure_future(flight.do_async('k', fn)) for _ in range(2)]
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        self.assertEqual(await asyncio.gather(*followers, return_exceptions=True), ['x', 'x'])
+        self.assertTrue(leader.cancelled())
+        self.assertEqual(flight.stats(), {'calls': 1, 'collapsed': 2})
+
+    async def test_streams_are_not_shared(self):
+        flight = SingleFlight()
+
+        async def fn():
+            await asyncio.sleep(0.01)
+            return iter([1, 2])
+
+        rets = await asyncio.gather(*[flight.do_async('k', fn) for _ in range(3)])
+        self.assertEqual([list(x) for x in rets], [[1, 2]] * 3)
+
+
+class TestCoalescedShell(unittest.TestCase):
+    def test_generator_getmany_under_concurrency(self):
+        def getmany(request, query, limit):
+            time.sleep(0.05)
+            return (Item(id=str(i)) for i in range(3))
+
+        app = FastAPI()
+        app.include_router(ApiShell(Item, '/d', on_getmany_callback=getmany, single_flight=SingleFlight()).router)
+        client = TestClient(app)
+        with ThreadPoolExecutor(3) as pool:
+            rets = list(pool.map(lambda _: client.get('/d/api/'), range(3)))
+        self.assertEqual([x.status_code for x in rets], [200] * 3)
+        self.assertEqual([x.json() for x in rets], [[{'id': '0'}, {'id': '1'}, {'id': '2'}]] * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
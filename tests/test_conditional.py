@@ -0,0 +1,98 @@
+import unittest
+from datetime import datetime, timezone
+import pydantic
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from coopapi import ApiShell, ConditionalGet
+
+
+class Item(pydantic.BaseModel):
+    id: str
+    name: str
+    version: int = 0
+
+
+class TestConditionalGet(unittest.TestCase):
+    def setUp(self):
+        self.docs = {'1': {'id': '1', 'name': 'a', 'version': 1, 'secret': 'x'}}
+
+        def getone(request, id):
+            return self.docs[id]
+
+        def getmany(request, query, limit):
+            return list(self.docs.values())
+
+        app = FastAPI()
+        app.include_router(ApiShell(Item, '/h', on_getone_callback=getone, on_getmany_callback=getmany,
+                                    conditional_get=ConditionalGet()).router)
+        app.include_router(ApiShell(Item, '/v', on_getone_callback=getone,
+                                    conditional_get=ConditionalGet(etag_callback=lambda request, x: str(x['version']),
+                                                                   last_modified_callback=lambda request, x: datetime(2024, 1, 1, tzinfo=timezone.utc))).router)
+        app.include_router(ApiShell(Item, '/o', on_getone_callback=lambda request, id: Item(id=id, name='a', version=3),
+                                    conditional_get=ConditionalGet(etag_callback=lambda request, x: f'v{x.version}')).router)
+        app.include_router(ApiShell(Item, '/t', on_getone_callback=getone, conditional_get=ConditionalGet(),
+                                    trusted_output=True).router)
+        self.client = TestClient(app, raise_server_exceptions=False)
+
+    def test_etag_and_304(self):
+        ret = self.client.get('/h/api/1')
+        self.assertEqual(ret.status_code, 200)
+        etag = ret.headers['etag']
+        again = self.client.get('/h/api/1', headers={'If-None-Match': etag})
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.content, b'')
+        self.assertEqual(again.headers['etag'], etag)
+
+        self.docs['1'] = {**self.docs['1'], 'name': 'b'}
+        self.assertEqual(self.client.get('/h/api/1', headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_etag_callback_and_last_modified(self):
+        ret = self.client.get('/v/api/1')
+        self.assertEqual(ret.headers['etag'], '"1"')
+        self.assertEqual(self.client.get('/v/api/1', headers={'If-None-Match': 'W/"1"'}).status_code, 304)
+        self.assertEqual(self.client.get('/v/api/1', headers={'If-Modified-Since': ret.headers['last-modified']}).status_code, 304)
+        self.assertEqual(self.client.get('/v/api/1', headers={'If-Modified-Since': 'Sun, 31 Dec 2023 00:00:00 GMT'}).status_code, 200)
+
+    def test_callbacks_get_the_item_as_returned(self):
+        self.assertEqual(self.client.get('/o/api/1').headers['etag'], '"v3"')
+        self.assertEqual(self.client.get('/o/api/1', headers={'If-None-Match': '"v3"'}).status_code, 304)
+
+    def test_body_goes_through_the_response_model(self):
+        self.assertEqual(self.client.get('/h/api/1').json(), {'id': '1', 'name': 'a', 'version': 1})
+        self.assertEqual(self.client.get('/h/api/').json(), [{'id': '1', 'name': 'a', 'version': 1}])
+        self.docs['2'] = {'id': '2'}
+        self.assertEqual(self.client.get('/h/api/2').status_code, 500)
+
+    def test_trusted_output_skips_validation(self):
+        self.assertEqual(self.client.get('/t/api/1').json()['secret'], 'x')
+
+    def test_projection(self):
+        ret = self.client.get('/h/api/1', params={'fields': 'name'})
+        self.assertEqual(ret.json(), {'name': 'a'})
+        self.assertEqual(self.client.get('/h/api/1', params={'fields': 'name'},
+                                         headers={'If-None-Match': ret.headers['etag']}).status_code, 304)
+
+    def test_projection_with_etag_callback(self):
+        # the callbacks see the whole item, so a version field that isn't requested still drives the ETag
+        ret = self.client.get('/v/api/1', params={'fields': 'name'})
+        self.assertEqual(ret.status_code, 200)
+        self.assertEqual(ret.json(), {'name': 'a'})
+        self.assertEqual(ret.headers['etag'], '"1"')
+        self.assertEqual(self.client.get('/v/api/1', params={'fields': 'name'},
+                                         headers={'If-None-Match': '"1"'}).status_code, 304)
+
+    def test_projection_of_unknown_field(self):
+        self.assertEqual(self.client.get('/h/api/1', params={'fields': 'secret'}).status_code, 400)
+        self.assertEqual(self.client.get('/v/api/1', params={'fields': 'name,nope'}).status_code, 400)
+
+    def test_projection_on_getmany(self):
+        ret = self.client.get('/h/api/', params={'fields': 'id'})
+        self.assertEqual(ret.json(), [{'id': '1'}])
+        self.assertEqual(self.client.get('/h/api/', params={'fields': 'id'},
+                                         headers={'If-None-Match': ret.headers['etag']}).status_code, 304)
+        # a projection is its own representation, with its own ETag
+        self.assertNotEqual(self.client.get('/h/api/').headers['etag'], ret.headers['etag'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import logging
+import unittest
+from unittest import mock
+import pydantic
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from coopapi import ApiShell, InMemoryStore
+from coopapi import dirty_ingest
+from coopapi.payload_logging import PayloadLogConfig, REDACTED
+
+
+class Item(pydantic.BaseModel):
+    id: str
+    n: int
+    secret: str = ''
+
+
+def _clean(record):
+    return {k: v[0] for k, v in record.items()}
+
+
+class TestDirtyIngest(unittest.TestCase):
+    def setUp(self):
+        self.store = InMemoryStore(Item)
+        self.store.add(Item(id='0', n=0))
+        app = FastAPI()
+        app.include_router(ApiShell(Item, '/d', dirty_create=_clean, log_config=PayloadLogConfig(),
+                                    **self.store.callbacks()).router)
+        self.client = TestClient(app)
+
+    def _ingest(self, body: bytes, content_type: str = 'text/plain'):
+        ret = self.client.post('/d/dirty/stream', content=body, headers={'content-type': content_type})
+        self.assertEqual(ret.status_code, 200)
+        return ret.json()
+
+    def test_lines(self):
+        report = self._ingest(b'id=1&n=1\nid=2&n=two\n\nid=0&n=0\nid=3&n=3\n')
+        self.assertEqual((report['received'], report['created'], report['failed']), (4, 2, 2))
+        self.assertEqual([(x['record'], x['status_code']) for x in report['errors']], [(2, 400), (4, 409)])
+        self.assertEqual(report['errors'][1]['id'], '0')
+        self.assertEqual(self.store.get('3').n, 3)
+
+    def test_csv(self):
+        report = self._ingest('id,n,secret\n1,1,"two\nlines"\n2,x,\n3,3,é\n'.encode(), 'text/csv')
+        self.assertEqual((report['received'], report['created'], report['failed']), (3, 2, 1))
+        self.assertEqual([(x['record'], x['status_code']) for x in report['errors']], [(2, 400)])
+        self.assertEqual(self.store.get('1').secret, 'two\nlines')
+        self.assertEqual(self.store.get('3').secret, 'é')
+
+    def test_upload_spooled_to_disk(self):
+        with mock.patch.object(dirty_ingest, 'SPOOL_MAX_BYTES', 16):
+            report = self._ingest(''.join(f'id={i}&n={i}&secret=é\n' for i in range(1, 50)).encode())
+        self.assertEqual((report['received'], report['created'], report['failed']), (49, 49, 0))
+
+    def test_cleaned_records_are_logged_redacted(self):
+        with self.assertLogs('DirtyIngest', logging.DEBUG) as logs:
+            self._ingest(b'id=1&n=1&secret=hunter2\n')
+        records = [x for x in logs.output if 'cleaned to' in x]
+        self.assertEqual(len(records), 1)
+        self.assertIn(REDACTED, records[0])
+        self.assertNotIn('hunter2', records[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+import pydantic
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from coopapi import ApiShell, DuplicateException, NotFoundException
+
+
+class Item(pydantic.BaseModel):
+    id: str
+    name: str
+
+
+def _callbacks(db: dict, run_async: bool) -> dict:
+    def post(request, item):
+        if item.id in db:
+            raise DuplicateException()
+        db[item.id] = item
+        return item
+
+    def put(request, id, update_values):
+        if id not in db:
+            raise NotFoundException()
+        db[id] = Item(**{**db[id].dict(), **update_values})
+        return db[id]
+
+    def delete(request, id):
+        if id == 'boom':
+            raise RuntimeError('backend down')
+        if db.pop(id, None) is None:
+            raise NotFoundException()
+        return True
+
+    def getone(request, id):
+        if id not in db:
+            raise NotFoundException()
+        return db[id]
+
+    def getmany(request, query, limit):
+        return [x for x in db.values() if all(getattr(x, k) == v for k, v in (query or {}).items())][:limit]
+
+    callbacks = {'on_post_callback': post, 'on_put_callback': put, 'on_delete_callback': delete,
+                 'on_getone_callback': getone, 'on_getmany_callback': getmany}
+    if not run_async:
+        return callbacks
+
+    def to_async(fn):
+        async def run(*args, **kwargs):
+            return fn(*args, **kwargs)
+        return run
+    return {k: to_async(v) for k, v in callbacks.items()}
+
+
+class TestHandlerParity(unittest.TestCase):
+    '''Sync and async callbacks go through different handlers, which have to answer every request the same way'''
+    def setUp(self):
+        app = FastAPI()
+        app.include_router(ApiShell(Item, '/sync', **_callbacks({}, run_async=False)).router)
+        app.include_router(ApiShell(Item, '/async', **_callbacks({}, run_async=True)).router)
+        self.client = TestClient(app, raise_server_exceptions=False)
+
+    def _both(self, method: str, path: str, **kwargs):
+        sync = self.client.request(method, f'/sync{path}', **kwargs)
+        asyn = self.client.request(method, f'/async{path}', **kwargs)
+        self.assertEqual(sync.status_code, asyn.status_code, f"{method} {path}")
+        self.assertEqual(sync.json(), asyn.json(), f"{method} {path}")
+        return sync
+
+    def test_crud(self):
+        self.assertEqual(self._both('POST', '/api/', json={'id': '1', 'name': 'a'}).status_code, 201)
+        self.assertEqual(self._both('POST', '/api/', json={'id': '2', 'name': 'b'}).status_code, 201)
+        self.assertEqual(self._both('GET', '/api/1').json(), {'id': '1', 'name': 'a'})
+        self.assertEqual(self._both('GET', '/api/', params={'query': '{"name": "b"}'}).json(), [{'id': '2', 'name': 'b'}])
+        self.assertEqual(self._both('PUT', '/api/1', json={'name': 'z'}).json(), {'id': '1', 'name': 'z'})
+        self.assertEqual(self._both('DELETE', '/api/1').json(), True)
+
+    def test_errors(self):
+        self._both('POST', '/api/', json={'id': '1', 'name': 'a'})
+        self.assertEqual(self._both('POST', '/api/', json={'id': '1', 'name': 'a'}).status_code, 409)
+        self.assertEqual(self._both('POST', '/api/', json={'id': '3'}).status_code, 422)
+        self.assertEqual(self._both('GET', '/api/9').status_code, 404)
+        self.assertEqual(self._both('PUT', '/api/9', json={'name': 'z'}).status_code, 404)
+        self.assertEqual(self._both('DELETE', '/api/9').status_code, 404)
+
+    def test_delete_error_is_not_swallowed(self):
+        for prefix in ('/sync', '/async'):
+            self.assertEqual(self.client.delete(f'{prefix}/api/boom').status_code, 500)
+
+
+if __name__ == '__main__':
+    unittest.main()
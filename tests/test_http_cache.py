@@ -0,0 +1,74 @@
+import unittest
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+from coopapi.http_cache import HttpCache
+
+
+def _response(status_code: int = 200, content: bytes = b'{}', **headers) -> Response:
+    ret = Response()
+    ret.status_code = status_code
+    ret._content = content
+    ret.headers = CaseInsensitiveDict({k.replace('_', '-'): v for k, v in headers.items()})
+    ret.url = 'http://test/x'
+    return ret
+
+
+class StandIn:
+    '''Plays the part of requests.Session.request, answering from a list of canned responses'''
+    def __init__(self, *responses: Response):
+        self.responses = list(responses)
+        self.sent = []
+
+    def __call__(self, method, url, headers, **kwargs):
+        self.sent.append((method, dict(headers)))
+        return self.responses.pop(0)
+
+
+class TestHttpCache(unittest.TestCase):
+    def test_fresh_response_is_served_without_a_request(self):
+        cache = HttpCache()
+        server = StandIn(_response(content=b'a', cache_control='max-age=60'))
+        for _ in range(3):
+            self.assertEqual(cache.send(server, 'http://test/x', 'GET', {}).content, b'a')
+        self.assertEqual(len(server.sent), 1)
+        self.assertEqual(cache.stats()['hits'], 2)
+
+    def test_stale_response_is_revalidated(self):
+        cache = HttpCache()
+        server = StandIn(_response(content=b'a', cache_control='no-cache', etag='"v1"'),
+                         _response(304, content=b'', etag='"v1"'))
+        cache.send(server, 'http://test/x', 'GET', {})
+        ret = cache.send(server, 'http://test/x', 'GET', {})
+        self.assertEqual(ret.status_code, 200)
+        self.assertEqual(ret.content, b'a')
+        self.assertEqual(server.sent[1][1]['If-None-Match'], '"v1"')
+        self.assertEqual(cache.stats()['revalidated'], 1)
+
+    def test_no_store_and_errors_are_not_cached(self):
+        cache = HttpCache()
+        server = StandIn(_response(content=b'a', cache_control='no-store, max-age=60'),
+                         _response(500, cache_control='max-age=60'),
+                         _response(content=b'c'))
+        for _ in range(3):
+            cache.send(server, 'http://test/x', 'GET', {})
+        self.assertEqual(len(server.sent), 3)
+
+    def test_unsafe_request_drops_the_entry(self):
+        cache = HttpCache()
+        server = StandIn(_response(content=b'a', cache_control='max-age=60'),
+                         _response(204, content=b''),
+                         _response(content=b'b', cache_control='max-age=60'))
+        cache.send(server, 'http://test/x', 'GET', {})
+        cache.send(server, 'http://test/x', 'PUT', {})
+        self.assertEqual(cache.send(server, 'http://test/x', 'GET', {}).content, b'b')
+
+    def test_credentials_are_part_of_the_key(self):
+        cache = HttpCache()
+        server = StandIn(_response(content=b'a', cache_control='max-age=60'),
+                         _response(content=b'b', cache_control='max-age=60'))
+        self.assertEqual(cache.send(server, 'http://test/x', 'GET', {'Authorization': 'Bearer 1'}).content, b'a')
+        self.assertEqual(cache.send(server, 'http://test/x', 'GET', {'Authorization': 'Bearer 2'}).content, b'b')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from coopapi import http_request
+from coopapi.enums import RequestType
+from coopapi.http_request import DEFAULT_TIMEOUT, HttpClient
+from coopapi.tracing import REQUEST_ID_HEADER
+
+
+class StandIn(ThreadingHTTPServer):
+    '''A local server standing in for the network, counting hits per path and recording which connection each came on'''
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.hits = {}
+        self.ports = []
+        self.headers = []
+        self.thread = threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.01}, daemon=True)
+        self.thread.start()
+
+    def url(self, path: str) -> str:
+        return f'http://127.0.0.1:{self.server_port}{path}'
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        # a client that timed out has gone by the time the answer is written
+        pass
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        hits = self.server.hits[self.path] = self.server.hits.get(self.path, 0) + 1
+        self.server.ports.append(self.client_address[1])
+        self.server.headers.append(dict(self.headers))
+        if self.path == '/flaky' and hits < 3:
+            return self._send(503)
+        if self.path == '/drop' and hits < 2:
+            # hang up without answering, as a dropped connection would
+            self.close_connection = True
+            return
+        if self.path == '/slow':
+            time.sleep(0.5)
+        self._send(200)
+
+    def _send(self, code: int):
+        body = self.path.encode()
+        self.send_response(code)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = _respond
+
+
+class TestHttpClient(unittest.TestCase):
+    def setUp(self):
+        self.server = StandIn()
+        self.client = HttpClient(retries=2, backoff_factor=0)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+
+    def test_session_is_reused(self):
+        for _ in range(3):
+            self.assertEqual(self.client.request(self.server.url('/ok'), RequestType.GET).text, '/ok')
+        # one keep-alive connection, so every request came from the same client port
+        self.assertEqual(len(set(self.server.ports)), 1)
+
+    def test_retries_5xx(self):
+        self.assertEqual(self.client.request(self.server.url('/flaky'), RequestType.GET).status_code, 200)
+        self.assertEqual(self.server.hits['/flaky'], 3)
+
+    def test_does_not_retry_post(self):
+        self.assertEqual(self.client.request(self.server.url('/flaky'), RequestType.POST).status_code, 503)
+        self.assertEqual(self.server.hits['/flaky'], 1)
+
+    def test_retries_dropped_connections(self):
+        self.assertEqual(self.client.request(self.server.url('/drop'), RequestType.GET).status_code, 200)
+        self.assertEqual(self.server.hits['/drop'], 2)
+
+    def test_connection_refused(self):
+        url = self.server.url('/ok')
+        self.server.close()
+        with self.assertRaises(requests.ConnectionError):
+            self.client.request(url, RequestType.GET)
+
+    def test_timeouts(self):
+        self.assertEqual(self.client.timeout, DEFAULT_TIMEOUT)
+        with HttpClient(timeout=(1, 0.1), retries=0) as client:
+            start = time.perf_counter()
+            with self.assertRaises(requests.RequestException):
+                client.request(self.server.url('/slow'), RequestType.GET)
+            self.assertLess(time.perf_counter() - start, 0.45)
+        # a per call timeout wins over the client's
+        self.assertEqual(self.client.request(self.server.url('/slow'), RequestType.GET, timeout=2).status_code, 200)
+
+
+class TestModuleFunctions(unittest.TestCase):
+    def setUp(self):
+        self.server = StandIn()
+        self.client = HttpClient()
+        self.previous = http_request.default_client()
+        http_request.set_default_client(self.client)
+
+    def tearDown(self):
+        http_request.set_default_client(self.previous)
+        self.client.close()
+        self.server.close()
+
+    def test_delegate_to_the_default_client(self):
+        self.assertEqual(http_request.get(self.server.url('/a'), request_id='abc').text, '/a')
+        self.assertEqual(http_request.post(self.server.url('/b'), json_serializable={'x': 1}).text, '/b')
+        self.assertEqual(self.server.headers[0][REQUEST_ID_HEADER], 'abc')
+        self.assertEqual(len(set(self.server.ports)), 1)
+        self.assertIs(http_request.default_client(), self.client)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import subprocess
+import sys
+import unittest
+
+
+def _run(code: str) -> str:
+    return subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout.strip()
+
+
+class TestImports(unittest.TestCase):
+    def test_submodules_are_attributes_of_the_package(self):
+        out = _run("import coopapi; print(coopapi.http_request_handlers.__name__, coopapi.apiShell.ApiShell.__name__, "
+                   "coopapi.errors.NotFoundException.__name__)")
+        self.assertEqual(out, 'coopapi.http_request_handlers ApiShell NotFoundException')
+
+    def test_unknown_names_raise_attribute_error(self):
+        import coopapi
+        self.assertRaises(AttributeError, getattr, coopapi, 'not_a_thing')
+        self.assertFalse(hasattr(coopapi, '__wrapped__'))
+
+    def test_public_names_are_loaded_on_use(self):
+        out = _run("import sys, coopapi; before = 'fastapi' in sys.modules; coopapi.ApiShell; "
+                   "print(before, 'fastapi' in sys.modules)")
+        self.assertEqual(out, 'False True')
+
+    def test_client_does_not_load_the_server(self):
+        out = _run("import sys, coopapi.http_request; print(sorted(x for x in ('fastapi', 'starlette', 'pydantic') if x in sys.modules))")
+        self.assertEqual(out, '[]')
+
+
+if __name__ == '__main__':
+    unittest.main()
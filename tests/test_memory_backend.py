@@ -0,0 +1,100 @@
+import random
+import unittest
+from dataclasses import dataclass
+from typing import Optional
+from coopapi import DuplicateException, InMemoryStore, NotFoundException
+from coopapi.memory_backend import _matches
+
+
+@dataclass
+class Row:
+    id: str
+    color: Optional[str] = None
+    qty: Optional[int] = None
+
+
+COLORS = ['red', 'green', 'blue', None]
+
+QUERIES = [
+    {'color': 'red'},
+    {'color': None},
+    {'color': {'$eq': 'green'}},
+    {'color': {'$in': ['red', 'blue']}},
+    {'color': {'$ne': 'red'}},
+    {'qty': 3},
+    {'qty': None},
+    {'qty': {'$eq': None}},
+    {'qty': {'$gte': 2, '$lt': 6}},
+    {'qty': {'$gt': 7}},
+    {'qty': {'$lte': 1}},
+    {'qty': {'$in': [1, 4]}},
+    {'color': 'blue', 'qty': {'$gte': 5}},
+    {'id': {'$gte': '05', '$lt': '12'}},
+    {'id': '07'},
+]
+
+
+class TestInMemoryStore(unittest.TestCase):
+    def setUp(self):
+        self.store = InMemoryStore(Row, hash_indexes=['color'], sorted_indexes=['qty'])
+        # the same rows with nothing indexed, to compare against
+        self.scan = {}
+        self.rand = random.Random(11)
+
+    def _row(self, id: str) -> Row:
+        return Row(id=id, color=self.rand.choice(COLORS), qty=self.rand.choice([None] + list(range(10))))
+
+    def _check(self):
+        for query in QUERIES:
+            expected = [x for _, x in sorted(self.scan.items())
+                        if all(_matches(getattr(x, k), v) for k, v in query.items())]
+            self.assertEqual(self.store.find(query), expected, query)
+            self.assertEqual(self.store.find(query, limit=3), expected[:3], query)
+        self.assertEqual(self.store.find(), [x for _, x in sorted(self.scan.items())])
+        self.assertEqual(len(self.store), len(self.scan))
+
+    def test_queries_match_a_full_scan(self):
+        for i in range(300):
+            id = f'{self.rand.randrange(20):02}'
+            op = self.rand.random()
+            if id not in self.scan:
+                self.scan[id] = self.store.add(self._row(id))
+            elif op < 0.4:
+                values = {k: v for k, v in vars(self._row(id)).items() if k != 'id'}
+                self.scan[id] = self.store.update(id, values)
+            elif op < 0.7:
+                self.store.delete(id)
+                del self.scan[id]
+            else:
+                new_id = f'{self.rand.randrange(20):02}'
+                if new_id in self.scan and new_id != id:
+                    with self.assertRaises(DuplicateException):
+                        self.store.update(id, {'id': new_id})
+                else:
+                    self.scan[new_id] = self.store.update(id, {'id': new_id, 'qty': 1})
+                    if new_id != id:
+                        del self.scan[id]
+            if i % 10 == 0:
+                self._check()
+        self._check()
+
+    def test_key_change_moves_the_item(self):
+        self.store.add(Row(id='1', color='red', qty=1))
+        self.store.update('1', {'id': '2'})
+        with self.assertRaises(NotFoundException):
+            self.store.get('1')
+        self.assertEqual(self.store.get('2'), Row(id='2', color='red', qty=1))
+        self.assertEqual(self.store.find({'color': 'red'}), [Row(id='2', color='red', qty=1)])
+        self.assertEqual(self.store.find({'qty': 1}), [Row(id='2', color='red', qty=1)])
+        self.assertEqual(self.store.find({'id': '1'}), [])
+        self.assertEqual(self.store.find_after(after='1'), [Row(id='2', color='red', qty=1)])
+
+    def test_find_after_pages_by_id(self):
+        for i in (3, 1, 2):
+            self.store.add(Row(id=str(i), qty=i))
+        self.assertEqual([x.id for x in self.store.iter_after(page_size=2)], ['1', '2', '3'])
+        self.assertEqual([x.id for x in self.store.find_after({'qty': {'$gt': 1}}, after='2')], ['3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
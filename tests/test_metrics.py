@@ -0,0 +1,101 @@
+import re
+import unittest
+import pydantic
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from coopapi import AdmissionControl, AdmissionLimit, ApiShell, NotFoundException, RouteMetrics
+
+
+class Item(pydantic.BaseModel):
+    id: str
+    name: str
+
+
+def getone(request, id):
+    if id == 'missing':
+        raise NotFoundException()
+    return Item(id=id, name='a')
+
+
+def _samples(txt: str) -> dict:
+    '''The exposition's samples as {'name{labels}': value}'''
+    ret = {}
+    for line in txt.splitlines():
+        if line and not line.startswith('#'):
+            key, value = line.rsplit(' ', 1)
+            ret[key] = float(value)
+    return ret
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.metrics = RouteMetrics(buckets=(0.1, 1.0))
+        app = FastAPI()
+        app.include_router(ApiShell(Item, '/m', on_getone_callback=getone, metrics=self.metrics,
+                                    admission=AdmissionControl(shell=AdmissionLimit(max_in_flight=4))).router)
+        self.client = TestClient(app, raise_server_exceptions=False)
+
+    def test_requests_are_counted_by_route_and_status(self):
+        for id in ('1', '2', 'missing'):
+            self.client.get(f'/m/api/{id}')
+
+        samples = _samples(self.client.get('/m/metrics').text)
+        self.assertEqual(samples['coopapi_requests_total{route="/m/api/{id}",method="GET",status="200"}'], 2)
+        self.assertEqual(samples['coopapi_requests_total{route="/m/api/{id}",method="GET",status="404"}'], 1)
+        self.assertEqual(samples['coopapi_request_duration_seconds_count{route="/m/api/{id}",method="GET"}'], 3)
+        self.assertEqual(samples['coopapi_callback_duration_seconds_count{shell="/m",callback="getone"}'], 3)
+
+    def test_histograms_are_cumulative(self):
+        self.client.get('/m/api/1')
+        samples = _samples(self.client.get('/m/metrics').text)
+        buckets = [samples[f'coopapi_request_duration_seconds_bucket{{route="/m/api/{{id}}",method="GET",le="{le}"}}']
+                   for le in ('0.1', '1.0', '+Inf')]
+        self.assertEqual(buckets, sorted(buckets))
+        self.assertEqual(buckets[-1], 1)
+        self.assertGreater(samples['coopapi_request_duration_seconds_sum{route="/m/api/{id}",method="GET"}'], 0)
+
+    def test_exposition_format(self):
+        self.client.get('/m/api/1')
+        ret = self.client.get('/m/metrics')
+        self.assertEqual(ret.status_code, 200)
+        self.assertTrue(ret.headers['content-type'].startswith('text/plain; version=0.0.4'))
+        families = re.findall(r'^# TYPE (\S+) (\S+)$', ret.text, re.M)
+        self.assertIn(('coopapi_requests_total', 'counter'), families)
+        self.assertIn(('coopapi_request_duration_seconds', 'histogram'), families)
+        self.assertIn(('coopapi_admission_in_flight', 'gauge'), families)
+        self.assertEqual(_samples(ret.text)['coopapi_admission_in_flight{shell="/m",verb="*"}'], 0)
+        for line in ret.text.splitlines():
+            self.assertRegex(line, r'^(# (HELP|TYPE) \S+ .+|[a-z_]+(\{.*\})? \S+)$')
+
+    def test_label_values_are_escaped(self):
+        admission = AdmissionControl(shell=AdmissionLimit(max_in_flight=1))
+        admission.gates('s', 'GET')
+        txt = admission.render_prometheus(shell='a"b\\c\nd')
+        self.assertIn('coopapi_admission_queued{shell="a\\"b\\\\c\\nd",verb="*"} 0', txt)
+
+
+class TestSharedMetrics(unittest.TestCase):
+    def test_app_level_endpoint(self):
+        metrics = RouteMetrics()
+        app = FastAPI()
+        for base_route in ('/a', '/b'):
+            app.include_router(ApiShell(Item, base_route, on_getone_callback=getone, metrics=metrics, metrics_endpoint=False,
+                                        admission=AdmissionControl(shell=AdmissionLimit(max_in_flight=4))).router)
+        app.include_router(metrics.router())
+        client = TestClient(app)
+        client.get('/a/api/1')
+        client.get('/b/api/1')
+
+        self.assertEqual(client.get('/a/metrics').status_code, 404)
+        txt = client.get('/metrics').text
+        samples = _samples(txt)
+        self.assertEqual(samples['coopapi_requests_total{route="/a/api/{id}",method="GET",status="200"}'], 1)
+        self.assertEqual(samples['coopapi_requests_total{route="/b/api/{id}",method="GET",status="200"}'], 1)
+        self.assertIn('coopapi_admission_in_flight{shell="/a",verb="*"}', samples)
+        self.assertIn('coopapi_admission_in_flight{shell="/b",verb="*"}', samples)
+        # each family is described once, however many shells share it
+        self.assertEqual(txt.count('# TYPE coopapi_admission_in_flight '), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
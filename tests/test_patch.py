@@ -0,0 +1,102 @@
+import unittest
+from typing import List, Optional
+import pydantic
+import pydantic.dataclasses
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from coopapi import ApiShell, ChangeFeed, InMemoryStore, NotFoundException
+from coopapi.http_request_handlers import patch_model
+
+
+class Item(pydantic.BaseModel):
+    id: str
+    name: str = pydantic.Field(..., max_length=3)
+    qty: int = pydantic.Field(0, ge=0)
+    tags: List[str] = []
+    note: Optional[str] = None
+
+    @pydantic.validator('name')
+    def not_reserved(cls, v):
+        if v == 'nil':
+            raise ValueError('name is reserved')
+        return v.lower()
+
+
+class TestPatchModel(unittest.TestCase):
+    def test_constraints_and_validators_are_kept(self):
+        model = patch_model(Item)
+        with self.assertRaises(pydantic.ValidationError) as ctx:
+            model(name='toolong', qty=-5)
+        self.assertEqual({x['loc'][0] for x in ctx.exception.errors()}, {'name', 'qty'})
+        self.assertRaises(pydantic.ValidationError, model, name='nil')
+        self.assertEqual(model(name='AB').dict(exclude_unset=True), {'name': 'ab'})
+
+    def test_pydantic_dataclass_constraints_are_kept(self):
+        @pydantic.dataclasses.dataclass
+        class Thing:
+            id: str
+            size: int = pydantic.Field(..., le=10)
+
+        self.assertRaises(pydantic.ValidationError, patch_model(Thing), size=11)
+        self.assertEqual(patch_model(Thing)(size='3').dict(exclude_unset=True), {'size': 3})
+
+    def test_null_only_where_the_schema_allows_it(self):
+        self.assertRaises(pydantic.ValidationError, patch_model(Item), qty=None)
+        self.assertEqual(patch_model(Item)(note=None).dict(exclude_unset=True), {'note': None})
+
+    def test_id_and_unknown_fields_are_rejected(self):
+        self.assertRaises(pydantic.ValidationError, patch_model(Item), id='2')
+        self.assertRaises(pydantic.ValidationError, patch_model(Item), colour='red')
+
+
+class TestPatchRoute(unittest.TestCase):
+    def setUp(self):
+        self.store = InMemoryStore(Item)
+        self.store.add(Item(id='1', name='a', qty=2))
+        self.changes = []
+
+        def patch(request, id, changes):
+            self.changes.append(changes)
+            return self.store.update(id, changes)
+
+        async def patch_async(request, id, changes):
+            if id != '1':
+                raise NotFoundException()
+            return {**self.store.get(id).dict(), **changes}
+
+        self.feed = ChangeFeed()
+        app = FastAPI()
+        app.include_router(ApiShell(Item, '/p', on_patch_callback=patch, change_feed=self.feed).router)
+        app.include_router(ApiShell(Item, '/c', on_patch_callback=patch_async, patch_changes_only=True,
+                                    trusted_output=True, verify_output=True).router)
+        self.client = TestClient(app)
+
+    def test_only_sent_fields_reach_the_callback(self):
+        ret = self.client.patch('/p/api/1', json={'qty': 5})
+        self.assertEqual(ret.status_code, 202)
+        self.assertEqual(ret.json(), {'id': '1', 'name': 'a', 'qty': 5, 'tags': [], 'note': None})
+        self.assertEqual(self.changes, [{'qty': 5}])
+        self.assertEqual(self.feed.stats()['published'], 1)
+
+    def test_invalid_patches(self):
+        self.assertEqual(self.client.patch('/p/api/1', json={'name': 'toolong'}).status_code, 422)
+        self.assertEqual(self.client.patch('/p/api/1', json={'qty': -1}).status_code, 422)
+        self.assertEqual(self.client.patch('/p/api/1', json={'name': 'nil'}).status_code, 422)
+        self.assertEqual(self.client.patch('/p/api/1', json={'bogus': 1}).status_code, 422)
+        self.assertEqual(self.client.patch('/p/api/1', json={}).status_code, 400)
+        self.assertEqual(self.client.patch('/p/api/1', json={'name': None}).status_code, 422)
+        self.assertEqual(self.changes, [])
+        self.assertEqual(self.client.patch('/p/api/1', json={'note': None}).status_code, 202)
+
+    def test_missing_item(self):
+        self.assertEqual(self.client.patch('/p/api/9', json={'qty': 1}).status_code, 404)
+        self.assertEqual(self.client.patch('/c/api/9', json={'qty': 1}).status_code, 404)
+
+    def test_changes_only(self):
+        ret = self.client.patch('/c/api/1', json={'name': 'XY'})
+        self.assertEqual(ret.status_code, 202)
+        self.assertEqual(ret.json(), {'id': '1', 'name': 'xy'})
+
+
+if __name__ == '__main__':
+    unittest.main()
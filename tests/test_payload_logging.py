@@ -0,0 +1,92 @@
+import logging
+import unittest
+from unittest import mock
+import pydantic
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from coopapi import ApiShell
+from coopapi import http_request_handlers as hrh
+from coopapi.enums import RequestType
+from coopapi.http_request import _log_send
+from coopapi.payload_logging import LazyPayload, PayloadLogConfig, REDACTED
+
+
+class Item(pydantic.BaseModel):
+    id: str
+    password: str = ''
+
+
+class Unformattable:
+    def __repr__(self):
+        raise AssertionError('formatted a payload that was never logged')
+
+
+class TestPayloadLogging(unittest.TestCase):
+    def test_nested_keys_are_redacted(self):
+        payload = {'user': {'Password': 'p', 'roles': [{'token': 't', 'name': 'admin'}]}, 'Authorization': 'Bearer x'}
+        with self.assertLogs('coop.http', logging.INFO) as logs:
+            _log_send(id='1', lvl=logging.INFO, method=RequestType.POST, url='http://x', json=payload)
+        self.assertNotIn("'p'", logs.output[0])
+        self.assertNotIn("'t'", logs.output[0])
+        self.assertNotIn('Bearer', logs.output[0])
+        self.assertIn("'admin'", logs.output[0])
+        self.assertEqual(logs.output[0].count(repr(REDACTED)), 3)
+        # the payload itself is left as it was
+        self.assertEqual(payload['user']['Password'], 'p')
+
+    def test_truncation_length(self):
+        config = PayloadLogConfig(max_body_chars=50)
+        txt = config.format('x' * 500)
+        self.assertEqual(txt, f"{repr('x' * 500)[:50]}... [{len(repr('x' * 500)) - 50} chars truncated]")
+        self.assertEqual(config.format('short'), "'short'")
+        big = config.format_content(b'y' * (config.max_parse_bytes + 1))
+        self.assertEqual(big, f"{'y' * 50}... [{config.max_parse_bytes + 1} bytes total]")
+
+    def test_sampling(self):
+        app = FastAPI()
+        app.include_router(ApiShell(Item, '/s', on_post_callback=lambda request, item: item,
+                                    log_config=PayloadLogConfig(sample_rate=0.5)).router)
+        client = TestClient(app)
+        with self.assertLogs(hrh.logger, logging.INFO) as logs:
+            # the first draw misses the sample and the second is in it
+            with mock.patch('random.random', side_effect=[0.9, 0.1]):
+                client.post('/s/api/', json={'id': '1'})
+                client.post('/s/api/', json={'id': '2'})
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("'id': '2'", logs.output[0])
+        self.assertFalse(PayloadLogConfig(sample_rate=0).enabled(hrh.logger, logging.CRITICAL))
+
+    def test_nothing_is_formatted_when_the_level_is_off(self):
+        logger = logging.getLogger('coop.http')
+        previous = logger.level
+        logger.setLevel(logging.WARNING)
+        try:
+            with mock.patch.object(PayloadLogConfig, 'format', side_effect=AssertionError('formatted')) as fmt:
+                _log_send(id='1', lvl=logging.INFO, method=RequestType.POST, url='http://x', json=Unformattable())
+                logger.info('%s', LazyPayload(Unformattable()))
+            self.assertFalse(fmt.called)
+        finally:
+            logger.setLevel(previous)
+
+    def test_shell_logs_through_log_config(self):
+        app = FastAPI()
+        app.include_router(ApiShell(Item, '/l', on_post_callback=lambda request, item: item,
+                                    log_config=PayloadLogConfig(redact_fields=frozenset(['password']))).router)
+        client = TestClient(app)
+        with self.assertLogs(hrh.logger, logging.INFO) as logs:
+            client.post('/l/api/', json={'id': '1', 'password': 'hunter2'})
+        self.assertTrue(any(REDACTED in x for x in logs.output))
+        self.assertFalse(any('hunter2' in x for x in logs.output))
+
+        previous = hrh.logger.level
+        hrh.logger.setLevel(logging.WARNING)
+        try:
+            with mock.patch.object(PayloadLogConfig, 'format') as fmt:
+                client.post('/l/api/', json={'id': '2'})
+            self.assertFalse(fmt.called)
+        finally:
+            hrh.logger.setLevel(previous)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+import pydantic
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from coopapi import ApiShell, ShellRegistry
+
+
+class Item(pydantic.BaseModel):
+    id: str
+    name: str
+
+
+def _shell(base_route: str) -> ApiShell:
+    # each shell names its items after itself, so a response shows which shell answered
+    return ApiShell(Item, base_route,
+                    on_getone_callback=lambda request, id: Item(id=id, name=base_route),
+                    on_getmany_callback=lambda request, query, limit: [Item(id='1', name=base_route)])
+
+
+BASE_ROUTES = ('/a', '/v1', '/v1/b')
+
+
+class TestShellRegistry(unittest.TestCase):
+    def setUp(self):
+        self.app = FastAPI()
+        self.registry = ShellRegistry(_shell(x) for x in BASE_ROUTES)
+        self.registry.mount(self.app)
+
+        @self.app.get('/a/other')
+        def other():
+            return 'other'
+
+        @self.app.get('/health')
+        def health():
+            return 'ok'
+
+        self.client = TestClient(self.app)
+
+    def test_dispatch_to_the_right_shell(self):
+        for base_route in BASE_ROUTES:
+            self.assertEqual(self.client.get(f'{base_route}/api/1').json(), {'id': '1', 'name': base_route})
+            self.assertEqual(self.client.get(f'{base_route}/api/').json(), [{'id': '1', 'name': base_route}])
+        self.assertEqual(self.client.get('/nope/api/1').status_code, 404)
+
+    def test_wrong_method(self):
+        ret = self.client.delete('/a/api/1')
+        self.assertEqual(ret.status_code, 405)
+        self.assertEqual(ret.headers['allow'], 'GET')
+
+    def test_fallthrough_to_the_app_routes(self):
+        self.assertEqual(self.client.get('/a/other').json(), 'other')
+        self.assertEqual(self.client.get('/health').json(), 'ok')
+
+    def test_openapi_matches_include_router(self):
+        included = FastAPI()
+        for base_route in BASE_ROUTES:
+            included.include_router(_shell(base_route).router)
+
+        routes = list(self.app.router.routes)
+        schema = self.client.get('/openapi.json').json()
+        expected = TestClient(included).get('/openapi.json').json()
+        self.assertEqual({k: v for k, v in schema['paths'].items() if not k.startswith(('/a/other', '/health'))},
+                         expected['paths'])
+        self.assertEqual(schema['components'], expected['components'])
+        self.assertEqual(self.app.router.routes, routes)
+
+    def test_duplicate_base_route(self):
+        with self.assertRaises(ValueError):
+            self.registry.add(_shell('/a/'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import json
+import unittest
+import pydantic
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from coopapi import ApiShell, InMemoryStore
+from coopapi.streaming import NDJSON_MEDIA_TYPE
+
+
+class Item(pydantic.BaseModel):
+    id: str
+    n: int
+
+
+class MongoItem(pydantic.BaseModel):
+    id: str = pydantic.Field(alias='_id')
+    n: int
+
+
+def _docs(key: str, **extra):
+    docs = [{key: f'{i:02}', 'n': i, **extra} for i in range(7)]
+
+    def stream(request, query, limit, after):
+        # like a Mongo cursor, yielding plain documents
+        rows = (x for x in docs if after is None or x[key] > after)
+        return (x for i, x in enumerate(rows) if limit is None or i < limit)
+    return stream
+
+
+class TestStreaming(unittest.TestCase):
+    def setUp(self):
+        store = InMemoryStore(Item)
+        for i in range(7):
+            store.add(Item(id=f'{i:02}', n=i))
+
+        async def getmany(request, query, limit):
+            for x in store.find(query, limit):
+                yield x
+
+        callbacks = store.callbacks()
+        app = FastAPI()
+        app.include_router(ApiShell(Item, '/s', on_getmany_callback=getmany,
+                                    on_getmany_stream_callback=callbacks['on_getmany_stream_callback']).router)
+        app.include_router(ApiShell(Item, '/d', on_getmany_stream_callback=_docs('id')).router)
+        app.include_router(ApiShell(MongoItem, '/m', on_getmany_stream_callback=_docs('_id')).router)
+        app.include_router(ApiShell(Item, '/x', on_getmany_stream_callback=_docs('id', secret='s')).router)
+        app.include_router(ApiShell(Item, '/b', on_getmany_stream_callback=_docs('id', n='nan')).router)
+        app.include_router(ApiShell(Item, '/t', on_getmany_stream_callback=_docs('id', secret='s'),
+                                    trusted_output=True).router)
+        self.client = TestClient(app)
+
+    def _pages(self, prefix: str, **kwargs):
+        ids = []
+        cursor = None
+        while True:
+            page = self.client.get(f'{prefix}/api/stream', params={'limit': 3, **({'cursor': cursor} if cursor else {})},
+                                   **kwargs)
+            self.assertEqual(page.status_code, 200)
+            if page.headers['content-type'].startswith(NDJSON_MEDIA_TYPE):
+                lines = [json.loads(x) for x in page.text.splitlines()]
+                cursor = lines.pop()['next_cursor'] if lines and 'next_cursor' in lines[-1] else None
+                items = lines
+            else:
+                body = page.json()
+                items, cursor = body['items'], body['next_cursor']
+            ids.append([x.get('id', x.get('_id')) for x in items])
+            if cursor is None:
+                return ids
+
+    def test_pages_of_objects(self):
+        self.assertEqual(self._pages('/s'), [['00', '01', '02'], ['03', '04', '05'], ['06']])
+
+    def test_pages_as_ndjson(self):
+        self.assertEqual(self._pages('/s', headers={'accept': NDJSON_MEDIA_TYPE}),
+                         [['00', '01', '02'], ['03', '04', '05'], ['06']])
+
+    def test_pages_of_documents(self):
+        self.assertEqual(self._pages('/d'), [['00', '01', '02'], ['03', '04', '05'], ['06']])
+        self.assertEqual(self._pages('/m'), [['00', '01', '02'], ['03', '04', '05'], ['06']])
+
+    def test_generator_getmany_is_streamed(self):
+        ret = self.client.get('/s/api/', params={'limit': 2})
+        self.assertEqual(ret.json(), [{'id': '00', 'n': 0}, {'id': '01', 'n': 1}])
+
+    def test_items_are_filtered_through_the_schema(self):
+        self.assertEqual(self.client.get('/x/api/stream', params={'limit': 1}).json()['items'], [{'id': '00', 'n': 0}])
+
+    def test_bad_item_fails_the_stream(self):
+        with self.assertRaises(Exception) as raised:
+            self.client.get('/b/api/stream')
+        # anyio may hand the error back inside an exception group
+        errors = getattr(raised.exception, 'exceptions', [raised.exception])
+        self.assertIsInstance(errors[0], pydantic.ValidationError)
+
+    def test_trusted_items_are_sent_as_they_are(self):
+        self.assertEqual(self.client.get('/t/api/stream', params={'limit': 1}).json()['items'],
+                         [{'id': '00', 'n': 0, 'secret': 's'}])
+
+    def test_limit_must_be_positive(self):
+        # a limit of 0 would end every page on an item it never sent
+        self.assertEqual(self.client.get('/s/api/stream', params={'limit': 0}).status_code, 422)
+        self.assertEqual(self.client.get('/s/api/stream', params={'limit': -1}).status_code, 422)
+
+    def test_generator_getmany_projected_by_the_callback(self):
+        async def getmany(request, query, limit, fields=None):
+            for i in range(2):
+                yield {k: v for k, v in {'id': str(i), 'n': i}.items() if fields is None or k in fields}
+
+        app = FastAPI()
+        app.include_router(ApiShell(Item, '/p', on_getmany_callback=getmany).router)
+        ret = TestClient(app).get('/p/api/', params={'fields': 'id'})
+        self.assertEqual(ret.json(), [{'id': '0'}, {'id': '1'}])
+
+    def test_bad_cursor(self):
+        self.assertEqual(self.client.get('/s/api/stream', params={'cursor': 'nope'}).status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+import pydantic
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from coopapi import AdmissionControl, AdmissionLimit, ApiShell, JsonlExporter, RingBufferExporter, Tracer
+from coopapi.tracing import REQUEST_ID_HEADER, current_request_id
+
+
+class Item(pydantic.BaseModel):
+    id: str
+    name: str
+
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        self.seen = []
+
+        def getone(request, id):
+            self.seen.append(current_request_id())
+            return Item(id=id, name='a')
+
+        def post(request, item):
+            return item
+
+        def post_many(request, items):
+            # whether the body was read into memory before the endpoint streamed it
+            self.buffered = hasattr(request, '_body')
+            return items
+
+        self.traces = RingBufferExporter()
+        app = FastAPI()
+        app.include_router(ApiShell(Item, '/t', on_getone_callback=getone, on_post_callback=post,
+                                    dirty_create=lambda record: {k: v[0] for k, v in record.items()},
+                                    on_post_many_callback=post_many,
+                                    tracer=Tracer(self.traces, sample_rate=1.0)).router)
+        app.include_router(ApiShell(Item, '/u', on_getone_callback=getone,
+                                    tracer=Tracer(RingBufferExporter(), sample_rate=0.0)).router)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        app.include_router(ApiShell(Item, '/e', on_getone_callback=getone, executor=self.executor,
+                                    tracer=Tracer(self.traces, sample_rate=1.0)).router)
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_request_id_is_propagated(self):
+        ret = self.client.get('/t/api/1', headers={REQUEST_ID_HEADER: 'abc'})
+        self.assertEqual(ret.headers[REQUEST_ID_HEADER], 'abc')
+        self.assertEqual(self.seen, ['abc'])
+        trace = self.traces.traces()[-1]
+        self.assertEqual((trace['request_id'], trace['route'], trace['status_code']), ('abc', '/t/api/{id}', 200))
+        self.assertEqual(set(trace['spans_ms']), {'validate', 'callback', 'serialize'})
+
+    def test_unsampled_requests_echo_the_id(self):
+        ret = self.client.get('/u/api/1', headers={REQUEST_ID_HEADER: 'abc'})
+        self.assertEqual(ret.headers[REQUEST_ID_HEADER], 'abc')
+        generated = self.client.get('/u/api/1').headers[REQUEST_ID_HEADER]
+        self.assertEqual(self.seen, ['abc', generated])
+
+    def test_callbacks_on_an_executor_see_the_request(self):
+        self.client.get('/e/api/1', headers={REQUEST_ID_HEADER: 'abc'})
+        self.assertEqual(self.seen, ['abc'])
+        self.assertIn('callback', self.traces.traces()[-1]['spans_ms'])
+
+    def test_body_is_timed_as_it_is_read(self):
+        self.client.post('/t/api/', json={'id': '1', 'name': 'a'})
+        self.assertIn('receive', self.traces.traces()[-1]['spans_ms'])
+
+        ret = self.client.post('/t/dirty/stream', content=b'id,name\n1,a\n2,b\n', headers={'content-type': 'text/csv'})
+        self.assertEqual(ret.json()['created'], 2)
+        self.assertFalse(self.buffered)
+        trace = self.traces.traces()[-1]
+        self.assertEqual(trace['route'], '/t/dirty/stream')
+        self.assertIn('receive', trace['spans_ms'])
+
+    def test_failures_are_traced(self):
+        self.client.post('/t/api/', json={'id': '1'})
+        self.assertEqual(self.traces.traces()[-1]['status_code'], 422)
+
+
+class TestJsonlExporter(unittest.TestCase):
+    def test_closed_on_shutdown(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'traces.jsonl')
+            tracer = Tracer(JsonlExporter(path, flush_every=100), sample_rate=1.0)
+            app = FastAPI()
+            # shared by two shells, so closed twice
+            for base_route in ('/a', '/b'):
+                app.include_router(ApiShell(Item, base_route, on_getone_callback=lambda request, id: Item(id=id, name='a'),
+                                            tracer=tracer).router)
+            with TestClient(app) as client:
+                client.get('/a/api/1', headers={REQUEST_ID_HEADER: 'abc'})
+                client.get('/b/api/1')
+            with open(path) as f:
+                traces = [json.loads(x) for x in f]
+        self.assertEqual([x['route'] for x in traces], ['/a/api/{id}', '/b/api/{id}'])
+        self.assertEqual(traces[0]['request_id'], 'abc')
+
+
+class TestTracingAdmission(unittest.IsolatedAsyncioTestCase):
+    async def test_queue_wait_is_its_own_span(self):
+        release = asyncio.Event()
+
+        async def getone(request, id):
+            if id == '1':
+                await release.wait()
+            return Item(id=id, name='a')
+
+        traces = RingBufferExporter()
+        admission = AdmissionControl(shell=AdmissionLimit(max_in_flight=1, max_queue=1))
+        app = FastAPI()
+        app.include_router(ApiShell(Item, '/q', on_getone_callback=getone, tracer=Tracer(traces, sample_rate=1.0),
+                                    admission=admission).router)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test') as client:
+            first = asyncio.ensure_future(client.get('/q/api/1', headers={REQUEST_ID_HEADER: 'first'}))
+            await asyncio.sleep(0.02)
+            second = asyncio.ensure_future(client.get('/q/api/2', headers={REQUEST_ID_HEADER: 'second'}))
+            while admission.stats()['*']['queued'] == 0:
+                await asyncio.sleep(0.005)
+            await asyncio.sleep(0.05)
+            release.set()
+            await asyncio.gather(first, second)
+
+        queued = next(x for x in traces.traces() if x['request_id'] == 'second')
+        self.assertEqual(queued['status_code'], 200)
+        self.assertGreaterEqual(queued['spans_ms']['queue'], 40)
+        self.assertLess(queued['spans_ms']['validate'], 40)
+
+
+if __name__ == '__main__':
+    unittest.main()
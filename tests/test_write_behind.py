@@ -0,0 +1,72 @@
+import asyncio
+import unittest
+import httpx
+import pydantic
+from fastapi import FastAPI
+from coopapi import ApiShell, DuplicateException, WriteBehind
+from coopapi.payload_logging import PayloadLogConfig
+
+
+class Item(pydantic.BaseModel):
+    id: str
+    password: str = 'hunter2'
+
+
+class TestWriteBehind(unittest.IsolatedAsyncioTestCase):
+    def _shell(self, config: WriteBehind, fail_ids=(), log_config: PayloadLogConfig = None) -> ApiShell:
+        self.batches = []
+
+        async def post_many(request, items):
+            self.batches.append([x.id for x in items])
+            return [DuplicateException() if x.id in fail_ids else x for x in items]
+
+        self.shell = ApiShell(Item, '/w', on_post_many_callback=post_many, write_behind=config, log_config=log_config)
+        app = FastAPI()
+        app.include_router(self.shell.router)
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test')
+
+    async def test_posts_are_written_in_batches(self):
+        async with self._shell(WriteBehind(max_batch=4, max_latency_s=0.05), fail_ids={'3'}) as client:
+            rets = await asyncio.gather(*[client.post('/w/api/', json={'id': str(i)}) for i in range(10)])
+        self.assertEqual([x.status_code for x in rets], [409 if i == 3 else 201 for i in range(10)])
+        self.assertEqual(rets[0].json(), {'id': '0', 'password': 'hunter2'})
+        self.assertEqual(sorted(int(x) for batch in self.batches for x in batch), list(range(10)))
+        self.assertTrue(all(len(x) <= 4 for x in self.batches))
+        self.assertLess(len(self.batches), 10)
+        self.assertEqual(self.shell.post_batcher.stats(), {'pending': 0, 'batches': len(self.batches), 'items': 10, 'failed': 1})
+
+    async def test_latency_flushes_a_partial_batch(self):
+        async with self._shell(WriteBehind(max_batch=100, max_latency_s=0.01)) as client:
+            ret = await asyncio.wait_for(client.post('/w/api/', json={'id': '1'}), 1)
+        self.assertEqual(ret.status_code, 201)
+        self.assertEqual(self.batches, [['1']])
+
+    async def test_fire_and_forget(self):
+        async with self._shell(WriteBehind(max_latency_s=0.01, wait=False), fail_ids={'2'}) as client:
+            with self.assertLogs('WriteBehind', 'ERROR') as logs:
+                rets = await asyncio.gather(*[client.post('/w/api/', json={'id': str(i)}) for i in range(3)])
+                self.assertEqual([x.status_code for x in rets], [202] * 3)
+                await self.shell.post_batcher.close()
+        self.assertEqual(self.batches, [['0', '1', '2']])
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn("'id': '2'", logs.output[0])
+        self.assertNotIn('hunter2', logs.output[0])
+
+    async def test_full_queue_is_rejected(self):
+        async with self._shell(WriteBehind(max_latency_s=0.05, wait=False, max_pending=2, retry_after_s=3)) as client:
+            rets = await asyncio.gather(*[client.post('/w/api/', json={'id': str(i)}) for i in range(3)])
+            self.assertEqual([x.status_code for x in rets], [202, 202, 503])
+            self.assertEqual(rets[2].headers['retry-after'], '3')
+            await self.shell.post_batcher.close()
+        self.assertEqual(self.batches, [['0', '1']])
+
+    async def test_close_flushes_what_is_queued(self):
+        async with self._shell(WriteBehind(max_latency_s=10, wait=False)) as client:
+            await client.post('/w/api/', json={'id': '1'})
+            self.assertEqual(self.shell.post_batcher.pending, 1)
+            await self.shell.post_batcher.close()
+        self.assertEqual(self.batches, [['1']])
+
+
+if __name__ == '__main__':
+    unittest.main()